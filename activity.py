@@ -1006,6 +1006,10 @@ class SpeakActivity(activity.Activity):
             timeout = 100
         GLib.timeout_add(timeout, self._speak_the_text, entry, text)
 
+    def show_brain_progress(self, fraction):
+        # how much of the brain is loaded; 0 hides the progress
+        self._entry.set_progress_fraction(fraction)
+
     def _dismiss_OSK(self, entry):
         entry.hide()
         entry.show()
@@ -1022,7 +1026,7 @@ class SpeakActivity(activity.Activity):
 
             # speak the text
             if self._mode == MODE_BOT:
-                self.face.say(brain.respond(text))
+                brain.ask(text, self.face.say)
             else:
                 self.face.say(text)
 
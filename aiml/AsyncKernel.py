@@ -0,0 +1,115 @@
+"""This file contains the AsyncKernel, an asyncio front end for a Kernel
+(or a KernelPool).  It requires Python 3.7 or later."""
+
+import asyncio
+
+from .Kernel import Kernel
+
+_globalSessionID = Kernel._globalSessionID
+
+
+class AsyncKernel(object):
+    """Answer requests for a Kernel from an asyncio event loop.
+
+    respond() is a coroutine: the request is queued, and every
+    `batchWindow` seconds the queued requests are handed to an executor,
+    so the event loop never waits for the matcher.  Requests are always
+    answered in order within a session; requests of different sessions
+    may run in parallel if the backend allows it (a Kernel created with
+    concurrent=True, or a KernelPool, whose respondMany() receives each
+    batch in one call).
+
+    Identical inputs (up to whitespace) arriving in a row in the same
+    session within one batch window are treated as resubmissions of the
+    same request: the Kernel answers them once, and all of them get that
+    response.  An identical input following another input of the session
+    is answered on its own, after that one.
+
+    """
+
+    def __init__(self, kernel, executor=None, batchWindow=0.002):
+        self._kernel = kernel
+        self._executor = executor
+        self._batchWindow = batchWindow
+        self._pending = []      # (sessionID, key, input, future), in arrival order
+        self._flushHandle = None
+        self._tails = {}        # group key -> the last task run for that group
+        self._numRequests = 0
+        self._numCoalesced = 0
+
+    def numRequests(self):
+        """Return the number of requests received so far."""
+        return self._numRequests
+
+    def numCoalesced(self):
+        """Return the number of requests answered with the response to an
+        identical request."""
+        return self._numCoalesced
+
+    async def respond(self, input_, sessionID=_globalSessionID):
+        """Return the Kernel's response to the input string."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = u" ".join(input_.split())
+        self._pending.append((sessionID, key, input_, future))
+        self._numRequests += 1
+        if self._flushHandle is None:
+            self._flushHandle = loop.call_later(self._batchWindow, self._flush)
+        return await future
+
+    def _flush(self):
+        """Hand the queued requests over to the executor."""
+        self._flushHandle = None
+        pending, self._pending = self._pending, []
+        # Coalesce identical requests made in a row in the same session.
+        requests = []   # ((sessionID, key), (input, futures)), in arrival order
+        last = {}       # sessionID -> the latest of requests for that session
+        for sessionID, key, input_, future in pending:
+            request = last.get(sessionID)
+            if request is not None and request[0][1] == key:
+                request[1][1].append(future)
+                self._numCoalesced += 1
+            else:
+                request = last[sessionID] = ((sessionID, key), (input_, [future]))
+                requests.append(request)
+        # A KernelPool answers a whole batch at once; a Kernel gets one job
+        # per session.  The jobs of a group run after the previous job of
+        # the same group, which keeps each session's requests in order.
+        groups = {}
+        if hasattr(self._kernel, "respondMany"):
+            groups[None] = requests
+        else:
+            for item in requests:
+                groups.setdefault(item[0][0], []).append(item)
+        loop = asyncio.get_running_loop()
+        for group, items in groups.items():
+            task = loop.create_task(self._run(self._tails.get(group), items))
+            self._tails[group] = task
+            task.add_done_callback(lambda task, group=group: self._forget(group, task))
+
+    def _forget(self, group, task):
+        if self._tails.get(group) is task:
+            del self._tails[group]
+
+    def _respondMany(self, requests):
+        """Answer a list of (sessionID, input) pairs, in the executor."""
+        if hasattr(self._kernel, "respondMany"):
+            return self._kernel.respondMany(requests)
+        return [self._kernel.respond(input_, sessionID)
+                for sessionID, input_ in requests]
+
+    async def _run(self, previous, items):
+        if previous is not None:
+            await asyncio.wait([previous])
+        requests = [(sessionID, input_) for (sessionID, key), (input_, futures) in items]
+        loop = asyncio.get_running_loop()
+        try:
+            responses = await loop.run_in_executor(self._executor, self._respondMany, requests)
+        except Exception as e:
+            for key, (input_, futures) in items:
+                for future in futures:
+                    if not future.done(): future.set_exception(e)
+            return
+        for (key, (input_, futures)), response in zip(items, responses):
+            for future in futures:
+                if not future.done(): future.set_result(response)
@@ -0,0 +1,228 @@
+"""This file contains functions to build a Kernel's brain from AIML files
+parsed in parallel, in the worker processes of a multiprocessing pool.
+
+Parsing is by far the most expensive part of learning an AIML file, and
+each file can be parsed on its own.  The categories are then added to the
+brain in the main process, in the order of the files, so that a category
+defined in several files ends up with the template of the last one, just
+as with Kernel.learn().
+
+Typical use:
+
+    pool = multiprocessing.Pool()
+    k = aiml.Kernel()
+    BrainBuilder.learn(k, sorted(glob.glob("alice/*.aiml")), pool)
+
+To build several brains at once, submit() the files of each of them to
+the same pool first, and merge() them afterwards.
+
+A brain can also be kept up to date incrementally.  Its manifest records
+the hash of every AIML file and the categories the file contributed; when
+some files change, submitUpdate() and mergeUpdate() parse only those, and
+replace their categories in the brain.
+"""
+
+from __future__ import print_function
+
+import hashlib
+import io
+import json
+import sys
+import time
+import xml.sax
+
+from .AimlParser import create_parser
+from .constants import *
+
+
+def _parse(filename, textEncoding, parser="sax"):
+    """Parse an AIML file.  Runs in a worker process.
+
+    Returns a tuple (categories, seconds, error): the list of the file's
+    (pattern/that/topic tuple, template) pairs, the time spent parsing it
+    and None if the file was parsed successfully, or an error message.
+    Like Kernel.learn(), a file with malformed XML still yields the
+    categories read before the error.
+    """
+    start = time.time()
+    aimlParser = create_parser(parser)
+    handler = aimlParser.getContentHandler()
+    handler.setEncoding(textEncoding)
+    error = None
+    try: aimlParser.parse(filename)
+    except xml.sax.SAXParseException as msg:
+        error = str(msg)
+    return list(handler.categories.items()), time.time() - start, error
+
+
+def submit(pool, filenames, textEncoding=None, parser="sax"):
+    """Start parsing the AIML files in the pool's workers, and return a
+    job to pass to merge().  parser selects the AIML parser, as in
+    Kernel.learn()."""
+    return [(f, pool.apply_async(_parse, (f, textEncoding, parser))) for f in filenames]
+
+
+def _results(job):
+    """Yield the filename and parse results of each file of a job, in
+    order.  The job is emptied as it goes, so that the results don't
+    outlive the merge: they hold every template of the files."""
+    job.reverse()
+    while job:
+        f, result = job.pop()
+        yield f, result.get()
+
+
+def merge(kernel, job):
+    """Wait for the files of a job returned by submit() and add their
+    categories to the kernel's brain, in file order.
+
+    Returns a list with a (filename, categories, parseSeconds,
+    mergeSeconds) tuple for every file that was parsed successfully.  The
+    categories read before a parse error are merged too, as learn() does,
+    but the file isn't reported.  A job can only be merged once.
+    """
+    report = []
+    for f, (categories, parseTime, error) in _results(job):
+        start = time.time()
+        brain = kernel._brain
+        for key, tem in categories:
+            brain.add(key, tem)
+        mergeTime = time.time() - start
+        if error is not None:
+            err = "\nFATAL PARSE ERROR in file %s:\n%s\n" % (f, error)
+            sys.stderr.write(err)
+            continue
+        if kernel._verboseMode:
+            print( "Loaded %s: %d categories (parsed in %.2f, merged in %.2f seconds)" % (
+                f, len(categories), parseTime, mergeTime) )
+        report.append((f, len(categories), parseTime, mergeTime))
+    return report
+
+
+def learn(kernel, filenames, pool, parser="sax"):
+    """Learn the AIML files, parsing them in the pool's workers.  Like
+    calling kernel.learn() on each file in turn.  Returns the report of
+    merge()."""
+    return merge(kernel, submit(pool, filenames, kernel._textEncoding, parser))
+
+
+def fileHash(filename):
+    """Return the SHA-1 hash of a file's contents, in hex."""
+    with open(filename, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def loadManifest(filename):
+    """Load a manifest saved by saveManifest().
+
+    A manifest is a list of (filename, hash, keys) tuples, in file order,
+    where keys lists the pattern/that/topic tuples of the categories
+    defined in the file.  Returns an empty manifest if the file can't be
+    read.
+    """
+    try:
+        with io.open(filename, encoding="utf-8") as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return []
+    return [(name, h, [tuple(key) for key in keys]) for name, h, keys in data]
+
+
+def saveManifest(filename, manifest):
+    """Save a manifest returned by mergeUpdate()."""
+    data = json.dumps([[name, h, [list(key) for key in keys]] for name, h, keys in manifest])
+    with io.open(filename, "w", encoding="utf-8") as f:
+        f.write(unicode(data))
+
+
+def submitUpdate(pool, filenames, manifest, textEncoding=None, parser="sax"):
+    """Start parsing the AIML files that changed since the manifest was
+    made, and return a job to pass to mergeUpdate().
+
+    The brain the job will update must be the one built along with the
+    manifest; with an empty manifest, it must be empty.
+    """
+    old = dict((name, h) for name, h, keys in manifest)
+    hashes = [(f, fileHash(f)) for f in filenames]
+    changed = [f for f, h in hashes if old.get(f) != h]
+    return (manifest, hashes, submit(pool, changed, textEncoding, parser), (textEncoding, parser))
+
+
+def mergeUpdate(kernel, job):
+    """Update the kernel's brain with the files of a job returned by
+    submitUpdate().
+
+    The categories of the changed and deleted files are removed from the
+    brain or replaced, unless a later file defines them too.  Returns a
+    tuple (manifest, report): the new manifest, and the report of merge()
+    for the changed files.  A job can only be merged once.
+
+    A file that fails to parse contributes the categories read before
+    the error, as with learn(), and is recorded in the manifest without
+    a hash, so that the next update parses it again.
+    """
+    manifest, hashes, parseJob, parseArgs = job
+    oldKeys = dict((name, keys) for name, h, keys in manifest)
+    templates = {}      # changed file -> {key: template}
+    failed = set()      # files that couldn't be parsed
+    report = []
+    for f, (categories, parseTime, error) in _results(parseJob):
+        if error is not None:
+            err = "\nFATAL PARSE ERROR in file %s:\n%s\n" % (f, error)
+            sys.stderr.write(err)
+            failed.add(f)
+        templates[f] = dict(categories)
+        report.append((f, len(categories), parseTime, 0.0))
+    newKeys = dict((f, list(templates[f]) if f in templates else oldKeys[f])
+                   for f, h in hashes)
+
+    # The categories that may change hands: those of the files that
+    # changed, before and after, and those of the deleted files.
+    affected = set()
+    for f, keys in oldKeys.items():
+        if f in templates or f not in newKeys:
+            affected.update(keys)
+    for f in templates:
+        affected.update(newKeys[f])
+    # The last file defining a category owns it.
+    def owners(files, keysByFile):
+        owner = {}
+        for f in files:
+            for key in keysByFile[f]:
+                if key in affected:
+                    owner[key] = f
+        return owner
+    oldOwner = owners([name for name, h, keys in manifest], oldKeys)
+    newOwner = owners([f for f, h in hashes], newKeys)
+
+    start = time.time()
+    brain = kernel._brain
+    reparse = {}        # unchanged file -> keys it now owns
+    for key in affected:
+        f = newOwner.get(key)
+        if f is None:
+            brain.remove(key)
+        elif f in templates:
+            brain.add(key, templates[f][key])
+        elif f != oldOwner.get(key):
+            # An unchanged file's definition is no longer overridden.
+            reparse.setdefault(f, []).append(key)
+    for f, keys in reparse.items():
+        categories, parseTime, error = _parse(f, *parseArgs)
+        if error is not None:
+            err = "\nFATAL PARSE ERROR in file %s:\n%s\n" % (f, error)
+            sys.stderr.write(err)
+            failed.add(f)
+        categories = dict(categories)
+        for key in keys:
+            if key in categories:
+                brain.add(key, categories[key])
+            else:
+                brain.remove(key)
+    if kernel._verboseMode:
+        for f, n, parseTime, mergeTime in report:
+            print( "Updated %s: %d categories (parsed in %.2f seconds)" % (f, n, parseTime) )
+        for f in sorted(set(oldKeys) - set(newKeys)):
+            print( "Removed %s" % f )
+        print( "%d categories updated in %.2f seconds" % (len(affected), time.time() - start) )
+    return [(f, h if f not in failed else None, newKeys[f]) for f, h in hashes], report
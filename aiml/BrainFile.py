@@ -0,0 +1,485 @@
+'''
+Reading and writing of brain files.
+
+There are two formats, both starting with a header that records the
+format version, the marshal version the file was written with, and a
+CRC-32 checksum, so that a file written by an incompatible Python, or
+damaged, can be rejected (see validate()) before anything is built from
+it.  Files saved by older versions of PyAIML have no header (plain
+marshal) or an older one, and are still read.
+
+A mapped brain file holds the flat arrays of a CompiledPatternMgr exactly as
+they are laid out in memory, so that the pattern index can be used right
+after the file is mmap()ed.  Each template is marshalled on its own and is
+only decoded the first time a match returns it.
+
+Parts of templates (elements and attribute dictionaries) that several
+templates hold as the same object, as they do once the brain has been
+through PatternMgr.internTemplates(), are stored only once: they are
+marshalled in a table of their own, and replaced by their index in that
+table where they appear.  Decoding puts the shared objects back.
+
+Layout (all integers little-endian):
+
+    magic          8 bytes, MAGIC
+    version        uint32
+    numSections    uint32
+    marshalVersion uint32
+    pythonVersion  2 * uint16, major and minor
+    checksum       uint32, CRC-32 of the rest of the file
+    sections       numSections * (uint64 offset, uint64 length)
+    ...            section contents, each aligned to 8 bytes
+
+The sections are, in order: META (marshalled (templateCount, botName)),
+WORDS (marshalled list of words), CHILD_START, CHILD_KEYS, CHILD_NODES,
+NODE_TEMPLATE (int32 arrays), TEMPLATE_OFFSETS (uint32 array, relative to
+the start of TEMPLATES), TEMPLATES (concatenated marshalled templates),
+SHARED_OFFSETS and SHARED (the same for the shared parts).  Version 1
+files have no shared parts, and only the first eight sections; versions
+1 and 2 have neither marshal and Python versions nor a checksum.
+
+A tree brain file holds the node tree of a PatternMgr, marshalled and
+optionally compressed with zlib or lzma:
+
+    magic          8 bytes, TREE_MAGIC
+    version        uint32
+    method         uint32, NONE, ZLIB or LZMA
+    marshalVersion uint32
+    pythonVersion  2 * uint16, major and minor
+    templateCount  uint32
+    botNameLength  uint32
+    payloadLength  uint64, the size of the marshalled tree
+    dataLength     uint64, the size of the tree as stored
+    checksum       uint32, CRC-32 of the tree as stored
+    botName        botNameLength bytes, UTF-8
+    ...            the tree as stored
+'''
+
+from __future__ import print_function
+
+import marshal
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+try:
+    import lzma
+except ImportError:     # Python 2
+    lzma = None
+
+from .constants import *
+
+MAGIC = b"AIMLMMAP"
+VERSION = 3
+
+META, WORDS, CHILD_START, CHILD_KEYS, CHILD_NODES, NODE_TEMPLATE, \
+    TEMPLATE_OFFSETS, TEMPLATES, SHARED_OFFSETS, SHARED = range(10)
+_NUM_SECTIONS = {1: 8, 2: 10, 3: 10}  # by version
+
+# An index into the shared table only pays off for parts whose marshalled
+# size is larger than this.
+_MIN_SHARED_SIZE = 8
+
+_HEADER = struct.Struct("<8sII")
+_INFO = struct.Struct("<IHHI")      # follows _HEADER from version 3 on
+_SECTION = struct.Struct("<QQ")
+_ALIGN = 8
+
+
+TREE_MAGIC = b"AIMLTREE"
+TREE_VERSION = 1
+NONE, ZLIB, LZMA = 0, 1, 2
+_METHODS = {None: NONE, "zlib": ZLIB, "lzma": LZMA}
+_TREE_HEADER = struct.Struct("<8sIIIHHIIQQI")
+_CHUNK_SIZE = 1 << 18
+
+
+class BrainFileError(Exception):
+    pass
+
+
+def isBrainFile(filename):
+    """Return True if filename is a memory-mapped brain file."""
+    with open(filename, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def isTreeFile(filename):
+    """Return True if filename is a tree brain file."""
+    with open(filename, "rb") as f:
+        return f.read(len(TREE_MAGIC)) == TREE_MAGIC
+
+
+def _checkVersions(filename, marshalVersion, major, minor):
+    if marshalVersion > marshal.version:
+        raise BrainFileError("%s was written with marshal version %d, this Python only reads up to %d"
+                             % (filename, marshalVersion, marshal.version))
+    # Python 2 and 3 marshal strings as different types.
+    if major != sys.version_info[0]:
+        raise BrainFileError("%s was written by Python %d.%d, it can't be read by Python %d"
+                             % (filename, major, minor, sys.version_info[0]))
+
+
+class TemplateTable(object):
+    """A read-only sequence of templates, decoded on first access.
+
+    shared is the TemplateTable of the shared parts the templates refer
+    to, if any.
+    """
+
+    def __init__(self, offsets, data, shared=None):
+        self._offsets = offsets
+        self._data = data
+        self._shared = shared
+        self._decoded = {}
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        try: return self._decoded[i]
+        except KeyError:
+            if not 0 <= i < len(self):
+                raise IndexError("template index out of range")
+            template = marshal.loads(self._data[self._offsets[i]:self._offsets[i+1]])
+            if self._shared is not None:
+                _resolve(template, self._shared)
+            self._decoded[i] = template
+            return template
+
+    def numDecoded(self):
+        """Return the number of templates decoded so far."""
+        return len(self._decoded)
+
+
+def _resolve(obj, shared):
+    """Replace the shared table indices found in a decoded element (or
+    attribute dictionary) with the shared parts."""
+    if isinstance(obj, dict):
+        return
+    if isinstance(obj[1], int):
+        obj[1] = shared[obj[1]]
+    for i in range(2, len(obj)):
+        if isinstance(obj[i], int):
+            obj[i] = shared[obj[i]]
+        elif isinstance(obj[i], list):
+            _resolve(obj[i], shared)
+
+
+def _sharedParts(templates):
+    """Return the set of the ids of the elements and attribute
+    dictionaries that appear more than once in templates, and are worth
+    storing once."""
+    parts = {}      # id -> part
+    repeated = set()
+    stack = list(templates)
+    while stack:
+        elem = stack.pop()
+        for part in [elem[1]] + [e for e in elem[2:] if isinstance(e, list)]:
+            if id(part) in parts:
+                repeated.add(id(part))
+            else:
+                parts[id(part)] = part
+                if isinstance(part, list):
+                    stack.append(part)
+    return set(i for i in repeated if len(marshal.dumps(parts[i])) > _MIN_SHARED_SIZE)
+
+
+def _encode(elem, shared, indices, table):
+    """Return a copy of elem where the parts whose ids are in shared are
+    replaced by their index in table, adding them to it as needed."""
+    def ref(part):
+        if id(part) not in shared:
+            return part if isinstance(part, dict) else _encode(part, shared, indices, table)
+        try: return indices[id(part)]
+        except KeyError:
+            # Reserve the slot first: the part may itself hold shared parts.
+            i = indices[id(part)] = len(table)
+            table.append(None)
+            table[i] = part if isinstance(part, dict) else _encode(part, shared, indices, table)
+            return i
+    return [elem[0], ref(elem[1])] + [ref(e) if isinstance(e, list) else e for e in elem[2:]]
+
+
+def _intArray(buf, typecode):
+    """Return buf as a sequence of 32-bit integers, without copying it if
+    the platform allows."""
+    if sys.byteorder == "little":
+        try: return memoryview(buf).cast(typecode)
+        except AttributeError: pass     # Python 2
+    a = array(typecode)
+    if PY3: a.frombytes(bytes(buf))
+    else: a.fromstring(bytes(buf))
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a
+
+
+def _bytes(a):
+    """Return the little-endian contents of an integer array."""
+    if sys.byteorder != "little":
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tostring() if not PY3 else a.tobytes()
+
+
+def _marshalAll(objects):
+    """Marshal each object; return the offsets and the marshalled blobs."""
+    offsets = array("I", [0])
+    blobs = []
+    for obj in objects:
+        blob = marshal.dumps(obj)
+        blobs.append(blob)
+        offsets.append(offsets[-1] + len(blob))
+    return offsets, blobs
+
+
+def write(filename, templateCount, botName, words, childStart, childKeys,
+          childNodes, nodeTemplate, templates):
+    """Write the arrays of a compiled pattern tree to filename."""
+    shared = _sharedParts(templates)
+    indices = {}        # id(shared part) -> index in table
+    table = []
+    encoded = [_encode(template, shared, indices, table) for template in templates]
+    offsets, blobs = _marshalAll(encoded)
+    sharedOffsets, sharedBlobs = _marshalAll(table)
+    sections = [
+        marshal.dumps((templateCount, botName)),
+        marshal.dumps(list(words)),
+        _bytes(array("i", childStart)),
+        _bytes(array("i", childKeys)),
+        _bytes(array("i", childNodes)),
+        _bytes(array("i", nodeTemplate)),
+        _bytes(offsets),
+        b"".join(blobs),
+        _bytes(sharedOffsets),
+        b"".join(sharedBlobs),
+    ]
+    # Work out where each section goes.
+    pos = _HEADER.size + _INFO.size + _SECTION.size * len(sections)
+    table = []
+    chunks = []
+    for s in sections:
+        padding = -pos % _ALIGN
+        chunks += [b"\0" * padding, s]
+        pos += padding
+        table.append((pos, len(s)))
+        pos += len(s)
+    chunks[:0] = [_SECTION.pack(offset, length) for offset, length in table]
+    checksum = 0
+    for chunk in chunks:
+        checksum = zlib.crc32(chunk, checksum)
+    with open(filename, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(sections)))
+        f.write(_INFO.pack(marshal.version, sys.version_info[0], sys.version_info[1],
+                           checksum & 0xffffffff))
+        for chunk in chunks:
+            f.write(chunk)
+
+
+def _mapSections(data, filename, verify):
+    """Check the header of the mapped brain file in data, and return its
+    version and the list of its sections.  If verify is true, check the
+    checksum too, which reads the whole file."""
+    if len(data) < _HEADER.size:
+        raise BrainFileError("%s is too short to be a brain file" % filename)
+    magic, version, numSections = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise BrainFileError("%s is not a mapped brain file" % filename)
+    if numSections != _NUM_SECTIONS.get(version):
+        raise BrainFileError("%s has unsupported version %d" % (filename, version))
+    tableStart = _HEADER.size
+    if version >= 3:
+        tableStart += _INFO.size
+        if len(data) < tableStart:
+            raise BrainFileError("%s is truncated" % filename)
+        marshalVersion, major, minor, checksum = _INFO.unpack_from(data, _HEADER.size)
+        _checkVersions(filename, marshalVersion, major, minor)
+        if verify and zlib.crc32(memoryview(data)[tableStart:]) & 0xffffffff != checksum:
+            raise BrainFileError("%s is corrupted (bad checksum)" % filename)
+    if len(data) < tableStart + numSections * _SECTION.size:
+        raise BrainFileError("%s is truncated" % filename)
+    table = [_SECTION.unpack_from(data, tableStart + i * _SECTION.size) for i in range(numSections)]
+    if any(offset + length > len(data) for offset, length in table):
+        raise BrainFileError("%s is truncated" % filename)
+    # No views are made before the checks are done: the file can't be
+    # closed while an exception holds one.
+    view = memoryview(data)
+    return version, [view[offset:offset+length] for offset, length in table]
+
+
+def read(filename, verify=False):
+    """Map filename into memory.
+
+    Returns a tuple (templateCount, botName, words, childStart, childKeys,
+    childNodes, nodeTemplate, templates).  The integer arrays are views
+    into the mapped file and templates is a TemplateTable.
+
+    The header and the layout are always checked, which costs nothing;
+    the checksum only if verify is true, since that reads the whole file.
+    """
+    with open(filename, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    version, sections = _mapSections(data, filename, verify)
+    templateCount, botName = marshal.loads(sections[META])
+    words = marshal.loads(sections[WORDS])
+    shared = None
+    if version >= 2:
+        shared = TemplateTable(_intArray(sections[SHARED_OFFSETS], "I"), sections[SHARED])
+        shared._shared = shared     # shared parts may hold shared parts
+    templates = TemplateTable(_intArray(sections[TEMPLATE_OFFSETS], "I"),
+                              sections[TEMPLATES], shared)
+    return (templateCount, botName, words,
+            _intArray(sections[CHILD_START], "i"),
+            _intArray(sections[CHILD_KEYS], "i"),
+            _intArray(sections[CHILD_NODES], "i"),
+            _intArray(sections[NODE_TEMPLATE], "i"),
+            templates)
+
+
+# What a decompressor raises on damaged data.
+_DECOMPRESS_ERRORS = (zlib.error,) if lzma is None else (zlib.error, lzma.LZMAError)
+
+
+def _decompressor(method):
+    if method == ZLIB:
+        return zlib.decompressobj()
+    if method == LZMA and lzma is not None:
+        return lzma.LZMADecompressor()
+    raise BrainFileError("unsupported compression method %d" % method)
+
+
+def writeTree(filename, templateCount, botName, root, compress=None):
+    """Write the node tree of a PatternMgr to filename, compressed with
+    compress ("zlib" or "lzma") or not at all (None)."""
+    if compress not in _METHODS or (compress == "lzma" and lzma is None):
+        raise ValueError("unsupported compression method: %s" % compress)
+    payload = marshal.dumps(root)
+    if compress == "zlib":
+        data = zlib.compress(payload, 6)
+    elif compress == "lzma":
+        data = lzma.compress(payload)
+    else:
+        data = payload
+    name = botName.encode("utf-8")
+    with open(filename, "wb") as f:
+        f.write(_TREE_HEADER.pack(TREE_MAGIC, TREE_VERSION, _METHODS[compress],
+                                  marshal.version, sys.version_info[0], sys.version_info[1],
+                                  templateCount, len(name), len(payload), len(data),
+                                  zlib.crc32(data) & 0xffffffff))
+        f.write(name)
+        f.write(data)
+
+
+def _readTreeHeader(f, filename):
+    """Read and check the header of a tree brain file.  Returns a tuple
+    (method, templateCount, botName, payloadLength, dataLength,
+    checksum)."""
+    header = f.read(_TREE_HEADER.size)
+    if len(header) < _TREE_HEADER.size:
+        raise BrainFileError("%s is too short to be a brain file" % filename)
+    (magic, version, method, marshalVersion, major, minor, templateCount,
+     nameLength, payloadLength, dataLength, checksum) = _TREE_HEADER.unpack(header)
+    if magic != TREE_MAGIC:
+        raise BrainFileError("%s is not a tree brain file" % filename)
+    if version != TREE_VERSION:
+        raise BrainFileError("%s has unsupported version %d" % (filename, version))
+    _checkVersions(filename, marshalVersion, major, minor)
+    if method == NONE and payloadLength != dataLength:
+        raise BrainFileError("%s is corrupted" % filename)
+    name = f.read(nameLength)
+    # Catch truncated files before reading any further.
+    f.seek(0, 2)
+    if f.tell() != _TREE_HEADER.size + nameLength + dataLength:
+        raise BrainFileError("%s is truncated" % filename)
+    f.seek(_TREE_HEADER.size + nameLength)
+    return method, templateCount, name.decode("utf-8"), payloadLength, dataLength, checksum
+
+
+def readTreeHeader(filename):
+    """Return the (templateCount, botName) recorded in the header of a
+    tree brain file, without reading the tree."""
+    with open(filename, "rb") as f:
+        header = _readTreeHeader(f, filename)
+    return header[1], header[2]
+
+
+def readTree(filename, progress=None):
+    """Read a tree brain file.  Returns a tuple (templateCount, botName,
+    root).  progress, if given, is called with (bytesRead, fileSize) after
+    every chunk read.
+
+    The stored tree is read a chunk at a time, checksummed and (if
+    compressed) decompressed straight into a buffer of the size recorded
+    in the header, which is then unmarshalled in one go: much faster than
+    letting marshal pull the data through a decompressing file object.
+    Nothing is unmarshalled unless the checksum is right.
+    """
+    with open(filename, "rb") as f:
+        method, templateCount, botName, payloadLength, dataLength, checksum = \
+            _readTreeHeader(f, filename)
+        decompressor = _decompressor(method) if method != NONE else None
+        payload = bytearray(payloadLength)
+        pos = 0
+        crc = 0
+        bytesRead = f.tell()
+        fileSize = bytesRead + dataLength
+        while True:
+            chunk = f.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            bytesRead += len(chunk)
+            if progress is not None:
+                progress(bytesRead, fileSize)
+            crc = zlib.crc32(chunk, crc)
+            try:
+                data = decompressor.decompress(chunk) if decompressor else chunk
+            except _DECOMPRESS_ERRORS as e:
+                raise BrainFileError("%s is corrupted (%s)" % (filename, e))
+            if pos + len(data) > payloadLength:
+                raise BrainFileError("%s is corrupted" % filename)
+            payload[pos:pos+len(data)] = data
+            pos += len(data)
+    if crc & 0xffffffff != checksum or pos != payloadLength:
+        raise BrainFileError("%s is corrupted (bad checksum)" % filename)
+    return templateCount, botName, marshal.loads(payload if PY3 else bytes(payload))
+
+
+def validate(filename):
+    """Check a brain file without loading it: its format version, the
+    marshal version it was written with, its size and its checksum.
+
+    Raises BrainFileError if the file can't be loaded by this Python.
+    Returns False for plain marshal files (saved by older versions of
+    PyAIML), which have nothing to check, and True otherwise.
+    """
+    with open(filename, "rb") as f:
+        magic = f.read(len(MAGIC))
+        if magic == TREE_MAGIC:
+            f.seek(0)
+            method, templateCount, botName, payloadLength, dataLength, checksum = \
+                _readTreeHeader(f, filename)
+            if method != NONE:
+                _decompressor(method)   # is the method supported?
+            crc = 0
+            while True:
+                chunk = f.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+            if crc & 0xffffffff != checksum:
+                raise BrainFileError("%s is corrupted (bad checksum)" % filename)
+            return True
+        if magic != MAGIC:
+            return False
+        if not os.fstat(f.fileno()).st_size:
+            raise BrainFileError("%s is too short to be a brain file" % filename)
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        _mapSections(data, filename, True)
+    finally:
+        data.close()
+    return True
@@ -0,0 +1,290 @@
+'''
+A memory-compact variant of the PatternMgr.
+
+Instead of a tree of nested dictionaries, the pattern tree is stored as a
+handful of flat arrays: every distinct word is interned to an integer id,
+the children of each node are kept sorted in one shared array (and found
+with a binary search), and templates live in a separate table.  Matching
+semantics are exactly those of the dictionary-based PatternMgr.
+'''
+
+from __future__ import print_function
+
+import bisect
+import copy
+import os
+import pprint
+import threading
+from array import array
+
+from .constants import *
+from . import BrainFile
+from . import Utils
+from .PatternMgr import PatternMgr
+
+
+class CompiledPatternMgr(PatternMgr):
+    # Words are interned to integer ids.  The special dictionary keys of
+    # PatternMgr (all smaller than _FIRST_WORD) keep their own values.
+    _FIRST_WORD = 6
+    _NO_TEMPLATE = -1
+
+    def __init__(self):
+        PatternMgr.__init__(self)
+        self._clearCompiled()
+        # The dictionary tree is only kept while patterns are being added.
+        # It is compiled into the flat arrays the next time it's needed.
+        self._root = 0
+        self._editing = False
+        # Several threads may try to compile the tree on their first match.
+        self._freezeLock = threading.Lock()
+
+    def _clearCompiled(self):
+        self._words = []        # word id - _FIRST_WORD -> word
+        self._wordIds = {}      # word -> word id
+        self._childStart = array('i', [0, 0])  # children of node n are in [start[n], start[n+1])
+        self._childKeys = array('i')
+        self._childNodes = array('i')
+        self._nodeTemplate = array('i', [self._NO_TEMPLATE])
+        self._templates = []
+
+    def numNodes(self):
+        """Return the number of nodes in the compiled pattern tree."""
+        self._freeze()
+        return len(self._nodeTemplate)
+
+    def dump(self):
+        """Print all learned patterns, for debugging purposes."""
+        pprint.pprint(self._root if self._editing else self._tree())
+
+    def save(self, filename, compress=None):
+        """Dump the current patterns to the file specified by filename.  The
+        file format is the same one used by PatternMgr.
+        """
+        tree = self._root if self._editing else self._tree()
+        saved = self._root
+        self._root = tree
+        try:
+            PatternMgr.save(self, filename, compress)
+        finally:
+            self._root = saved
+
+    def saveMapped(self, filename):
+        """Dump the current patterns to filename as a memory-mapped brain
+        file (see the BrainFile module).  To restore later, use restore().
+        """
+        self._freeze()
+        try:
+            BrainFile.write(filename, self._templateCount, self._botName,
+                            self._words, self._childStart, self._childKeys,
+                            self._childNodes, self._nodeTemplate,
+                            self._templates)
+        except Exception as e:
+            print( "Error saving PatternMgr to file %s:" % filename )
+            raise
+
+    def restore(self, filename, progress=None):
+        """Restore a previously save()d or saveMapped() collection of
+        patterns.
+
+        Mapped brain files are not read into memory: the pattern index is
+        used straight from the mapped file, and templates are decoded the
+        first time they are matched.  progress is called as by
+        PatternMgr.restore(); for a mapped file, only once it's mapped.
+        """
+        if not BrainFile.isBrainFile(filename):
+            self._editing = True
+            PatternMgr.restore(self, filename, progress)
+            self._freeze()
+            return
+        self._clearCompiled()
+        (self._templateCount, self._botName, self._words, self._childStart,
+         self._childKeys, self._childNodes, self._nodeTemplate,
+         self._templates) = BrainFile.read(filename)
+        if progress is not None:
+            size = os.path.getsize(filename)
+            progress(size, size)
+        self._wordIds = dict(zip(self._words, range(self._FIRST_WORD, self._FIRST_WORD + len(self._words))))
+        self._root = 0
+        self._editing = False
+        self._matchCache.clear()
+
+    def copyPatterns(self, patternMgr):
+        """Replace the current patterns with those of a dictionary-based
+        PatternMgr.  The templates themselves are shared, not copied.
+        """
+        self._templateCount = patternMgr.numTemplates()
+        self._botName = patternMgr._botName
+        self._root = patternMgr._root
+        self._editing = True
+        self._freeze()
+        self._matchCache.clear()
+
+    def share(self):
+        """Return a CompiledPatternMgr using the pattern arrays and the
+        templates of this one, with its own bot name and match cache.
+        Neither may learn or forget patterns afterwards.
+        """
+        self._freeze()
+        brain = copy.copy(self)
+        brain._matchCache = Utils.LRUCache(self._matchCacheSize)
+        return brain
+
+    def add(self, data, template):
+        """Add a [pattern/that/topic] tuple and its corresponding template
+        to the node tree.
+        """
+        self._thaw()
+        PatternMgr.add(self, data, template)
+
+    def remove(self, data):
+        """Remove the category stored for the exact [pattern/that/topic]
+        tuple. See PatternMgr.remove() for details.
+        """
+        if not self._editing and self.lookup(data) is None:
+            return None
+        self._thaw()
+        return PatternMgr.remove(self, data)
+
+    def internTemplates(self):
+        """Make identical templates, and identical parts of templates,
+        share the same objects. See PatternMgr.internTemplates() for
+        details.
+        """
+        self._thaw()
+        return PatternMgr.internTemplates(self)
+
+    def match(self, pattern, that, topic):
+        """Return a Match for the template which is the closest match to
+        pattern. See PatternMgr.match() for details.
+        """
+        self._freeze()
+        return PatternMgr.match(self, pattern, that, topic)
+
+    def lookup(self, data):
+        """Return the template stored for the exact [pattern/that/topic]
+        tuple. See PatternMgr.lookup() for details.
+        """
+        self._freeze()
+        return PatternMgr.lookup(self, data)
+
+    def categories(self):
+        """Yield a (pattern, that, topic, template) tuple for every stored
+        category. See PatternMgr.categories() for details.
+        """
+        self._freeze()
+        return PatternMgr.categories(self)
+
+    def contextFreeMatch(self, pattern):
+        """Return the template that pattern matches whatever the 'that'
+        and topic are. See PatternMgr.contextFreeMatch() for details.
+        """
+        self._freeze()
+        return PatternMgr.contextFreeMatch(self, pattern)
+
+    def _freeze(self):
+        """Compile the dictionary tree (if there is one) into flat arrays."""
+        if not self._editing:
+            return
+        with self._freezeLock:
+            if self._editing:
+                self._compile()
+
+    def _compile(self):
+        tree = self._root
+        self._clearCompiled()
+        childStart = self._childStart = array('i', [0])
+        childKeys = self._childKeys
+        childNodes = self._childNodes
+        nodeTemplate = self._nodeTemplate = array('i')
+        # Breadth-first traversal, so that the children of every node are
+        # numbered (and stored) contiguously.
+        queue = [tree]
+        numNodes = 1
+        templateIds = {}    # id(template) -> index in self._templates
+        for node in queue:
+            if self._TEMPLATE in node:
+                # Categories sharing a template object share its entry.
+                template = node[self._TEMPLATE]
+                try: nodeTemplate.append(templateIds[id(template)])
+                except KeyError:
+                    templateIds[id(template)] = len(self._templates)
+                    nodeTemplate.append(len(self._templates))
+                    self._templates.append(template)
+            else:
+                nodeTemplate.append(self._NO_TEMPLATE)
+            children = sorted((self._keyId(key), child)
+                              for key, child in node.items()
+                              if key != self._TEMPLATE)
+            for keyId, child in children:
+                childKeys.append(keyId)
+                childNodes.append(numNodes)
+                queue.append(child)
+                numNodes += 1
+            childStart.append(len(childKeys))
+        self._root = 0
+        self._editing = False
+
+    def _thaw(self):
+        """Turn the compiled arrays back into an editable dictionary tree."""
+        if self._editing:
+            return
+        self._root = self._tree()
+        self._clearCompiled()
+        self._editing = True
+
+    def _tree(self):
+        """Return the compiled arrays as a PatternMgr dictionary tree."""
+        nodes = [{} for i in range(len(self._nodeTemplate))]
+        for n, node in enumerate(nodes):
+            if self._nodeTemplate[n] != self._NO_TEMPLATE:
+                node[self._TEMPLATE] = self._templates[self._nodeTemplate[n]]
+            for i in range(self._childStart[n], self._childStart[n+1]):
+                node[self._keyName(self._childKeys[i])] = nodes[self._childNodes[i]]
+        return nodes[0]
+
+    def _keyId(self, key):
+        """Return the integer id for a dictionary key, interning words."""
+        if isinstance(key, int):
+            return key
+        try: return self._wordIds[key]
+        except KeyError:
+            keyId = self._wordIds[key] = len(self._words) + self._FIRST_WORD
+            self._words.append(key)
+            return keyId
+
+    def _keyName(self, keyId):
+        """Return the dictionary key for an integer id."""
+        if keyId < self._FIRST_WORD:
+            return keyId
+        return self._words[keyId - self._FIRST_WORD]
+
+    def _nodeKey(self, node):
+        """Return a hashable value identifying node."""
+        return node
+
+    def _keys(self, node):
+        """Return the key ids of the children of node."""
+        return list(self._childKeys[self._childStart[node]:self._childStart[node+1]])
+
+    def _wordKeys(self, words):
+        """Return the ids of the words, with None for words that no pattern
+        contains."""
+        wordIds = self._wordIds
+        return [wordIds.get(w) for w in words]
+
+    def _child(self, node, keyId):
+        """Return the child of node reached through keyId, or None."""
+        lo = self._childStart[node]
+        hi = self._childStart[node+1]
+        i = bisect.bisect_left(self._childKeys, keyId, lo, hi)
+        if i < hi and self._childKeys[i] == keyId:
+            return self._childNodes[i]
+        return None
+
+    def _template(self, node):
+        """Return the template stored at node, or None."""
+        t = self._nodeTemplate[node]
+        if t == self._NO_TEMPLATE:
+            return None
+        return self._templates[t]
@@ -3,7 +3,6 @@
 
 from __future__ import print_function
 
-import copy
 import glob
 import os
 import random
@@ -20,10 +19,15 @@ except ImportError:
     from configparser import ConfigParser
 
 from .constants import *
+from . import BrainFile
 from . import DefaultSubs
 from . import Utils
-from .AimlParser import create_parser
+from .AimlParser import iterCategories
 from .PatternMgr import PatternMgr
+from .Session import SessionView
+from .SessionStore import MemorySessionStore
+from .TemplateCompiler import TemplateCompiler
+from .CompiledPatternMgr import CompiledPatternMgr
 from .WordSub import WordSub
 
 
@@ -47,23 +51,60 @@ def msg_encoder(encoding=None):
 class Kernel:
     # module constants
     _globalSessionID = "_global" # key of the global session (duh)
-    _maxHistorySize = 10 # maximum length of the _inputs and _responses lists
+    _maxHistorySize = 10 # maximum length of the _inputs and _responses deques
     _maxRecursionDepth = 100 # maximum number of recursive <srai>/<sr> tags before the response is aborted.
+    _normalCacheSize = 4096 # maximum number of inputs whose normal substitution is kept
+    _compileTemplates = True # render templates compiled to closures (see TemplateCompiler)
+    # Elements whose output only depends on their contents, the matched
+    # input and the bot predicates.  A template made of these alone is
+    # "pure": it renders the same text every time it's matched by the same
+    # input, 'that' and topic.
+    _pureElements = frozenset([
+        "bot", "formal", "gender", "lowercase", "person", "person2", "sentence",
+        "sr", "srai", "star", "template", "text", "thatstar", "think",
+        "topicstar", "uppercase", "version",
+    ])
     # special predicate keys
-    _inputHistory = "_inputHistory"     # keys to a queue (list) of recent user input
-    _outputHistory = "_outputHistory"   # keys to a queue (list) of recent responses.
+    _inputHistory = "_inputHistory"     # keys to a queue (deque) of recent user input
+    _outputHistory = "_outputHistory"   # keys to a queue (deque) of recent responses.
     _inputStack = "_inputStack"         # Should always be empty in between calls to respond()
+    # Mapped brains loaded with loadBrain(shared=True): file path ->
+    # (file identity, CompiledPatternMgr).
+    _sharedBrains = {}
+    _sharedBrainsLock = threading.Lock()
 
-    def __init__(self):
+    def __init__(self, compiledBrain=False, concurrent=False, sessionStore=None):
+        """Create a new Kernel.
+
+        If `compiledBrain` is true, the patterns are stored in a
+        CompiledPatternMgr, which needs much less memory than the default
+        dictionary-based PatternMgr but is slower to learn new categories.
+
+        By default, respond() serves one request at a time.  If
+        `concurrent` is true, requests in different sessions run in
+        parallel and only requests in the same session wait for each
+        other.  The brain is then shared read-only: learn(), loadBrain()
+        and friends must not be called while requests are being served,
+        and <learn> elements are ignored.
+
+        The sessions are kept in `sessionStore` (see SessionStore), by
+        default a MemorySessionStore that keeps them all in memory.
+
+        """
         self._verboseMode = True
         self._version = "python-aiml {}".format(VERSION)
-        self._brain = PatternMgr()
+        self._compiledBrain = compiledBrain
+        self._concurrent = concurrent
+        self._brain = CompiledPatternMgr() if compiledBrain else PatternMgr()
+        self._brainShared = False
         self._respondLock = threading.RLock()
         self.setTextEncoding(None if PY3 else "utf-8")
 
         # set up the sessions
-        self._sessions = {}
-        self._addSession(self._globalSessionID)
+        self._sessionStore = sessionStore
+        self._sessions = sessionStore if sessionStore is not None else MemorySessionStore()
+        self._sessions.pin(self._globalSessionID)
+        self._sessions.release(self._sessions.acquire(self._globalSessionID), False)
 
         # Set up the bot predicates
         self._botPredicates = {}
@@ -75,6 +116,12 @@ class Kernel:
         self._subbers['person'] = WordSub(DefaultSubs.defaultPerson)
         self._subbers['person2'] = WordSub(DefaultSubs.defaultPerson2)
         self._subbers['normal'] = WordSub(DefaultSubs.defaultNormal)
+        self._normalCache = Utils.LRUCache(self._normalCacheSize)
+
+        # id(template) -> (template, whether it is pure)
+        self._pureTemplates = {}
+        # id(template) -> (template, compiled template)
+        self._compiledTemplates = {}
 
         # set up the element processors
         self._elementProcessors = {
@@ -110,6 +157,7 @@ class Kernel:
             "uppercase":    self._processUppercase,
             "version":      self._processVersion,
         }
+        self._templateCompiler = TemplateCompiler(self)
 
     def bootstrap(self, brainFile=None, learnFiles=[], commands=[],
                   chdir=None):
@@ -171,6 +219,15 @@ class Kernel:
         # there's a one-to-one mapping between templates and categories
         return self._brain.numTemplates()
 
+    def cacheStats(self):
+        """Return the (hits, misses, size) counters of the Kernel's
+        caches, as a dictionary: 'normal' for the normalized inputs and
+        'match' for the results of pattern matching.
+
+        """
+        return {"normal": self._normalCache.stats(),
+                "match": self._brain._matchCache.stats()}
+
     def resetBrain(self):
         """Reset the brain to its initial state.
 
@@ -180,27 +237,208 @@ class Kernel:
 
         """
         del(self._brain)
-        self.__init__()
+        self.__init__(self._compiledBrain, self._concurrent, self._sessionStore)
 
-    def loadBrain(self, filename):
+    def loadBrain(self, filename, progress=None, shared=False):
         """Attempt to load a previously-saved 'brain' from the
         specified filename.
 
         NOTE: the current contents of the 'brain' will be discarded!
 
+        The marshal format written by saveBrain(), compressed or not, and
+        the memory-mapped format written by saveBrain(mapped=True) are
+        all accepted.  Mapped brains are always loaded into a
+        CompiledPatternMgr.
+
+        progress, if given, is called with (bytesRead, fileSize) as the
+        brain file is read, the last time with bytesRead == fileSize.
+        It is called from the thread loading the brain.
+
+        If `shared` is true and the file is a mapped brain, the brain is
+        shared with every other Kernel of the process that loaded the
+        same file with `shared`, as long as the file doesn't change: it
+        is only mapped (and its templates decoded) once.  Each Kernel keeps
+        its own bot name and match results.  A shared brain is read-only;
+        learn() and friends must not be called until another brain is
+        loaded or the brain is reset.  Processes mapping the same file
+        share its pages in any case.
+
         """
         if self._verboseMode: print( "Loading brain from %s..." % filename, end="" )
         start = time.time()
-        self._brain.restore(filename)
+        if shared and BrainFile.isBrainFile(filename):
+            self._brain = self._sharedBrain(filename, progress).share()
+            self._brainShared = True
+        else:
+            if self._brainShared:
+                self._brain = CompiledPatternMgr() if self._compiledBrain else PatternMgr()
+                self._brainShared = False
+            if BrainFile.isBrainFile(filename) and not isinstance(self._brain, CompiledPatternMgr):
+                self._brain = CompiledPatternMgr()
+            self._brain.restore(filename, progress)
+        self._pureTemplates = {}
+        self._compiledTemplates = {}
         if self._verboseMode:
             end = time.time() - start
             print( "done (%d categories in %.2f seconds)" % (self._brain.numTemplates(), end) )
 
-    def saveBrain(self, filename):
-        """Dump the contents of the bot's brain to a file on disk."""
+    @classmethod
+    def _sharedBrain(cls, filename, progress):
+        """Return the shared brain loaded from the mapped brain file
+        filename, loading it if it isn't loaded yet or the file changed."""
+        path = os.path.realpath(filename)
+        st = os.stat(path)
+        identity = (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+        with cls._sharedBrainsLock:
+            entry = cls._sharedBrains.get(path)
+            if entry is None or entry[0] != identity:
+                brain = CompiledPatternMgr()
+                brain.restore(path, progress)
+                cls._sharedBrains[path] = entry = (identity, brain)
+            elif progress is not None:
+                progress(st.st_size, st.st_size)
+        return entry[1]
+
+    @classmethod
+    def clearSharedBrains(cls):
+        """Forget the brains shared by loadBrain(shared=True).  The
+        Kernels using them keep them; they are freed with the last one."""
+        with cls._sharedBrainsLock:
+            cls._sharedBrains.clear()
+
+    def resolveRedirects(self):
+        """Resolve the <srai> elements whose contents are constant.
+
+        Every <srai> holding only text is matched once, here, instead of
+        every time it is processed.  If the match doesn't depend on the
+        'that' and topic, and the matched template doesn't use <star>
+        and friends, the <srai> element is marked with the category it
+        leads to; <srai> processing then goes straight to that category's
+        template.  The marks are saved with the brain.
+
+        The marks follow the brain's current contents and bot name.  A
+        mark is ignored once the bot is renamed, since the bot name takes
+        part in matching: call this again after learning more categories
+        or setting the bot's name.  Returns a tuple
+        (redirects, depth): the number of <srai> elements resolved, and
+        the length of the longest chain of resolved redirects.
+
+        """
+        brain = self._brain
+        paths = {}      # id(template) -> (pattern, that, topic)
+        templates = []
+        for pattern, that, topic, template in brain.categories():
+            paths[id(template)] = (pattern, that, topic)
+            templates.append(template)
+
+        def elements(elem, tags):
+            if elem[0] in tags:
+                yield elem
+            for e in elem[2:]:
+                if isinstance(e, list):
+                    for x in elements(e, tags):
+                        yield x
+
+        # Find the target of every constant <srai>.  Targets that use the
+        # words matched by wildcards are left alone.
+        starTags = ("star", "thatstar", "topicstar", "sr", "person", "person2")
+        def usesStars(template):
+            for e in elements(template, starTags):
+                # <person/> and <person2/> stand for <person><star/></person>
+                if e[0] not in ("person", "person2") or len(e) == 2:
+                    return True
+            return False
+        # Interned templates may share <srai> elements, or elements holding
+        # them.  Marks are made per template, so each template gets its
+        # own copies of those.
+        owners = {}     # id(srai element) -> ids of the templates holding it
+        for template in templates:
+            for srai in elements(template, ("srai",)):
+                owners.setdefault(id(srai), set()).add(id(template))
+        shared = set(i for i, o in owners.items() if len(o) > 1)
+        def private(elem):
+            if not isinstance(elem, list):
+                return elem
+            children = [private(e) for e in elem[2:]]
+            if id(elem) not in shared and all(c is e for c, e in zip(children, elem[2:])):
+                return elem
+            return [elem[0], dict(elem[1])] + children
+        if shared:
+            for template in templates:
+                template[2:] = [private(e) for e in template[2:]]
+            self._compiledTemplates = {}
+
+        targets = {}    # id(template) -> [(srai element, target template)]
+        for template in templates:
+            for srai in elements(template, ("srai",)):
+                if "pattern" in srai[1]:
+                    # forget an earlier resolution
+                    srai[1] = dict((k, v) for k, v in srai[1].items()
+                                   if k not in ("pattern", "that", "topic", "botname"))
+                if not all(isinstance(e, list) and e[0] == "text" for e in srai[2:]):
+                    continue
+                text = u"".join(self._processElement(e, self._globalSessionID) for e in srai[2:])
+                target = brain.contextFreeMatch(self._normalize(text))
+                if target is None or usesStars(target):
+                    continue
+                targets.setdefault(id(template), []).append((srai, target))
+
+        # Mark the redirects, leaving out those that form a cycle.
+        depths = {}     # id(template) -> longest chain of redirects, or None while visiting
+        def depth(template):
+            depths[id(template)] = None
+            longest = 0
+            for srai, target in targets.get(id(template), ()):
+                if id(target) in depths and depths[id(target)] is None:
+                    continue
+                d = depths[id(target)] if id(target) in depths else depth(target)
+                pattern, that, topic = paths[id(target)]
+                srai[1] = dict(srai[1], pattern=pattern, that=that, topic=topic,
+                               botname=brain._botName)
+                redirects[0] += 1
+                longest = max(longest, d + 1)
+            depths[id(template)] = longest
+            return longest
+        redirects = [0]
+        maxDepth = 0
+        for template in templates:
+            if id(template) not in depths:
+                maxDepth = max(maxDepth, depth(template))
+        return redirects[0], maxDepth
+
+    def internTemplates(self):
+        """Make identical templates, and identical parts of templates,
+        share the same objects, in memory and in the brain files saved
+        afterwards.  Returns the number of distinct templates.
+
+        Do this after resolveRedirects(), which changes templates.
+
+        """
+        self._pureTemplates = {}
+        self._compiledTemplates = {}
+        return self._brain.internTemplates()
+
+    def saveBrain(self, filename, mapped=False, compress=None):
+        """Dump the contents of the bot's brain to a file on disk.
+
+        If `mapped` is true, the brain is written in the memory-mapped
+        format, which loads almost instantly and decodes templates only
+        when they are first used.  Otherwise, `compress` may be "zlib" or
+        "lzma" to write a compressed brain file, which is much smaller
+        and quicker to read from slow storage.  Either way, the file can
+        be checked with BrainFile.validate() before it's loaded.
+
+        """
         if self._verboseMode: print( "Saving brain to %s..." % filename, end="")
         start = time.time()
-        self._brain.save(filename)
+        if mapped:
+            brain = self._brain
+            if not isinstance(brain, CompiledPatternMgr):
+                brain = CompiledPatternMgr()
+                brain.copyPatterns(self._brain)
+            brain.saveMapped(filename)
+        else:
+            self._brain.save(filename, compress)
         if self._verboseMode:
             print("done (%.2f seconds)" % (time.time() - start))
 
@@ -212,8 +450,9 @@ class Kernel:
         string is returned.
 
         """
-        try: return self._sessions[sessionID][name]
-        except KeyError: return ""
+        session = self._sessions.get(sessionID)
+        try: return session[name]
+        except (KeyError, TypeError): return ""
 
     def setPredicate(self, name, value, sessionID = _globalSessionID):
         """Set the value of the predicate 'name' in the specified
@@ -224,8 +463,10 @@ class Kernel:
         created.
 
         """
-        self._addSession(sessionID)  # add the session, if it doesn't already exist.
-        self._sessions[sessionID][name] = value
+        # add the session, if it doesn't already exist.
+        session = self._sessions.acquire(sessionID)
+        try: session[name] = value
+        finally: self._sessions.release(session)
 
     def getBotPredicate(self, name):
         """Retrieve the value of the specified bot predicate.
@@ -247,6 +488,8 @@ class Kernel:
         # name in the brain as well
         if name == "name":
             self._brain.setBotName(self.getBotPredicate("name"))
+        # Forget the responses rendered with the old value.
+        self._brain._matchCache.clear()
 
     def setTextEncoding(self, encoding):
         """
@@ -282,23 +525,12 @@ class Kernel:
             # iterate over the key,value pairs and add them to the subber
             for k, v in parser.items(s):
                 self._subbers[s][k] = v
-
-    def _addSession(self, sessionID):
-        """Create a new session with the specified ID string."""
-        if sessionID in self._sessions:
-            return
-        # Create the session.
-        self._sessions[sessionID] = {
-            # Initialize the special reserved predicates
-            self._inputHistory: [],
-            self._outputHistory: [],
-            self._inputStack: []
-        }
+        self._normalCache.clear()
+        self._brain._matchCache.clear()
 
     def _deleteSession(self, sessionID):
         """Delete the specified session."""
-        if sessionID in self._sessions:
-            self._sessions.pop(sessionID)
+        self._sessions.delete(sessionID)
 
     def getSessionData(self, sessionID=None):
         """Return a copy of the session data dictionary for the
@@ -307,37 +539,57 @@ class Kernel:
         If no sessionID is specified, return a dictionary containing
         *all* of the individual session dictionaries.
 
+        To read sessions without copying them, use getSession() and
+        iterSessions().
+
         """
-        s = None
         if sessionID is not None:
-            try: s = self._sessions[sessionID]
-            except KeyError: s = {}
-        else:
-            s = self._sessions
-        return copy.deepcopy(s)
+            s = self._sessions.get(sessionID)
+            return s.getData() if s is not None else {}
+        return dict((i, view.copy()) for i, view in self.iterSessions())
+
+    def getSession(self, sessionID=_globalSessionID):
+        """Return a read-only view (a SessionView) of the specified
+        session, or None if there is no such session.
 
-    def learn(self, filename):
+        The view reads the live session: nothing is copied, and no lock
+        is taken.
+
+        """
+        s = self._sessions.get(sessionID)
+        return SessionView(s) if s is not None else None
+
+    def iterSessions(self):
+        """Iterate over the sessions, yielding (sessionID, SessionView)
+        pairs.  Sessions created while iterating may be left out."""
+        for i in self._sessions.ids():
+            s = self._sessions.get(i)
+            if s is not None:
+                yield i, SessionView(s)
+
+    def learn(self, filename, parser="sax"):
         """Load and learn the contents of the specified AIML file.
 
         If filename includes wildcard characters, all matching files
         will be loaded and learned.
 
+        parser selects the AIML parser: "sax" or the faster "expat" (see
+        AimlParser.create_parser()).  Both learn the same categories.
+
         """
         for f in glob.glob(filename):
             if self._verboseMode: print( "Loading %s..." % f, end="")
             start = time.time()
-            # Load and parse the AIML file.
-            parser = create_parser()
-            handler = parser.getContentHandler()
-            handler.setEncoding(self._textEncoding)
-            try: parser.parse(f)
+            # Parse the AIML file, and store each pattern/template pair in
+            # the PatternMgr as soon as it's read.  A fatal parse error
+            # stops the file where it happened.
+            try:
+                for key, tem in iterCategories(f, self._textEncoding, parser):
+                    self._brain.add(key, tem)
             except xml.sax.SAXParseException as msg:
                 err = "\nFATAL PARSE ERROR in file %s:\n%s\n" % (f,msg)
                 sys.stderr.write(err)
                 continue
-            # store the pattern/template pairs in the PatternMgr.
-            for key, tem in handler.categories.items():
-                self._brain.add(key, tem)
             # Parsing was successful.
             if self._verboseMode:
                 print("done (%.2f seconds)" % (time.time() - start))
@@ -353,48 +605,46 @@ class Kernel:
         except UnicodeError: pass
         except AttributeError: pass
 
-        # prevent other threads from stomping all over us.
-        self._respondLock.acquire()
+        # Add the session, if it doesn't already exist, and keep it in
+        # memory until we're done with it.
+        session = self._sessions.acquire(sessionID)
 
-        try:
-            # Add the session, if it doesn't already exist
-            self._addSession(sessionID)
+        # prevent other threads from stomping all over us.  In concurrent
+        # mode, only requests in the same session need to wait.
+        lock = session.lock if self._concurrent else self._respondLock
+        lock.acquire()
 
+        try:
             # split the input into discrete sentences
             sentences = Utils.sentences(input_)
-            finalResponse = u""
+            responses = []
+            if session.inputHistory.maxlen != self._maxHistorySize:
+                session.setMaxHistory(self._maxHistorySize)
+            # the histories drop their oldest entries by themselves
+            inputHistory = session.inputHistory
+            outputHistory = session.outputHistory
             for s in sentences:
-                # Add the input to the history list before fetching the
+                # Add the input to the history before fetching the
                 # response, so that <input/> tags work properly.
-                inputHistory = self.getPredicate(self._inputHistory, sessionID)
                 inputHistory.append(s)
-                while len(inputHistory) > self._maxHistorySize:
-                    inputHistory.pop(0)
-                self.setPredicate(self._inputHistory, inputHistory, sessionID)
 
                 # Fetch the response
                 response = self._respond(s, sessionID)
 
-                # add the data from this exchange to the history lists
-                outputHistory = self.getPredicate(self._outputHistory, sessionID)
+                # add the data from this exchange to the history
                 outputHistory.append(response)
-                while len(outputHistory) > self._maxHistorySize:
-                    outputHistory.pop(0)
-                self.setPredicate(self._outputHistory, outputHistory, sessionID)
-
-                # append this response to the final response.
-                finalResponse += (response + u"  ")
+                responses.append(response)
 
-            finalResponse = finalResponse.strip()
-            #print( "@ASSERT", self.getPredicate(self._inputStack, sessionID))
-            assert(len(self.getPredicate(self._inputStack, sessionID)) == 0)
+            finalResponse = u"  ".join(responses).strip()
+            assert(len(session.inputStack) == 0)
 
             # and return, encoding the string into the I/O encoding
             return self._cod.enc(finalResponse)
 
         finally:
             # release the lock
-            self._respondLock.release()
+            lock.release()
+            self._sessions.release(session)
 
 
     # This version of _respond() just fetches the response for some input.
@@ -406,53 +656,131 @@ class Kernel:
         if len(input_) == 0:
             return u""
 
+        session = self._sessions.get(sessionID)
+
         # guard against infinite recursion
-        inputStack = self.getPredicate(self._inputStack, sessionID)
+        inputStack = session.inputStack
         if len(inputStack) > self._maxRecursionDepth:
             if self._verboseMode:
                 err = u"WARNING: maximum recursion depth exceeded (input='%s')" % self._cod.enc(input_)
                 sys.stderr.write(err)
+            # The truncated response must not be remembered.
+            session.impureCount += 1
             return u""
 
         # push the input onto the input stack
-        inputStack = self.getPredicate(self._inputStack, sessionID)
         inputStack.append(input_)
-        self.setPredicate(self._inputStack, inputStack, sessionID)
 
         # run the input through the 'normal' subber
-        subbedInput = self._subbers['normal'].sub(input_)
+        subbedInput = self._normalize(input_)
 
         # fetch the bot's previous response, to pass to the match()
         # function as 'that'.
-        outputHistory = self.getPredicate(self._outputHistory, sessionID)
-        try: that = outputHistory[-1]
+        try: that = session.outputHistory[-1]
         except IndexError: that = ""
-        subbedThat = self._subbers['normal'].sub(that)
+        subbedThat = self._normalize(that)
 
         # fetch the current topic
-        topic = self.getPredicate("topic", sessionID)
-        subbedTopic = self._subbers['normal'].sub(topic)
+        topic = session.get("topic", "")
+        subbedTopic = self._normalize(topic)
 
         # Determine the final response.
         response = u""
-        elem = self._brain.match(subbedInput, subbedThat, subbedTopic)
-        if elem is None:
+        match = self._brain.match(subbedInput, subbedThat, subbedTopic)
+        if match is None:
             if self._verboseMode:
                 err = "WARNING: No match found for input: %s\n" % self._cod.enc(input_)
                 sys.stderr.write(err)
+        elif match.response is not None:
+            # A pure template, already rendered for this very input.
+            response = match.response
         else:
-            # Process the element into a response string.
-            response += self._processElement(elem, sessionID).strip()
-            response += u" "
-        response = response.strip()
+            # Process the element into a response string.  The match stays
+            # on the match stack meanwhile, for <star> and friends.
+            impureCount = session.impureCount
+            if not self._isPure(match.template):
+                session.impureCount += 1
+            matchStack = session.matchStack
+            matchStack.append(match)
+            try:
+                response = self._renderTemplate(match.template, sessionID).strip()
+            finally:
+                matchStack.pop()
+            # If neither this template nor any template reached through
+            # <srai> was impure, the response can be reused.
+            if session.impureCount == impureCount:
+                match.response = response
 
         # pop the top entry off the input stack.
-        inputStack = self.getPredicate(self._inputStack, sessionID)
         inputStack.pop()
-        self.setPredicate(self._inputStack, inputStack, sessionID)
 
         return response
 
+    def _redirect(self, attr, sessionID):
+        """Respond to a <srai> marked by resolveRedirects(), whose
+        attributes are attr, by rendering the category it names.  Returns
+        None if the brain has no such category any more, or if the bot
+        was renamed since."""
+        if attr.get("botname") != self._brain._botName:
+            return None
+        template = self._brain.lookup((attr["pattern"], attr["that"], attr["topic"]))
+        if template is None:
+            return None
+        session = self._sessions.get(sessionID)
+
+        # guard against infinite recursion, like _respond()
+        inputStack = session.inputStack
+        if len(inputStack) > self._maxRecursionDepth:
+            if self._verboseMode:
+                err = u"WARNING: maximum recursion depth exceeded (input='%s')" % self._cod.enc(attr["pattern"])
+                sys.stderr.write(err)
+            session.impureCount += 1
+            return u""
+
+        if not self._isPure(template):
+            session.impureCount += 1
+        inputStack.append(attr["pattern"])
+        try:
+            return self._renderTemplate(template, sessionID).strip()
+        finally:
+            inputStack.pop()
+
+    def _normalize(self, s):
+        """Return s run through the 'normal' subber, caching the result."""
+        subbed = self._normalCache.get(s)
+        if subbed is None:
+            subbed = self._subbers['normal'].sub(s)
+            self._normalCache.put(s, subbed)
+        return subbed
+
+    def _isPure(self, template):
+        """Return True if the template is made of pure elements only (see
+        _pureElements)."""
+        try: return self._pureTemplates[id(template)][1]
+        except KeyError: pass
+        def pure(elem):
+            return elem[0] in self._pureElements and \
+                all(pure(e) for e in elem[2:] if isinstance(e, list))
+        isPure = pure(template)
+        # Keep the template alive, so its id() can't be reused.
+        self._pureTemplates[id(template)] = (template, isPure)
+        return isPure
+
+    def _renderTemplate(self, template, sessionID):
+        """Return the response of a template, compiling it the first time
+        it is rendered (see TemplateCompiler).  With _compileTemplates
+        false, the template is interpreted by _processElement()."""
+        if not self._compileTemplates:
+            return self._processElement(template, sessionID)
+        try: code = self._compiledTemplates[id(template)][1]
+        except KeyError:
+            code = self._templateCompiler.compile(template)
+            # Keep the template alive, so its id() can't be reused.
+            self._compiledTemplates[id(template)] = (template, code)
+        out = []
+        code(sessionID, out)
+        return u"".join(out)
+
     def _processElement(self, elem, sessionID):
         """Process an AIML element.
 
@@ -684,7 +1012,7 @@ class Kernel:
         the current session.
 
         """
-        inputHistory = self.getPredicate(self._inputHistory, sessionID)
+        inputHistory = self._sessions.get(sessionID).inputHistory
         try: index = int(elem[1]['index'])
         except: index = 1
         try: return inputHistory[-index]
@@ -719,6 +1047,12 @@ class Kernel:
         filename = ""
         for e in elem[2:]:
             filename += self._processElement(e, sessionID)
+        if self._concurrent:
+            # The brain is read-only while serving concurrent requests.
+            if self._verboseMode:
+                err = "WARNING: <learn> ignored in concurrent mode (file='%s')\n" % self._cod.enc(filename)
+                sys.stderr.write(err)
+            return ""
         self.learn(filename)
         return ""
 
@@ -887,6 +1221,11 @@ class Kernel:
         returned.
 
         """
+        # A <srai> marked by resolveRedirects() names its category.
+        if "pattern" in elem[1]:
+            response = self._redirect(elem[1], sessionID)
+            if response is not None:
+                return response
         newInput = ""
         for e in elem[2:]:
             newInput += self._processElement(e, sessionID)
@@ -909,16 +1248,9 @@ class Kernel:
         """
         try: index = int(elem[1]['index'])
         except KeyError: index = 1
-        # fetch the user's last input
-        inputStack = self.getPredicate(self._inputStack, sessionID)
-        input_ = self._subbers['normal'].sub(inputStack[-1])
-        # fetch the Kernel's last response (for 'that' context)
-        outputHistory = self.getPredicate(self._outputHistory, sessionID)
-        try: that = self._subbers['normal'].sub(outputHistory[-1])
-        except: that = ""  # there might not be any output yet
-        topic = self.getPredicate("topic", sessionID)
-        response = self._brain.star("star", input_, that, topic, index)
-        return response
+        # fetch the words captured when the current template was matched
+        match = self._sessions.get(sessionID).matchStack[-1]
+        return match.star("star", index)
 
     # <system>
     def _processSystem(self, elem, sessionID):
@@ -1016,7 +1348,7 @@ class Kernel:
         of the Kernel's previous responses.
 
         """
-        outputHistory = self.getPredicate(self._outputHistory, sessionID)
+        outputHistory = self._sessions.get(sessionID).outputHistory
         index = 1
         try:
             # According to the AIML spec, the optional index attribute
@@ -1049,16 +1381,9 @@ class Kernel:
         """
         try: index = int(elem[1]['index'])
         except KeyError: index = 1
-        # fetch the user's last input
-        inputStack = self.getPredicate(self._inputStack, sessionID)
-        input_ = self._subbers['normal'].sub(inputStack[-1])
-        # fetch the Kernel's last response (for 'that' context)
-        outputHistory = self.getPredicate(self._outputHistory, sessionID)
-        try: that = self._subbers['normal'].sub(outputHistory[-1])
-        except Exception: that = ""  # there might not be any output yet
-        topic = self.getPredicate("topic", sessionID)
-        response = self._brain.star("thatstar", input_, that, topic, index)
-        return response
+        # fetch the words captured when the current template was matched
+        match = self._sessions.get(sessionID).matchStack[-1]
+        return match.star("thatstar", index)
 
     # <think>
     def _processThink(self, elem, sessionID):
@@ -1090,16 +1415,9 @@ class Kernel:
         """
         try: index = int(elem[1]['index'])
         except KeyError: index = 1
-        # fetch the user's last input
-        inputStack = self.getPredicate(self._inputStack, sessionID)
-        input_ = self._subbers['normal'].sub(inputStack[-1])
-        # fetch the Kernel's last response (for 'that' context)
-        outputHistory = self.getPredicate(self._outputHistory, sessionID)
-        try: that = self._subbers['normal'].sub(outputHistory[-1])
-        except Exception: that = ""  # there might not be any output yet
-        topic = self.getPredicate("topic", sessionID)
-        response = self._brain.star("topicstar", input_, that, topic, index)
-        return response
+        # fetch the words captured when the current template was matched
+        match = self._sessions.get(sessionID).matchStack[-1]
+        return match.star("topicstar", index)
 
     # <uppercase>
     def _processUppercase(self, elem, sessionID):
@@ -0,0 +1,202 @@
+"""This file contains the KernelPool, which serves AIML requests from
+several worker processes that share one loaded brain."""
+
+from __future__ import print_function
+
+import gc
+import multiprocessing
+import os
+import pickle
+import threading
+import zlib
+
+from .constants import *
+from .Kernel import Kernel
+
+_globalSessionID = Kernel._globalSessionID
+
+
+# The Kernel methods a worker will run on behalf of the pool.
+_METHODS = ("respond", "getPredicate", "setPredicate", "getSessionData")
+
+
+def _forkContext():
+    """Return a multiprocessing context that forks its workers, or None if
+    the platform can't fork."""
+    try: return multiprocessing.get_context("fork")
+    except AttributeError: pass     # Python 2 always forks on POSIX
+    except ValueError: return None
+    return multiprocessing if hasattr(os, "fork") else None
+
+
+def _serve(kernel, conn):
+    """The main loop of a worker: run each batch of (method, args) requests
+    received on conn, and send back a list of (ok, result) pairs."""
+    while True:
+        try: requests = conn.recv()
+        except EOFError: break
+        if requests is None: break
+        results = []
+        for method, args in requests:
+            try: results.append((True, getattr(kernel, method)(*args)))
+            except Exception as e: results.append((False, e))
+        try: conn.send(results)
+        except Exception:
+            # Some result can't be pickled: send what can be, so that the
+            # pool gets an answer to every request all the same.
+            conn.send([_picklable(result) for result in results])
+    conn.close()
+
+
+def _picklable(result):
+    """Return an (ok, result) pair, or an error in its place if it can't
+    be pickled."""
+    try:
+        pickle.loads(pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+        return result
+    except Exception as e:
+        ok, value = result
+        return (False, RuntimeError("%s can't be returned by a KernelPool worker: %s"
+                                    % (type(value).__name__, e)))
+
+
+class KernelPool(object):
+    """Serve the requests of many sessions from a pool of worker processes.
+
+    The pool is built around a Kernel that has already been set up (brain
+    loaded, bot predicates set, and so on).  Each worker is forked from the
+    current process, so it inherits that Kernel and its brain copy-on-write
+    instead of loading one of its own.  Every session is always routed to
+    the same worker, so its predicates and histories live in that worker
+    only: the Kernel passed in doesn't see them.
+
+    On platforms without fork(), the pool has no workers and serves all
+    requests from the Kernel itself.
+
+    """
+
+    def __init__(self, kernel, numWorkers=None):
+        self._kernel = kernel
+        self._workers = []      # (process, connection) pairs
+        self._lock = threading.Lock()
+        context = _forkContext()
+        if context is None:
+            return
+        if numWorkers is None:
+            numWorkers = multiprocessing.cpu_count()
+        # Keep the garbage collector of each worker from touching (and
+        # thereby copying) the pages holding the brain.
+        gc.collect()
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+        try:
+            for i in range(numWorkers):
+                parentConn, childConn = context.Pipe()
+                process = context.Process(target=_serve, args=(kernel, childConn))
+                process.daemon = True
+                process.start()
+                childConn.close()
+                self._workers.append((process, parentConn))
+        finally:
+            # The workers are forked: the parent collects as usual again.
+            if hasattr(gc, "unfreeze"):
+                gc.unfreeze()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def numWorkers(self):
+        """Return the number of worker processes."""
+        return len(self._workers)
+
+    def close(self):
+        """Stop the worker processes."""
+        with self._lock:
+            for process, conn in self._workers:
+                try: conn.send(None)
+                except (IOError, OSError): pass
+                conn.close()
+            for process, conn in self._workers:
+                process.join()
+            self._workers = []
+
+    def _workerIndex(self, sessionID):
+        """Return the index of the worker that serves sessionID."""
+        if not isinstance(sessionID, (bytes, unicode)):
+            sessionID = str(sessionID)
+        if isinstance(sessionID, unicode):
+            sessionID = sessionID.encode("utf-8")
+        return (zlib.crc32(sessionID) & 0xffffffff) % len(self._workers)
+
+    def _call(self, requests):
+        """Run a list of (sessionID, method, args) requests and return the
+        list of their results.  Requests made in the same session run in
+        order, in the worker serving that session."""
+        if not self._workers:
+            with self._lock:
+                return [getattr(self._kernel, method)(*args)
+                        for sessionID, method, args in requests]
+        batches = [[] for w in self._workers]
+        positions = [[] for w in self._workers]
+        for i, (sessionID, method, args) in enumerate(requests):
+            if method not in _METHODS:
+                raise ValueError("method %s can't be called through a KernelPool" % method)
+            w = self._workerIndex(sessionID)
+            batches[w].append((method, args))
+            positions[w].append(i)
+        results = [None] * len(requests)
+        with self._lock:
+            # Hand out all the batches first, so that the workers run
+            # them in parallel, then collect the results.  A worker that
+            # fails only fails its own requests: every other pipe is
+            # still drained, to keep it in step with its worker.
+            errors = [None] * len(self._workers)
+            for w, ((process, conn), batch) in enumerate(zip(self._workers, batches)):
+                if not batch: continue
+                try: conn.send(batch)
+                except Exception as e: errors[w] = e
+            for w, ((process, conn), batch, where) in enumerate(zip(self._workers, batches, positions)):
+                if not batch: continue
+                if errors[w] is None:
+                    try: received = conn.recv()
+                    except Exception as e: errors[w] = e
+                if errors[w] is not None:
+                    received = [(False, RuntimeError("KernelPool worker %d failed: %r" % (w, errors[w])))] * len(batch)
+                for i, result in zip(where, received):
+                    results[i] = result
+        for ok, result in results:
+            if not ok: raise result
+        return [result for ok, result in results]
+
+    def respond(self, input_, sessionID=_globalSessionID):
+        """Return the Kernel's response to the input string, as computed
+        by the worker serving sessionID."""
+        return self.respondMany([(sessionID, input_)])[0]
+
+    def respondMany(self, requests):
+        """Return the responses to a list of (sessionID, input) pairs.
+
+        The requests are spread over the workers by session, and the
+        responses are returned in the order of the requests.
+
+        """
+        return self._call([(sessionID, "respond", (input_, sessionID))
+                           for sessionID, input_ in requests])
+
+    def getPredicate(self, name, sessionID=_globalSessionID):
+        """Retrieve the current value of the predicate 'name' from the
+        specified session, in the worker serving it."""
+        return self._call([(sessionID, "getPredicate", (name, sessionID))])[0]
+
+    def setPredicate(self, name, value, sessionID=_globalSessionID):
+        """Set the value of the predicate 'name' in the specified session,
+        in the worker serving it."""
+        self._call([(sessionID, "setPredicate", (name, value, sessionID))])
+
+    def getSessionData(self, sessionID):
+        """Return a copy of the session data dictionary for the specified
+        session, from the worker serving it."""
+        return self._call([(sessionID, "getSessionData", (sessionID,))])[0]
@@ -13,6 +13,63 @@ import string
 import sys
 
 from .constants import *
+from . import BrainFile
+from . import Utils
+
+# Marks a missing entry of the match cache (None is a cached "no match").
+_MISSING = object()
+
+# The punctuation PatternMgr._inputWords() turns into spaces, and the
+# words it leaves.
+_PUNCTUATION = r"""`~!@#$%^&*()-_=+[{]}\|;:'",<.>/?"""
+_WORD_RE = re.compile(u"[^\\s" + re.escape(_PUNCTUATION) + u"]+", re.UNICODE)
+
+class Match(object):
+    """The result of PatternMgr.match(): the matched template, and the
+    words captured by the wildcards of its pattern, 'that' and 'topic'.
+    """
+
+    _starTypes = {'star': 0, 'thatstar': 1, 'topicstar': 2}
+
+    def __init__(self, template, spans, inputs):
+        self.template = template
+        self._spans = spans
+        self._inputs = inputs
+        self._offsets = [None, None, None]
+        # The Kernel stores the rendered template here when it can't
+        # change between calls (see Kernel._respond).
+        self.response = None
+
+    def star(self, starType, index):
+        """Returns a string, the portion of the input that was matched by
+        the index'th * (or _), counting from 1.
+
+        The 'starType' parameter specifies which type of star to find.
+        Legal values are:
+         - 'star': matches a star in the main pattern.
+         - 'thatstar': matches a star in the that pattern.
+         - 'topicstar': matches a star in the topic pattern.
+        """
+        try: context = self._starTypes[starType]
+        except KeyError:
+            # unknown value
+            raise ValueError( "starType must be in ['star', 'thatstar', 'topicstar']" )
+        spans = self._spans[context]
+        if not 0 < index <= len(spans):
+            return u""
+
+        # The spans count the words of the mutilated input.  Extract the
+        # text they cover from the original, unmutilated input, which has
+        # the same words at the same offsets, but with punctuation.
+        input_ = self._inputs[context]
+        offsets = self._offsets[context]
+        if offsets is None:
+            offsets = self._offsets[context] = [m.span() for m in _WORD_RE.finditer(input_)]
+        start, end = spans[index-1]
+        if end > len(offsets):
+            return u""
+        return ' '.join(input_[offsets[start][0]:offsets[end-1][1]].split())
+
 
 class PatternMgr:
     # special dictionary keys
@@ -22,14 +79,19 @@ class PatternMgr:
     _THAT       = 3
     _TOPIC      = 4
     _BOT_NAME   = 5
+
+    # maximum number of (pattern, that, topic) triples whose Match is kept
+    _matchCacheSize = 4096
     
     def __init__(self):
         self._root = {}
         self._templateCount = 0
         self._botName = u"Nameless"
-        punctuation = r"""`~!@#$%^&*()-_=+[{]}\|;:'",<.>/?"""
-        self._puncStripRE = re.compile("[" + re.escape(punctuation) + "]")
-        self._whitespaceRE = re.compile(r"\s+", re.UNICODE)
+        self._puncStripRE = re.compile("[" + re.escape(_PUNCTUATION) + "]")
+        self._puncTable = dict((ord(c), u" ") for c in _PUNCTUATION)
+        # Recent results of match().  Must be cleared whenever the patterns
+        # or the bot name change.
+        self._matchCache = Utils.LRUCache(self._matchCacheSize)
 
     def numTemplates(self):
         """Return the number of templates currently stored."""
@@ -41,33 +103,51 @@ class PatternMgr:
         """
         # Collapse a multi-word name into a single word
         self._botName = unicode( ' '.join(name.split()) )
+        self._matchCache.clear()
 
     def dump(self):
         """Print all learned patterns, for debugging purposes."""
         pprint.pprint(self._root)
 
-    def save(self, filename):
+    def save(self, filename, compress=None):
         """Dump the current patterns to the file specified by filename.  To
         restore later, use restore().
+
+        The file is a tree brain file (see the BrainFile module), whose
+        header allows checking it before loading it.  If compress is
+        "zlib" or "lzma", the patterns are compressed.
         """
         try:
-            outFile = open(filename, "wb")
-            marshal.dump(self._templateCount, outFile)
-            marshal.dump(self._botName, outFile)
-            marshal.dump(self._root, outFile)
-            outFile.close()
+            BrainFile.writeTree(filename, self._templateCount, self._botName,
+                                self._root, compress)
         except Exception as e:
             print( "Error saving PatternMgr to file %s:" % filename )
             raise
 
-    def restore(self, filename):
-        """Restore a previously save()d collection of patterns."""
+    def restore(self, filename, progress=None):
+        """Restore a previously save()d collection of patterns.  Files
+        saved by older versions of PyAIML, as plain marshal, are accepted
+        too.  A damaged file raises BrainFile.BrainFileError.
+
+        progress, if given, is called with (bytesRead, fileSize) as the
+        file is read.
+        """
         try:
+            if BrainFile.isTreeFile(filename):
+                (self._templateCount, self._botName,
+                 self._root) = BrainFile.readTree(filename, progress)
+                self._matchCache.clear()
+                return
             inFile = open(filename, "rb")
             self._templateCount = marshal.load(inFile)
             self._botName = marshal.load(inFile)
-            self._root = marshal.load(inFile)
+            # marshal.load() reads a file one value at a time: unmarshal
+            # the (large) tree from memory instead.
+            self._root = marshal.loads(inFile.read())
+            if progress is not None:
+                progress(inFile.tell(), inFile.tell())
             inFile.close()
+            self._matchCache.clear()
         except Exception as e:
             print( "Error restoring PatternMgr from file %s:" % filename )
             raise
@@ -77,6 +157,7 @@ class PatternMgr:
         to the node tree.
         """
         pattern,that,topic = data
+        self._matchCache.clear()
         # TODO: make sure words contains only legal characters
         # (alphanumerics,*,_)
 
@@ -131,31 +212,180 @@ class PatternMgr:
             self._templateCount += 1    
         node[self._TEMPLATE] = template
 
+    def remove(self, data):
+        """Remove the category stored for the exact [pattern/that/topic]
+        tuple, as given to add().  Returns its template, or None if there
+        was no such category.
+        """
+        pattern, that, topic = data
+        special = {u"_": self._UNDERSCORE, u"*": self._STAR, u"BOT_NAME": self._BOT_NAME}
+        path = [special.get(w, w) for w in pattern.split()]
+        del special[u"BOT_NAME"]
+        if len(that) > 0:
+            path += [self._THAT] + [special.get(w, w) for w in that.split()]
+        if len(topic) > 0:
+            path += [self._TOPIC] + [special.get(w, w) for w in topic.split()]
+
+        # Walk down to the template, remembering the way back up.
+        nodes = [self._root]
+        for key in path:
+            if key not in nodes[-1]:
+                return None
+            nodes.append(nodes[-1][key])
+        template = nodes[-1].pop(self._TEMPLATE, None)
+        if template is None:
+            return None
+        self._templateCount -= 1
+        self._matchCache.clear()
+        # Prune the nodes left without children.
+        for node, key in zip(reversed(nodes[:-1]), reversed(path)):
+            if node[key]:
+                break
+            del node[key]
+        return template
+
     def match(self, pattern, that, topic):
-        """Return the template which is the closest match to pattern. The
-        'that' parameter contains the bot's previous response. The 'topic'
-        parameter contains the current topic of conversation.
+        """Return a Match for the template which is the closest match to
+        pattern. The 'that' parameter contains the bot's previous
+        response. The 'topic' parameter contains the current topic of
+        conversation.
 
-        Returns None if no template is found.
+        Returns None if no template is found.  Results are cached, so
+        the same Match may be returned for repeated calls.
         """
         if len(pattern) == 0:
             return None
-        # Mutilate the input.  Remove all punctuation and convert the
-        # text to all caps.
-        input_ = pattern.upper()
-        input_ = re.sub(self._puncStripRE, " ", input_)
+        key = (pattern, that, topic)
+        match = self._matchCache.get(key, _MISSING)
+        if match is not _MISSING:
+            return match
         if that.strip() == u"": that = u"ULTRABOGUSDUMMYTHAT" # 'that' must never be empty
-        thatInput = that.upper()
-        thatInput = re.sub(self._puncStripRE, " ", thatInput)
-        thatInput = re.sub(self._whitespaceRE, " ", thatInput)
         if topic.strip() == u"": topic = u"ULTRABOGUSDUMMYTOPIC" # 'topic' must never be empty
-        topicInput = topic.upper()
-        topicInput = re.sub(self._puncStripRE, " ", topicInput)
-        
-        # Pass the input off to the recursive call
-        patMatch, template = self._match(input_.split(), thatInput.split(), topicInput.split(), self._root)
+
+        # Pass the input off to the pattern-matcher
+        spans, template = self._match(self._inputWords(pattern), self._inputWords(that),
+                                      self._inputWords(topic), self._root)
+        match = None
+        if template is not None:
+            match = Match(template, spans, key)
+        self._matchCache.put(key, match)
+        return match
+
+    def _inputWords(self, s):
+        """Mutilate the input: return the words of s, converted to all caps,
+        with all punctuation removed.  Unicode strings are done in a single
+        pass."""
+        s = s.upper()
+        if isinstance(s, unicode):
+            return s.translate(self._puncTable).split()
+        return re.sub(self._puncStripRE, " ", s).split()
+
+    def lookup(self, data):
+        """Return the template stored for the exact [pattern/that/topic]
+        tuple, as given to add(), or None if there is no such category.
+        """
+        pattern, that, topic = data
+        special = {u"_": self._UNDERSCORE, u"*": self._STAR, u"BOT_NAME": self._BOT_NAME}
+        def keys(words):
+            return [special.get(w, k) for w, k in zip(words, self._wordKeys(words))]
+        path = keys(pattern.split())
+        del special[u"BOT_NAME"]
+        if len(that) > 0:
+            path += [self._THAT] + keys(that.split())
+        if len(topic) > 0:
+            path += [self._TOPIC] + keys(topic.split())
+        node = self._root
+        for key in path:
+            if key is None:
+                return None
+            node = self._child(node, key)
+            if node is None:
+                return None
+        return self._template(node)
+
+    def categories(self):
+        """Yield a (pattern, that, topic, template) tuple for every stored
+        category, in no particular order.
+        """
+        names = {self._UNDERSCORE: u"_", self._STAR: u"*", self._BOT_NAME: u"BOT_NAME"}
+        stack = [(self._root, 0, ((), (), ()))]
+        while stack:
+            node, phase, path = stack.pop()
+            template = self._template(node)
+            if template is not None:
+                yield tuple(u" ".join(words) for words in path) + (template,)
+            for key in self._keys(node):
+                child = self._child(node, key)
+                if key == self._THAT:
+                    stack.append((child, 1, path))
+                elif key == self._TOPIC:
+                    stack.append((child, 2, path))
+                else:
+                    name = self._keyName(key)
+                    name = names.get(name, name)
+                    words = path[:phase] + (path[phase] + (name,),) + path[phase+1:]
+                    stack.append((child, phase, words))
+
+    def internTemplates(self):
+        """Make identical templates, and identical parts of templates,
+        share the same objects (see Utils.TemplateInterner).  Returns the
+        number of distinct templates left.
+        """
+        interner = Utils.TemplateInterner()
+        distinct = set()
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if self._TEMPLATE in node:
+                node[self._TEMPLATE] = interner.intern(node[self._TEMPLATE])
+                distinct.add(id(node[self._TEMPLATE]))
+            stack.extend(child for key, child in node.items() if key != self._TEMPLATE)
+        self._matchCache.clear()
+        return len(distinct)
+
+    def contextFreeMatch(self, pattern):
+        """Return the template that pattern matches whatever the 'that'
+        and topic are, or None if nothing matches or if the match depends
+        on them (or on the bot's name).
+        """
+        input_ = self._inputWords(pattern)
+        if len(input_) == 0 or self._botName in input_:
+            return None
+        depends = ['depends']
+        def accept(node):
+            # The words ran out at node: whatever comes next is decided by
+            # the 'that' and topic subtrees.
+            that = self._child(node, self._THAT)
+            if that is None:
+                return self._template(node)
+            return self._anyContext(that) or depends
+        spans, template = self._match(input_, [], [], self._root, accept)
+        if template is depends:
+            return None
         return template
 
+    def _anyContext(self, node):
+        """Return the template below a _THAT node if it is reached by any
+        'that' and topic, i.e. if the subtree is just "* <topic> *".
+        Otherwise, return None.
+        """
+        keys = self._keys(node)
+        if keys != [self._STAR]:
+            return None
+        star = self._child(node, self._STAR)
+        keys = self._keys(star)
+        if not keys:
+            return self._template(star)
+        if keys != [self._TOPIC]:
+            return None
+        topic = self._child(star, self._TOPIC)
+        if self._keys(topic) != [self._STAR]:
+            return None
+        topicStar = self._child(topic, self._STAR)
+        if self._keys(topicStar):
+            return None
+        return self._template(topicStar)
+
     def star(self, starType, pattern, that, topic, index):
         """Returns a string, the portion of pattern that was matched by a *.
 
@@ -164,170 +394,149 @@ class PatternMgr:
          - 'star': matches a star in the main pattern.
          - 'thatstar': matches a star in the that pattern.
          - 'topicstar': matches a star in the topic pattern.
-        """
-        # Mutilate the input.  Remove all punctuation and convert the
-        # text to all caps.
-        input_ = pattern.upper()
-        input_ = re.sub(self._puncStripRE, " ", input_)
-        input_ = re.sub(self._whitespaceRE, " ", input_)
-        if that.strip() == u"": that = u"ULTRABOGUSDUMMYTHAT" # 'that' must never be empty
-        thatInput = that.upper()
-        thatInput = re.sub(self._puncStripRE, " ", thatInput)
-        thatInput = re.sub(self._whitespaceRE, " ", thatInput)
-        if topic.strip() == u"": topic = u"ULTRABOGUSDUMMYTOPIC" # 'topic' must never be empty
-        topicInput = topic.upper()
-        topicInput = re.sub(self._puncStripRE, " ", topicInput)
-        topicInput = re.sub(self._whitespaceRE, " ", topicInput)
 
-        # Pass the input off to the recursive pattern-matcher
-        patMatch, template = self._match(input_.split(), thatInput.split(), topicInput.split(), self._root)
-        if template == None:
+        This runs the whole match again; when the Match returned by
+        match() is at hand, use its star() method instead.
+        """
+        match = self.match(pattern, that, topic)
+        if match is None:
             return ""
+        return match.star(starType, index)
 
-        # Extract the appropriate portion of the pattern, based on the
-        # starType argument.
-        words = None
-        if starType == 'star':
-            patMatch = patMatch[:patMatch.index(self._THAT)]
-            words = input_.split()
-        elif starType == 'thatstar':
-            patMatch = patMatch[patMatch.index(self._THAT)+1 : patMatch.index(self._TOPIC)]
-            words = thatInput.split()
-        elif starType == 'topicstar':
-            patMatch = patMatch[patMatch.index(self._TOPIC)+1 :]
-            words = topicInput.split()
-        else:
-            # unknown value
-            raise ValueError( "starType must be in ['star', 'thatstar', 'topicstar']" )
-        
-        # compare the input string to the matched pattern, word by word.
-        # At the end of this loop, if foundTheRightStar is true, start and
-        # end will contain the start and end indices (in "words") of
-        # the substring that the desired star matched.
-        foundTheRightStar = False
-        start = end = j = numStars = k = 0
-        for i in range(len(words)):
-            # This condition is true after processing a star
-            # that ISN'T the one we're looking for.
-            if i < k:
-                continue
-            # If we're reached the end of the pattern, we're done.
-            if j == len(patMatch):
-                break
-            if not foundTheRightStar:
-                if patMatch[j] in [self._STAR, self._UNDERSCORE]: #we got a star
-                    numStars += 1
-                    if numStars == index:
-                        # This is the star we care about.
-                        foundTheRightStar = True
-                    start = i
-                    # Iterate through the rest of the string.
-                    for k in range (i, len(words)):
-                        # If the star is at the end of the pattern,
-                        # we know exactly where it ends.
-                        if j+1  == len (patMatch):
-                            end = len (words)
-                            break
-                        # If the words have started matching the
-                        # pattern again, the star has ended.
-                        if patMatch[j+1] == words[k]:
-                            end = k - 1
-                            i = k
-                            break
-                # If we just finished processing the star we cared
-                # about, we exit the loop early.
-                if foundTheRightStar:
-                    break
-            # Move to the next element of the pattern.
-            j += 1
-            
-        # extract the star words from the original, unmutilated input.
-        if foundTheRightStar:
-            #print( ' '.join(pattern.split()[start:end+1]) )
-            if starType == 'star': return ' '.join(pattern.split()[start:end+1])
-            elif starType == 'thatstar': return ' '.join(that.split()[start:end+1])
-            elif starType == 'topicstar': return ' '.join(topic.split()[start:end+1])
-        else: return u""
-
-    def _match(self, words, thatWords, topicWords, root):
-        """Return a tuple (pat, tem) where pat is a list of nodes, starting
-        at the root and leading to the matching pattern, and tem is the
-        matched template.
-
-        """ 
-        # base-case: if the word list is empty, return the current node's
-        # template.
-        if len(words) == 0:
-            # we're out of words.
-            pattern = []
-            template = None
-            if len(thatWords) > 0:
-                # If thatWords isn't empty, recursively
-                # pattern-match on the _THAT node with thatWords as words.
-                try:
-                    pattern, template = self._match(thatWords, [], topicWords, root[self._THAT])
-                    if pattern != None:
-                        pattern = [self._THAT] + pattern
-                except KeyError:
-                    pattern = []
-                    template = None
-            elif len(topicWords) > 0:
-                # If thatWords is empty and topicWords isn't, recursively pattern
-                # on the _TOPIC node with topicWords as words.
-                try:
-                    pattern, template = self._match(topicWords, [], [], root[self._TOPIC])
-                    if pattern != None:
-                        pattern = [self._TOPIC] + pattern
-                except KeyError:
-                    pattern = []
-                    template = None
-            if template == None:
-                # we're totally out of input.  Grab the template at this node.
-                pattern = []
-                try: template = root[self._TEMPLATE]
-                except KeyError: template = None
-            return (pattern, template)
-
-        first = words[0]
-        suffix = words[1:]
-        
-        # Check underscore.
-        # Note: this is causing problems in the standard AIML set, and is
-        # currently disabled.
-        if self._UNDERSCORE in root:
-            # Must include the case where suf is [] in order to handle the case
-            # where a * or _ is at the end of the pattern.
-            for j in range(len(suffix)+1):
-                suf = suffix[j:]
-                pattern, template = self._match(suf, thatWords, topicWords, root[self._UNDERSCORE])
-                if template is not None:
-                    newPattern = [self._UNDERSCORE] + pattern
-                    return (newPattern, template)
+    # _child(node, key) returns the child of node reached through key, or
+    # None.  For dictionary nodes, that's just dict.get().
+    _child = staticmethod(dict.get)
 
-        # Check first
-        if first in root:
-            pattern, template = self._match(suffix, thatWords, topicWords, root[first])
-            if template is not None:
-                newPattern = [first] + pattern
-                return (newPattern, template)
+    def _template(self, node):
+        """Return the template stored at node, or None."""
+        return node.get(self._TEMPLATE)
 
-        # check bot name
-        if self._BOT_NAME in root and first == self._botName:
-            pattern, template = self._match(suffix, thatWords, topicWords, root[self._BOT_NAME])
-            if template is not None:
-                newPattern = [first] + pattern
-                return (newPattern, template)
-        
-        # check star
-        if self._STAR in root:
-            # Must include the case where suf is [] in order to handle the case
-            # where a * or _ is at the end of the pattern.
-            for j in range(len(suffix)+1):
-                suf = suffix[j:]
-                pattern, template = self._match(suf, thatWords, topicWords, root[self._STAR])
+    def _nodeKey(self, node):
+        """Return a hashable value identifying node."""
+        return id(node)
+
+    def _keys(self, node):
+        """Return the keys of the children of node."""
+        return [key for key in node if key != self._TEMPLATE]
+
+    def _keyName(self, key):
+        """Return the dictionary key (a word or a special key) for a key
+        returned by _keys()."""
+        return key
+
+    def _wordKeys(self, words):
+        """Return the keys under which the words are stored in the node
+        tree, with None for words that no pattern contains."""
+        return words
+
+    def _match(self, words, thatWords, topicWords, root, accept=None):
+        """Return a tuple (spans, tem) where tem is the matched template
+        and spans holds three lists, one each for the input, 'that' and
+        'topic' words, with a (start, end) pair of word indices for every
+        * or _ in the matched pattern.  If nothing matches, return
+        (None, None).
+
+        The node tree is walked depth-first, with an explicit stack of the
+        alternatives that remain to be tried.  At each node, alternatives
+        are tried in priority order: _ (shortest span first), the literal
+        word, the bot's name and * (shortest span first).  When the words
+        of one context run out, the matcher moves on to the next context
+        (pattern, then 'that', then 'topic') and falls back to the template
+        stored at the node if that fails.
+
+        Whether a search from a given node and position succeeds doesn't
+        depend on how the matcher got there, so every (node, context,
+        position) state reached through a wildcard that failed is
+        remembered and never explored again.  This bounds backtracking by the number of such states,
+        where a plain depth-first search can take exponential time on long
+        inputs.
+
+        If given, accept(node) replaces _template() to find the template
+        of a node where the words run out.
+        """
+        phaseWords = (words, thatWords, topicWords)
+        phaseKeys = [self._wordKeys(ws) for ws in phaseWords]
+        # What follows the end of each context: the key of the node
+        # holding the next context, and the context's number.
+        if len(thatWords) > 0:
+            nextPhase = [(self._THAT, 1), None, None]
+        else:
+            nextPhase = [None, None, None]
+        if len(topicWords) > 0:
+            nextPhase[1] = (self._TOPIC, 2)
+            if nextPhase[0] is None:
+                nextPhase[0] = (self._TOPIC, 2)
+
+        child = self._child
+        nodeTemplate = accept or self._template
+        nodeKey = self._nodeKey
+        botName = self._botName
+        UNDERSCORE, STAR, BOT_NAME = self._UNDERSCORE, self._STAR, self._BOT_NAME
+        ACCEPT, FAILED = -1, -2
+        failed = set()
+        # Each entry is (node, phase, pos, spans, wildStart).  'spans' is a
+        # linked list of (previous, phase, start, end) tuples; wildStart is
+        # the position where the wildcard leading to node started, or -1.
+        # ACCEPT entries test the template at node; FAILED entries are
+        # popped once every alternative of the state in 'spans' failed.
+        stack = [(root, 0, 0, None, -1)]
+        push = stack.append
+        while stack:
+            node, phase, pos, spans, wildStart = stack.pop()
+            if phase < 0:
+                if phase == FAILED:
+                    failed.add(spans)
+                    continue
+                template = nodeTemplate(node)
                 if template is not None:
-                    newPattern = [self._STAR] + pattern
-                    return (newPattern, template)
+                    break
+                continue
+            if wildStart >= 0:
+                # Only states entered through a wildcard can be reached
+                # more than once: the path to any other node is unique.
+                state = (nodeKey(node), phase, pos)
+                if state in failed:
+                    continue
+                push((node, FAILED, pos, state, -1))
+                spans = (spans, phase, wildStart, pos)
+            ws = phaseWords[phase]
+            n = len(ws)
+            if pos == n:
+                # Out of words in this context: try the next context, and
+                # failing that the template at this node.
+                push((node, ACCEPT, 0, spans, -1))
+                following = nextPhase[phase]
+                if following is not None:
+                    c = child(node, following[0])
+                    if c is not None:
+                        push((c, following[1], 0, spans, -1))
+                continue
+            # Push the alternatives, lowest priority first.
+            c = child(node, STAR)
+            if c is not None:
+                for end in range(n, pos, -1):
+                    push((c, phase, end, spans, pos))
+            c = child(node, BOT_NAME)
+            if c is not None and ws[pos] == botName:
+                push((c, phase, pos+1, spans, -1))
+            key = phaseKeys[phase][pos]
+            if key is not None:
+                c = child(node, key)
+                if c is not None:
+                    push((c, phase, pos+1, spans, -1))
+            c = child(node, UNDERSCORE)
+            if c is not None:
+                for end in range(n, pos, -1):
+                    push((c, phase, end, spans, pos))
+        else:
+            # No matches were found.
+            return (None, None)
 
-        # No matches were found.
-        return (None, None)         
+        # Unwind the captured spans.
+        captured = ([], [], [])
+        while spans is not None:
+            spans, phase, start, end = spans
+            captured[phase].append((start, end))
+        for c in captured:
+            c.reverse()
+        return (captured, template)
@@ -0,0 +1,94 @@
+"""
+This file contains the PyAIML history benchmark.  It times Kernel.respond()
+on inputs of 1 to 50 sentences, and the history bookkeeping done for each
+sentence: the deques sessions use now against the lists trimmed with
+pop(0) used up to python-aiml 0.9.3, which are reproduced below.
+
+Usage: python bench_history.py [number of inputs]
+
+The kernel learns the test suite's self-test.aiml.
+"""
+from __future__ import print_function
+
+import os.path
+import sys
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+import aiml
+
+ROUNDS = 3
+SENTENCES = ["test input", "test bot", "test that", "test nothing like this",
+             "test star having multiple stars in a pattern makes me extremely happy"]
+
+
+def listHistory(session, sentences, maxHistorySize):
+    """The history bookkeeping of Kernel.respond() in python-aiml 0.9.3,
+    with the predicate lookups done for each sentence."""
+    finalResponse = u""
+    for s in sentences:
+        inputHistory = session["_inputHistory"]
+        inputHistory.append(s)
+        while len(inputHistory) > maxHistorySize:
+            inputHistory.pop(0)
+        session["_inputHistory"] = inputHistory
+        response = s
+        outputHistory = session["_outputHistory"]
+        outputHistory.append(response)
+        while len(outputHistory) > maxHistorySize:
+            outputHistory.pop(0)
+        session["_outputHistory"] = outputHistory
+        finalResponse += (response + u"  ")
+    return finalResponse.strip()
+
+
+def dequeHistory(session, sentences, maxHistorySize):
+    """The history bookkeeping of Kernel.respond() now."""
+    responses = []
+    inputHistory = session.inputHistory
+    outputHistory = session.outputHistory
+    for s in sentences:
+        inputHistory.append(s)
+        response = s
+        outputHistory.append(response)
+        responses.append(response)
+    return u"  ".join(responses).strip()
+
+
+def bestTime(function, inputs):
+    """Return the best time to call function on all the inputs, over
+    ROUNDS runs."""
+    times = []
+    for i in range(ROUNDS):
+        start = time.time()
+        for input_ in inputs:
+            function(input_)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    k = aiml.Kernel()
+    k.verbose(False)
+    k.learn(os.path.join(os.path.dirname(os.path.abspath(__file__)), "test", "self-test.aiml"))
+    size = k._maxHistorySize
+    listSession = {"_inputHistory": [], "_outputHistory": []}
+    dequeSession = aiml.Kernel()._sessions.acquire("bench")
+    print( "%d inputs per size" % count )
+    print( "%10s %12s %12s %8s %14s" % ("sentences", "lists (s)", "deques (s)", "speedup", "respond() (s)") )
+    for n in (1, 5, 10, 20, 50):
+        sentences = [SENTENCES[i % len(SENTENCES)] for i in range(n)]
+        inputs = [sentences] * count
+        listTime = bestTime(lambda s: listHistory(listSession, s, size), inputs)
+        dequeTime = bestTime(lambda s: dequeHistory(dequeSession, s, size), inputs)
+        text = ". ".join(sentences)
+        respondTime = bestTime(lambda s: k.respond(s, "bench"), [text] * (count // 10))
+        print( "%10d %12.3f %12.3f %7.1fx %14.3f" % (n, listTime, dequeTime, listTime / dequeTime,
+                                                   respondTime) )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+This file contains the PyAIML brain loading benchmark.  It saves each brain
+as an uncompressed, a zlib and an lzma compressed tree brain file and as a
+mapped brain file, and compares their sizes, their cold load times and the
+time BrainFile.validate() takes to check them.
+
+Usage: python bench_load.py [brain.brn ...]
+
+Without arguments, Speak's shipped brains (bot/*.brn) are used.  Before
+each load, the file is evicted from the page cache with posix_fadvise()
+where available, so that the time includes reading it from storage.
+"""
+from __future__ import print_function
+
+import glob
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+import aiml
+from aiml import BrainFile
+
+ROUNDS = 5
+FORMATS = [("tree", {}), ("zlib", {"compress": "zlib"}),
+           ("lzma", {"compress": "lzma"}), ("mapped", {"mapped": True})]
+
+
+def evict(filename):
+    """Drop filename from the page cache, if the platform allows."""
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+
+def loadTime(filename):
+    """Return the best time to load filename, over ROUNDS cold loads."""
+    times = []
+    for i in range(ROUNDS):
+        evict(filename)
+        k = aiml.Kernel()
+        k.verbose(False)
+        start = time.time()
+        k.loadBrain(filename)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def validateTime(filename):
+    """Return the best time to validate filename, over ROUNDS runs."""
+    times = []
+    for i in range(ROUNDS):
+        start = time.time()
+        BrainFile.validate(filename)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main():
+    brains = sys.argv[1:]
+    if not brains:
+        brains = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                               '..', '..', 'bot', '*.brn')))
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print( "%-16s %-8s %10s %10s %14s" % ("brain", "format", "size (KB)", "load (s)",
+                                              "validate (ms)") )
+        for brain in brains:
+            k = aiml.Kernel()
+            k.verbose(False)
+            k.loadBrain(brain)
+            for name, options in FORMATS:
+                if name == "lzma" and BrainFile.lzma is None:
+                    continue
+                filename = os.path.join(tmpdir, "%s.%s" % (os.path.basename(brain), name))
+                k.saveBrain(filename, **options)
+                print( "%-16s %-8s %10d %10.3f %14.2f" % (os.path.basename(brain), name,
+                                                         os.path.getsize(filename) // 1024,
+                                                         loadTime(filename),
+                                                         validateTime(filename) * 1000) )
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
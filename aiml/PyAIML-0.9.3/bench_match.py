@@ -0,0 +1,133 @@
+"""
+This file contains the PyAIML matcher benchmark.  It feeds inputs of 1 to
+500 words to the alice brain and compares the PatternMgr matcher against
+the recursive matcher used up to python-aiml 0.9.3, which is reproduced
+below.
+
+Usage: python bench_match.py [path/to/alice.brn]
+
+Without an argument, the brain is built from Speak's bot/alice/*.aiml.
+"""
+from __future__ import print_function
+
+import glob
+import os.path
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+import aiml
+from aiml.PatternMgr import PatternMgr
+
+
+def recursiveMatch(mgr, words, thatWords, topicWords, root):
+    """The recursive PatternMgr._match() of python-aiml 0.9.3."""
+    if len(words) == 0:
+        pattern = []
+        template = None
+        if len(thatWords) > 0:
+            try:
+                pattern, template = recursiveMatch(mgr, thatWords, [], topicWords, root[mgr._THAT])
+                if pattern != None:
+                    pattern = [mgr._THAT] + pattern
+            except KeyError:
+                pattern = []
+                template = None
+        elif len(topicWords) > 0:
+            try:
+                pattern, template = recursiveMatch(mgr, topicWords, [], [], root[mgr._TOPIC])
+                if pattern != None:
+                    pattern = [mgr._TOPIC] + pattern
+            except KeyError:
+                pattern = []
+                template = None
+        if template == None:
+            pattern = []
+            try: template = root[mgr._TEMPLATE]
+            except KeyError: template = None
+        return (pattern, template)
+
+    first = words[0]
+    suffix = words[1:]
+    if mgr._UNDERSCORE in root:
+        for j in range(len(suffix)+1):
+            pattern, template = recursiveMatch(mgr, suffix[j:], thatWords, topicWords, root[mgr._UNDERSCORE])
+            if template is not None:
+                return ([mgr._UNDERSCORE] + pattern, template)
+    if first in root:
+        pattern, template = recursiveMatch(mgr, suffix, thatWords, topicWords, root[first])
+        if template is not None:
+            return ([first] + pattern, template)
+    if mgr._BOT_NAME in root and first == mgr._botName:
+        pattern, template = recursiveMatch(mgr, suffix, thatWords, topicWords, root[mgr._BOT_NAME])
+        if template is not None:
+            return ([first] + pattern, template)
+    if mgr._STAR in root:
+        for j in range(len(suffix)+1):
+            pattern, template = recursiveMatch(mgr, suffix[j:], thatWords, topicWords, root[mgr._STAR])
+            if template is not None:
+                return ([mgr._STAR] + pattern, template)
+    return (None, None)
+
+
+def loadBrain():
+    mgr = PatternMgr()
+    if len(sys.argv) > 1:
+        mgr.restore(sys.argv[1])
+        return mgr
+    k = aiml.Kernel()
+    k.verbose(False)
+    botdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'bot', 'alice')
+    for f in sorted(glob.glob(os.path.join(botdir, '*.aiml'))):
+        k.learn(f)
+    return k._brain
+
+
+def main():
+    print( "Loading the alice brain..." )
+    mgr = loadBrain()
+    # Draw words from the patterns themselves, so that the matcher has
+    # to backtrack through real branches of the tree.
+    vocabulary = sorted(w for w in mgr._root if not isinstance(w, int))
+    random.seed(1234)
+    thatWords = u"ULTRABOGUSDUMMYTHAT".split()
+    topicWords = u"ULTRABOGUSDUMMYTOPIC".split()
+
+    # The recursive matcher backtracks exponentially on long inputs: give
+    # it this many seconds per input length, and skip it for longer inputs
+    # once that is exceeded.
+    recursiveBudget = 10.0
+    print( "%6s %8s %16s %16s" % ("words", "inputs", "recursive", "iterative") )
+    for length in (1, 2, 5, 10, 20, 50, 100, 200, 500):
+        inputs = [[random.choice(vocabulary) for i in range(length)]
+                  for n in range(50)]
+
+        start = time.time()
+        iterative = [mgr._match(ws, thatWords, topicWords, mgr._root)[1] for ws in inputs]
+        iterativeTime = "%13.1f us" % ((time.time() - start) / len(inputs) * 1e6)
+
+        recursiveTime = "%16s" % "skipped"
+        if recursiveBudget is not None:
+            recursive = []
+            start = time.time()
+            try:
+                for ws in inputs:
+                    recursive.append(recursiveMatch(mgr, ws, thatWords, topicWords, mgr._root)[1])
+                    if time.time() - start > recursiveBudget:
+                        recursiveBudget = None
+                        break
+                recursiveTime = "%13.1f us" % ((time.time() - start) / len(recursive) * 1e6)
+            except RuntimeError:
+                # RecursionError on Python 3.5+
+                recursiveBudget = None
+                recursive = []
+                recursiveTime = "%16s" % "RecursionError"
+            assert all(a is b for a, b in zip(recursive, iterative)), \
+                "matchers disagree on %d-word inputs" % length
+        print( "%6d %8d %s %s" % (length, len(inputs), recursiveTime, iterativeTime) )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+This file contains the PyAIML parser benchmark.  It parses a set of AIML
+files with each of the parsers AimlParser.create_parser() can make, checks
+that they find the same categories, and compares their parse time and
+peak memory use.
+
+Usage: python bench_parser.py [file.aiml ...]
+
+Without arguments, Speak's bot/alice/*.aiml are parsed.  Peak memory is
+measured with tracemalloc, which requires Python 3.4 or later.
+"""
+from __future__ import print_function
+
+import glob
+import os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from aiml.AimlParser import create_parser, PARSERS
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+ROUNDS = 3
+
+
+def parseAll(parser, filenames):
+    """Parse the files and return the list of their categories."""
+    categories = []
+    for f in filenames:
+        aimlParser = create_parser(parser)
+        aimlParser.parse(f)
+        categories.append(aimlParser.getContentHandler().categories)
+    return categories
+
+
+def parseTime(parser, filenames):
+    """Return the best time to parse the files, over ROUNDS runs."""
+    times = []
+    for i in range(ROUNDS):
+        start = time.time()
+        parseAll(parser, filenames)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def peakMemory(parser, filenames):
+    """Return the peak memory, in MB, allocated while parsing the files
+    one at a time, or None without tracemalloc."""
+    if tracemalloc is None:
+        return None
+    peak = 0
+    for f in filenames:
+        tracemalloc.start()
+        parseAll(parser, [f])
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return peak / 1024.0 / 1024.0
+
+
+def main():
+    filenames = sys.argv[1:]
+    if not filenames:
+        filenames = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                  '..', '..', 'bot', 'alice', '*.aiml')))
+    reference = parseAll(PARSERS[0], filenames)
+    for parser in PARSERS[1:]:
+        if parseAll(parser, filenames) != reference:
+            print( "%s parser: categories differ from the %s parser!" % (parser, PARSERS[0]) )
+            sys.exit(1)
+    print( "%d files, %d categories" % (len(filenames), sum(len(c) for c in reference)) )
+    print( "%-8s %12s %16s" % ("parser", "time (s)", "peak memory (MB)") )
+    for parser in PARSERS:
+        memory = peakMemory(parser, filenames)
+        print( "%-8s %12.2f %16s" % (parser, parseTime(parser, filenames),
+                                     "%.1f" % memory if memory is not None else "n/a") )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+This file contains the PyAIML session store benchmark.  It creates a large
+number of synthetic sessions in each session store, the way a Kernel does
+when it serves that many users, then times requests to random sessions,
+and reports the memory held by the sessions (with tracemalloc, Python 3).
+
+Usage: python bench_sessions.py [number of sessions] [sessions in memory]
+
+The memory store keeps every session; the LRU memory store and the sqlite
+store keep only the given number of them in memory (1000 by default).
+"""
+from __future__ import print_function
+
+import os
+import os.path
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from aiml.SessionStore import MemorySessionStore, SqliteSessionStore
+
+REQUESTS = 20000
+
+
+def request(store, sessionID, i):
+    """Do what Kernel.respond() does to a session, for one sentence."""
+    session = store.acquire(sessionID)
+    try:
+        session["topic"] = u"topic %d" % (i % 10)
+        session.inputHistory.append(u"what is your name %d" % i)
+        session.outputHistory.append(u"my name is nobody %d" % i)
+        del session.inputHistory[:-10]
+        del session.outputHistory[:-10]
+    finally:
+        store.release(session)
+
+
+def bench(name, store, count):
+    """Fill the store with count sessions, then time random requests."""
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = time.time()
+    for i in range(count):
+        request(store, "user%d" % i, i)
+    fillTime = time.time() - start
+    memory = tracemalloc.get_traced_memory()[0] / 1e6 if tracemalloc is not None else float("nan")
+    if tracemalloc is not None:
+        tracemalloc.stop()
+
+    rnd = random.Random(0)
+    # Most requests come from recent users.
+    ids = ["user%d" % int(count * (1 - rnd.random() ** 4)) for i in range(REQUESTS)]
+    start = time.time()
+    for i, sessionID in enumerate(ids):
+        request(store, sessionID, i)
+    requestTime = time.time() - start
+    print( "%-10s %10.2f %10.1f %14.1f %10d" % (name, fillTime, memory,
+                                              requestTime / REQUESTS * 1e6, store.evictions) )
+    store.close()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    inMemory = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    print( "%d sessions, %d requests, %d sessions in memory" % (count, REQUESTS, inMemory) )
+    print( "%-10s %10s %10s %14s %10s" % ("store", "fill (s)", "mem (MB)", "request (us)", "evictions") )
+    bench("memory", MemorySessionStore(), count)
+    bench("lru", MemorySessionStore(maxSessions=inMemory), count)
+    tmp = tempfile.mkdtemp()
+    try:
+        bench("sqlite", SqliteSessionStore(os.path.join(tmp, "sessions.db"), inMemory), count)
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+This file contains the PyAIML template benchmark.  It renders every
+template of a brain, compiled (Kernel._renderTemplate) and interpreted
+(Kernel._processElement), checks that both give the same responses and
+leave the same predicates, and compares how many templates each renders
+per second.
+
+Usage: python bench_templates.py [path/to/brain.brn ...]
+
+Without an argument, Speak's shipped brains bot/*.brn are used.  The
+wildcards of every category match "uno dos tres".
+"""
+from __future__ import print_function
+
+import glob
+import os.path
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+import aiml
+from aiml.PatternMgr import Match
+
+ROUNDS = 3
+SESSION = "bench"
+
+
+def render(kernel, template):
+    """Render a template as if it had just been matched."""
+    session = kernel._sessions.acquire(SESSION)
+    session.matchStack.append(Match(template, [[(0, 1), (1, 2), (2, 3)]] * 3,
+                                    ["uno dos tres"] * 3))
+    try:
+        return kernel._renderTemplate(template, SESSION)
+    finally:
+        session.matchStack.pop()
+        kernel._sessions.release(session)
+
+
+def load(filename, compiled):
+    kernel = aiml.Kernel()
+    kernel.verbose(False)
+    kernel.loadBrain(filename)
+    kernel._compileTemplates = compiled
+    return kernel
+
+
+def compare(filename):
+    """Render every template with both kernels, in the same order and
+    with the same random numbers.  Returns the number of differences."""
+    kernels = [load(filename, True), load(filename, False)]
+    templates = [sorted(k._brain.categories()) for k in kernels]
+    differences = 0
+    for i, categories in enumerate(zip(*templates)):
+        results = []
+        for k, (pattern, that, topic, template) in zip(kernels, categories):
+            random.seed(i)
+            try: response = render(k, template)
+            except Exception as e: response = "%s: %s" % (type(e).__name__, e)
+            results.append((response, k.getSessionData(SESSION)))
+        if results[0] != results[1]:
+            differences += 1
+            print( "%s: %s differs:\n  compiled:    %r\n  interpreted: %r" % (
+                filename, categories[0][:3], results[0][0], results[1][0]) )
+    return len(templates[0]), differences
+
+
+def rate(filename, compiled):
+    """Return the number of templates rendered per second."""
+    kernel = load(filename, compiled)
+    templates = [template for pattern, that, topic, template in kernel._brain.categories()]
+    times = []
+    for i in range(ROUNDS):
+        random.seed(i)
+        start = time.time()
+        for template in templates:
+            render(kernel, template)
+        times.append(time.time() - start)
+    return len(templates) / min(times)
+
+
+def main():
+    filenames = sys.argv[1:] or sorted(glob.glob(os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', '..', 'bot', '*.brn')))
+    # <date/> must render the same in both kernels
+    time.asctime = lambda t=None: "Sun Oct 18 12:00:00 2026"
+    print( "%-16s %10s %12s %14s %12s %8s" % ("brain", "templates", "differences",
+                                              "interpreted/s", "compiled/s", "speedup") )
+    failed = False
+    for filename in filenames:
+        count, differences = compare(filename)
+        failed = failed or differences > 0
+        interpreted = rate(filename, False)
+        compiled = rate(filename, True)
+        print( "%-16s %10d %12d %14d %12d %7.1fx" % (os.path.basename(filename), count, differences,
+                                                     interpreted, compiled, compiled / interpreted) )
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
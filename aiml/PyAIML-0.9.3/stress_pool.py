@@ -0,0 +1,75 @@
+"""
+This file contains the PyAIML process pool benchmark.  It loads a brain
+into a Kernel, forks a KernelPool from it, and compares the throughput and
+latency of the pool against the single Kernel on the same requests.
+
+Usage: python stress_pool.py [path/to/brain.brn [numWorkers]]
+
+Without arguments, Speak's bot/alisochka.brn is served by one worker per
+CPU.
+"""
+from __future__ import print_function
+
+import os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+import aiml
+from aiml.KernelPool import KernelPool
+
+INPUTS = [
+    "hello", "what is your name", "how old are you", "do you like music",
+    "what is the weather like", "tell me a joke", "who made you",
+    "where do you live", "what can you do", "goodbye",
+]
+NUM_SESSIONS = 64
+BATCHES = 20
+LATENCY_REQUESTS = 500
+
+
+def batch(n):
+    return [("user%d" % s, INPUTS[(s + n) % len(INPUTS)]) for s in range(NUM_SESSIONS)]
+
+
+def throughput(respondMany):
+    start = time.time()
+    for n in range(BATCHES):
+        respondMany(batch(n))
+    return BATCHES * NUM_SESSIONS / (time.time() - start)
+
+
+def latency(respond):
+    times = []
+    for i in range(LATENCY_REQUESTS):
+        start = time.time()
+        respond(INPUTS[i % len(INPUTS)], "user%d" % (i % NUM_SESSIONS))
+        times.append(time.time() - start)
+    times.sort()
+    return times[len(times) // 2] * 1000, times[len(times) * 95 // 100] * 1000
+
+
+def main():
+    if len(sys.argv) > 1:
+        brainFile = sys.argv[1]
+    else:
+        brainFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'bot', 'alisochka.brn')
+    numWorkers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    k = aiml.Kernel()
+    k.verbose(False)
+    k.loadBrain(brainFile)
+    singleRespondMany = lambda requests: [k.respond(input_, sessionID) for sessionID, input_ in requests]
+    results = [("Kernel", throughput(singleRespondMany)) + latency(k.respond)]
+    with KernelPool(k, numWorkers) as pool:
+        name = "KernelPool(%d)" % pool.numWorkers()
+        results.append((name, throughput(pool.respondMany)) + latency(pool.respond))
+
+    print( "%-16s %12s %10s %10s" % ("", "req/s", "p50 (ms)", "p95 (ms)") )
+    for result in results:
+        print( "%-16s %12.1f %10.2f %10.2f" % result )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+This file contains the PyAIML threading benchmark.  It loads a brain into
+a Kernel and has several threads talk to it at once, each in its own
+session, first with the default Kernel (which serves one request at a
+time) and then with a concurrent Kernel (which only serializes requests
+made in the same session).
+
+Usage: python stress_threads.py [path/to/brain.brn]
+
+Without an argument, Speak's bot/alisochka.brn is used.  Note that under
+CPython the global interpreter lock still keeps the matcher itself from
+running in parallel; the concurrent Kernel only removes the Kernel-wide
+lock, so the numbers mostly show how much of that lock's cost is gone.
+"""
+from __future__ import print_function
+
+import os.path
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+import aiml
+
+INPUTS = [
+    "hello", "what is your name", "how old are you", "do you like music",
+    "what is the weather like", "tell me a joke", "who made you",
+    "where do you live", "what can you do", "goodbye",
+]
+REQUESTS_PER_THREAD = 200
+
+
+def talk(kernel, sessionID, count):
+    for i in range(count):
+        kernel.respond(INPUTS[i % len(INPUTS)], sessionID)
+
+
+def run(kernel, numThreads):
+    threads = [threading.Thread(target=talk, args=(kernel, "user%d" % i, REQUESTS_PER_THREAD))
+               for i in range(numThreads)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return numThreads * REQUESTS_PER_THREAD / (time.time() - start)
+
+
+def main():
+    if len(sys.argv) > 1:
+        brainFile = sys.argv[1]
+    else:
+        brainFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'bot', 'alisochka.brn')
+    kernels = []
+    for concurrent in (False, True):
+        k = aiml.Kernel(concurrent=concurrent)
+        k.verbose(False)
+        k.loadBrain(brainFile)
+        kernels.append(k)
+
+    print( "%8s %18s %18s" % ("threads", "locked (req/s)", "concurrent (req/s)") )
+    for numThreads in (1, 2, 4, 8):
+        print( "%8d %18.1f %18.1f" % ((numThreads,) + tuple(run(k, numThreads) for k in kernels)) )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# -*- coding: latin-1 -*-
+
+from __future__ import print_function
+import glob
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+import xml.sax
+
+from aiml import Kernel
+from aiml.AimlParser import create_parser, iterCategories
+
+
+HERE = os.path.dirname(__file__)
+
+BROKEN = """<aiml version="1.0.1">
+<category><pattern>GOOD</pattern><template>fine</template></category>
+<category><pattern>BAD</pattern><template><random>text</random></template></category>
+<category><pattern>STAR</pattern><template><star index="0"/></template></category>
+</aiml>
+"""
+
+
+def parse(parser, filename):
+    """Return the categories and the number of errors found by a parser."""
+    aimlParser = create_parser(parser)
+    handler = aimlParser.getContentHandler()
+    stderr, sys.stderr = sys.stderr, open(os.devnull, "w")
+    try:
+        aimlParser.parse(filename)
+    finally:
+        sys.stderr.close()
+        sys.stderr = stderr
+    return handler.categories, handler.getNumErrors()
+
+
+class TestAimlParser( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test01_same_categories( self ):
+        '''the expat parser finds the same categories as the SAX parser'''
+        files = sorted(glob.glob(os.path.join(HERE, "*.aiml")))
+        files += sorted(glob.glob(os.path.join(HERE, "..", "..", "..", "bot", "sara", "*.aiml")))
+        for f in files:
+            self.assertEqual( parse("sax", f), parse("expat", f), msg=f )
+
+    def test02_errors( self ):
+        '''invalid categories are skipped the same way'''
+        filename = os.path.join(self.dir, "broken.aiml")
+        with open(filename, "w") as f:
+            f.write(BROKEN)
+        categories, errors = parse("expat", filename)
+        self.assertEqual( [(u"GOOD", u"*", u"*")], list(categories) )
+        self.assertEqual( 2, errors )
+        self.assertEqual( (categories, errors), parse("sax", filename) )
+
+    def test03_fatal_errors( self ):
+        '''malformed XML raises a SAXParseException'''
+        filename = os.path.join(self.dir, "malformed.aiml")
+        with open(filename, "w") as f:
+            f.write("<aiml><category>")
+        for parser in ("sax", "expat"):
+            self.assertRaises( xml.sax.SAXParseException, parse, parser, filename )
+        self.assertRaises( ValueError, create_parser, "nonsense" )
+
+    def test04_learn( self ):
+        '''Kernel.learn() can use either parser'''
+        testfile = os.path.join(HERE, "self-test.aiml")
+        kernels = []
+        for parser in ("sax", "expat"):
+            k = Kernel()
+            k.verbose(False)
+            k.learn(testfile, parser=parser)
+            kernels.append(k)
+        self.assertEqual( kernels[0]._brain._root, kernels[1]._brain._root )
+        self.assertEqual( "My name is Nameless", kernels[1].respond("test bot") )
+
+    def test05_iter_categories( self ):
+        '''categories are yielded as they're read, up to a fatal error'''
+        testfile = os.path.join(HERE, "self-test.aiml")
+        for parser in ("sax", "expat"):
+            categories = {}
+            for key, template in iterCategories(testfile, parser=parser):
+                categories[key] = template
+            self.assertEqual( parse(parser, testfile)[0], categories )
+            filename = os.path.join(self.dir, "truncated.aiml")
+            with open(filename, "w") as f:
+                f.write(BROKEN[:BROKEN.index("<category><pattern>STAR")])
+            it = iterCategories(filename, parser=parser)
+            stderr, sys.stderr = sys.stderr, open(os.devnull, "w")
+            try:
+                self.assertEqual( (u"GOOD", u"*", u"*"), next(it)[0] )
+                self.assertRaises( xml.sax.SAXParseException, next, it )
+                # an error in the middle of a chunk keeps the categories before it
+                with open(filename, "w") as f:
+                    f.write(BROKEN[:BROKEN.index("<category><pattern>STAR")] + "</oops>")
+                it = iterCategories(filename, parser=parser)
+                self.assertEqual( (u"GOOD", u"*", u"*"), next(it)[0] )
+                self.assertRaises( xml.sax.SAXParseException, next, it )
+            finally:
+                sys.stderr.close()
+                sys.stderr = stderr
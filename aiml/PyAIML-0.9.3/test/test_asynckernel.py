@@ -0,0 +1,69 @@
+# -*- coding: latin-1 -*-
+
+from __future__ import print_function
+import os.path
+import unittest
+
+try:
+    import asyncio
+    from aiml.AsyncKernel import AsyncKernel
+except (ImportError, SyntaxError):
+    AsyncKernel = None
+
+from aiml import Kernel
+from aiml.KernelPool import KernelPool
+
+
+@unittest.skipIf(AsyncKernel is None, "AsyncKernel needs Python 3.7")
+class TestAsyncKernel( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.k = Kernel(concurrent=True)
+        self.k.verbose(False)
+        self.k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+
+    def tearDown(self):
+        del self.k
+
+    def _gather(self, ak, requests):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            return loop.run_until_complete(asyncio.gather(
+                *[ak.respond(input_, sessionID) for sessionID, input_ in requests]))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def test01_order( self ):
+        '''requests are answered in order within each session'''
+        for backend in (self.k, KernelPool(self.k, 2)):
+            ak = AsyncKernel(backend, batchWindow=0)
+            requests = []
+            for i in range(10):
+                requests += [("user%d" % i, "test thatstar"), ("user%d" % i, "you should test star begin")]
+            self.assertEqual( ["I say beans", "Begin star matched: you should"] * 10, self._gather(ak, requests) )
+            self.assertEqual( 0, ak.numCoalesced() )
+            if backend is not self.k:
+                backend.close()
+
+    def test02_coalesce( self ):
+        '''identical requests of a session in one window are answered once'''
+        ak = AsyncKernel(self.k)
+        requests = [("user1", "test thatstar"), ("user1", " test  thatstar"), ("user2", "test thatstar")]
+        self.assertEqual( ["I say beans"] * 3, self._gather(ak, requests) )
+        self.assertEqual( 1, ak.numCoalesced() )
+        self.assertEqual( 1, len(self.k.getPredicate("_inputHistory", "user1")) )
+
+    def test03_coalesce_in_a_row( self ):
+        '''only identical requests in a row are coalesced'''
+        ak = AsyncKernel(self.k)
+        requests = [("user1", "test that"), ("user1", "test thatstar"), ("user2", "test that"),
+                    ("user1", "test that"), ("user1", "test that")]
+        self.assertEqual( ["I just said:", "I say beans", "I just said:",
+                           "I just said: I say beans", "I just said: I say beans"],
+                          self._gather(ak, requests) )
+        self.assertEqual( 1, ak.numCoalesced() )
+        self.assertEqual( 3, len(self.k.getPredicate("_inputHistory", "user1")) )
@@ -0,0 +1,161 @@
+# -*- coding: latin-1 -*-
+
+from __future__ import print_function
+import multiprocessing
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+from aiml import Kernel, BrainBuilder
+
+
+AIML = """<?xml version="1.0" encoding="ISO-8859-1"?>
+<aiml version="1.0">
+<category><pattern>WHICH FILE</pattern><template>%s</template></category>
+</aiml>
+"""
+
+CATEGORY = "<category><pattern>%s</pattern><template>%s</template></category>"
+
+
+class TestBrainBuilder( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.pool = multiprocessing.Pool(2)
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.pool.close()
+        self.pool.join()
+        shutil.rmtree(self.dir)
+
+    def test01_learn( self ):
+        '''a brain built in parallel is the one Kernel.learn() builds'''
+        testfile = os.path.join(os.path.dirname(__file__), "self-test.aiml")
+        expected = Kernel()
+        expected.verbose(False)
+        expected.learn(testfile)
+        k = Kernel()
+        k.verbose(False)
+        report = BrainBuilder.learn(k, [testfile], self.pool)
+        self.assertEqual( [testfile], [f for f, n, parseTime, mergeTime in report] )
+        self.assertEqual( expected._brain._root, k._brain._root )
+
+    def test02_order( self ):
+        '''the last file defining a category wins'''
+        files = []
+        for name in ("b", "a", "bad", "c"):
+            filename = os.path.join(self.dir, name + ".aiml")
+            with open(filename, "w") as f:
+                f.write(AIML % name if name != "bad" else "<aiml>")
+            files.append(filename)
+        k = Kernel()
+        k.verbose(False)
+        report = BrainBuilder.learn(k, files, self.pool)
+        self.assertEqual( 3, len(report) )
+        self.assertEqual( "c", k.respond("which file") )
+        report = BrainBuilder.learn(k, files[:2], self.pool)
+        self.assertEqual( "a", k.respond("which file") )
+
+    def write(self, name, *categories):
+        filename = os.path.join(self.dir, name + ".aiml")
+        with open(filename, "w") as f:
+            f.write('<aiml version="1.0">%s</aiml>' % "".join(
+                CATEGORY % category for category in categories))
+        return filename
+
+    def test03_update( self ):
+        '''an updated brain matches the one built from scratch'''
+        files = [self.write("a", ("WHICH FILE", "a"), ("HELLO", "hi")),
+                 self.write("b", ("OLD", "old")),
+                 self.write("c", ("WHICH FILE", "c"))]
+        k = Kernel()
+        k.verbose(False)
+        job = BrainBuilder.submitUpdate(self.pool, files, [])
+        manifest, report = BrainBuilder.mergeUpdate(k, job)
+        self.assertEqual( 3, len(report) )
+        self.assertEqual( "c", k.respond("which file") )
+        manifestFile = os.path.join(self.dir, "brain.manifest")
+        BrainBuilder.saveManifest(manifestFile, manifest)
+        self.assertEqual( manifest, BrainBuilder.loadManifest(manifestFile) )
+
+        # nothing changed
+        job = BrainBuilder.submitUpdate(self.pool, files, manifest)
+        self.assertEqual( (manifest, []), BrainBuilder.mergeUpdate(k, job) )
+
+        # b is edited and c deleted: a's definition is back
+        self.write("b", ("NEW", "new"))
+        files = files[:2]
+        job = BrainBuilder.submitUpdate(self.pool, files, manifest)
+        manifest, report = BrainBuilder.mergeUpdate(k, job)
+        self.assertEqual( [files[1]], [f for f, n, parseTime, mergeTime in report] )
+        self.assertEqual( "a", k.respond("which file") )
+        self.assertEqual( "new", k.respond("new") )
+        self.assertEqual( "", k.respond("old") )
+
+        expected = Kernel()
+        expected.verbose(False)
+        BrainBuilder.learn(expected, files, self.pool)
+        self.assertEqual( expected._brain.numTemplates(), k._brain.numTemplates() )
+        for input_ in ("which file", "hello", "new", "old"):
+            self.assertEqual( expected.respond(input_), k.respond(input_) )
+
+    def test04_parse_error( self ):
+        '''the categories before a parse error are kept, as by Kernel.learn()'''
+        filename = self.write("broken", ("GOOD", "fine"), ("ALSO GOOD", "fine too"))
+        with open(filename, "a") as f:
+            f.write("</oops>")
+        expected = Kernel()
+        expected.verbose(False)
+        k = Kernel()
+        k.verbose(False)
+        stderr, sys.stderr = sys.stderr, open(os.devnull, "w")
+        try:
+            expected.learn(filename)
+            report = BrainBuilder.learn(k, [filename], self.pool)
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+        self.assertEqual( [], report )
+        self.assertEqual( 2, k._brain.numTemplates() )
+        self.assertEqual( expected._brain._root, k._brain._root )
+
+    def test05_update_errors( self ):
+        '''files that fail to parse are parsed again by the next update'''
+        files = [self.write("a", ("WHICH FILE", "a")),
+                 self.write("b", ("HELLO", "hi")),
+                 self.write("c", ("WHICH FILE", "c"))]
+        k = Kernel()
+        k.verbose(False)
+        manifest, report = BrainBuilder.mergeUpdate(k, BrainBuilder.submitUpdate(self.pool, files, []))
+        stderr, sys.stderr = sys.stderr, open(os.devnull, "w")
+        try:
+            # b breaks
+            with open(files[1], "w") as f:
+                f.write("<aiml>")
+            manifest, report = BrainBuilder.mergeUpdate(k, BrainBuilder.submitUpdate(self.pool, files, manifest))
+            self.assertEqual( None, manifest[1][1] )
+            self.assertEqual( "", k.respond("hello") )
+            # and is parsed again even though it didn't change since
+            job = BrainBuilder.submitUpdate(self.pool, files, manifest)
+            manifest, report = BrainBuilder.mergeUpdate(k, job)
+            self.assertEqual( [files[1]], [f for f, n, parseTime, mergeTime in report] )
+            self.write("b", ("HELLO", "hi"))
+            manifest, report = BrainBuilder.mergeUpdate(k, BrainBuilder.submitUpdate(self.pool, files, manifest))
+            self.assertEqual( BrainBuilder.fileHash(files[1]), manifest[1][1] )
+            self.assertEqual( "hi", k.respond("hello") )
+
+            # a breaks after c is deleted, while its definition is restored
+            job = BrainBuilder.submitUpdate(self.pool, files[:2], manifest)
+            with open(files[0], "w") as f:
+                f.write("<aiml>")
+            manifest, report = BrainBuilder.mergeUpdate(k, job)
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+        self.assertEqual( None, manifest[0][1] )
+        self.assertEqual( "", k.respond("which file") )
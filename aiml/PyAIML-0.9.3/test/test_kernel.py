@@ -1,12 +1,19 @@
 # -*- coding: latin-1 -*-
 
 from __future__ import print_function
+import glob
 import time
 import os.path
+import random
+import tempfile
+import threading
 import unittest
 
 from aiml import Kernel
+from aiml.PatternMgr import Match
 
+# The bots shipped with Speak, if this is a checkout of it.
+BOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "bot")
 
 
 class TestKernel( unittest.TestCase ):
@@ -141,6 +148,271 @@ class TestKernel( unittest.TestCase ):
     def test18_whitespace( self ):
         self._testTag('whitespace preservation', 'test whitespace', ["Extra   Spaces\n   Rule!   (but not in here!)    But   Here   They   Do!"])
 
+    def test19_concurrent( self ):
+        k = Kernel(concurrent=True)
+        k.verbose(False)
+        k._brain = self.k._brain
+        conversation = [("test thatstar", "I say beans"),
+                        ("test thatstar", "I just said \"beans\""),
+                        ("test star creamy goodness middle", "Middle star matched: creamy goodness"),
+                        ("test that", "I just said: Middle star matched: creamy goodness"),
+                        ("test that", "I have already answered this question")]
+        errors = []
+        def talk(sessionID):
+            for i in range(20):
+                for input_, output in conversation:
+                    response = k.respond(input_, sessionID)
+                    if response != output:
+                        errors.append((sessionID, input_, response))
+        threads = [threading.Thread(target=talk, args=("user%d" % i,)) for i in range(8)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        self.assertEqual( [], errors )
+        self.assertEqual( k._maxHistorySize, len(k.getPredicate("_inputHistory", "user3")) )
+
+    def test20_cache( self ):
+        self.k.verbose(False)
+        hits, misses, size = self.k.cacheStats()["match"]
+        self.assertEqual( "My name is Nameless", self.k.respond("test bot", "user1") )
+        self.assertEqual( "My name is Nameless", self.k.respond("test bot", "user2") )
+        self.assertEqual( (hits + 1, misses + 1), self.k.cacheStats()["match"][:2] )
+        # the cache is dropped when the patterns or the bot name change
+        self.assertEqual( "", self.k.respond("cache test") )
+        self.k._brain.add((u"CACHE TEST", u"", u""), ['template', {}, ['text', {'xml:space': 'default'}, u"learned"]])
+        self.assertEqual( "learned", self.k.respond("cache test") )
+        self.k._brain.add((u"BOT_NAME CACHE TEST", u"", u""), ['template', {}, ['text', {'xml:space': 'default'}, u"named"]])
+        self.assertEqual( "", self.k.respond("Bender cache test") )
+        self.k.setBotPredicate("name", "BENDER")
+        self.assertEqual( "named", self.k.respond("Bender cache test") )
+
+    def test21_pure( self ):
+        calls = []
+        renderTemplate = self.k._renderTemplate
+        self.k._renderTemplate = lambda template, sessionID: calls.append(id(template)) or renderTemplate(template, sessionID)
+        for sessionID in ("user1", "user2"):
+            self.assertEqual( "srai test passed", self.k.respond("test srai", sessionID) )
+            self.assertIn( self.k.respond("test random", sessionID), ["response #1", "response #2", "response #3"] )
+        # the pure templates were only rendered for the first session
+        self.assertEqual( 1, calls.count(id(self.k._brain.lookup((u"TEST SRAI", u"*", u"*")))) )
+        self.assertEqual( 2, calls.count(id(self.k._brain.lookup((u"TEST RANDOM", u"*", u"*")))) )
+
+    def test22_redirects( self ):
+        self.k.verbose(False)
+        # "test srai infinite" redirects to itself, and is left alone
+        self.assertEqual( (1, 1), self.k.resolveRedirects() )
+        self.assertEqual( (1, 1), self.k.resolveRedirects() )
+        self.assertEqual( "srai test passed", self.k.respond("test srai") )
+        self.assertEqual( "", self.k.respond("test srai infinite") )
+        srai = self.k._brain.lookup((u"TEST SRAI", u"*", u"*"))[2]
+        self.assertEqual( u"SRAI TARGET", srai[1]["pattern"] )
+        # a redirect whose category is gone falls back to matching
+        srai[1]["pattern"] = u"NO SUCH TARGET"
+        self.k._brain._matchCache.clear()
+        self.assertEqual( "srai test passed", self.k.respond("test srai", "user1") )
+
+    def test23_shared_brain( self ):
+        self.k.verbose(False)
+        fd, filename = tempfile.mkstemp(suffix='.brn')
+        os.close(fd)
+        try:
+            self.k.saveBrain(filename, mapped=True)
+            kernels = []
+            for shared in (True, True, False):
+                k = Kernel()
+                k.verbose(False)
+                k.loadBrain(filename, shared=shared)
+                kernels.append(k)
+            self.assertTrue( kernels[0]._brain._templates is kernels[1]._brain._templates )
+            self.assertFalse( kernels[0]._brain._templates is kernels[2]._brain._templates )
+            self.assertEqual( "srai test passed", kernels[1].respond("test srai") )
+            # loading another brain leaves the shared one alone
+            templates = kernels[0]._brain._templates
+            kernels[0].loadBrain(filename)
+            self.assertFalse( kernels[0]._brain._templates is templates )
+            self.assertEqual( self.k.numCategories(), kernels[1].numCategories() )
+            # a changed file is loaded again
+            self.k._brain.add((u"SHARED TEST", u"*", u"*"), ['template', {}])
+            self.k.saveBrain(filename, mapped=True)
+            st = os.stat(filename)
+            os.utime(filename, (st.st_atime, st.st_mtime + 10))
+            kernels[2].loadBrain(filename, shared=True)
+            self.assertFalse( kernels[2]._brain._templates is templates )
+            self.assertEqual( self.k.numCategories(), kernels[2].numCategories() )
+            Kernel.clearSharedBrains()
+            kernels[0].loadBrain(filename, shared=True)
+            self.assertFalse( kernels[0]._brain._templates is kernels[2]._brain._templates )
+        finally:
+            os.remove(filename)
+
         # Run an interactive interpreter
         #print( "\nEntering interactive mode (ctrl-c to exit)" )
         #while True: print( self.k.respond(raw_input("> ")) )
+
+    def test23_shared_bot_predicates( self ):
+        self.k.verbose(False)
+        fd, filename = tempfile.mkstemp(suffix='.brn')
+        os.close(fd)
+        try:
+            self.k.saveBrain(filename, mapped=True)
+            kernels = []
+            for name in (u"Alice", u"Bob"):
+                k = Kernel()
+                k.verbose(False)
+                k.loadBrain(filename, shared=True)
+                k.setBotPredicate("name", name)
+                kernels.append(k)
+        finally:
+            os.remove(filename)
+        # the pure response of one Kernel isn't reused by the other
+        for i in range(2):
+            self.assertEqual( "My name is Alice", kernels[0].respond("test bot") )
+            self.assertEqual( "My name is Bob", kernels[1].respond("test bot") )
+        self.assertEqual( u"Alice", kernels[0]._brain._botName )
+        self.assertEqual( u"Bob", kernels[1]._brain._botName )
+
+    def test24_history( self ):
+        self.k.verbose(False)
+        self.k._maxHistorySize = 3
+        self.assertEqual( "You just said: test input", self.k.respond("one. two. test input", "user1") )
+        self.k.respond("four. five", "user1")
+        self.assertEqual( ["test input", "four", "five"], self.k.getSessionData("user1")["_inputHistory"] )
+        self.assertEqual( 3, len(self.k.getPredicate("_outputHistory", "user1")) )
+
+    def test25_session_views( self ):
+        self.k.verbose(False)
+        self.k.setPredicate("name", "Alice", "user1")
+        view = self.k.getSession("user1")
+        self.assertEqual( None, self.k.getSession("nobody") )
+        self.assertEqual( "Alice", view["name"] )
+        self.assertFalse( hasattr(view, "__setitem__") )
+        # the view follows the session, without copying it
+        self.k.respond("test input", "user1")
+        self.assertEqual( ("test input",), view["_inputHistory"] )
+        data = view.copy()
+        self.assertEqual( data, self.k.getSessionData("user1") )
+        data["_inputHistory"].append("changed")
+        self.assertEqual( ("test input",), view["_inputHistory"] )
+        sessions = dict(self.k.iterSessions())
+        self.assertEqual( sorted([self.k._globalSessionID, "user1"]), sorted(sessions) )
+        self.assertEqual( dict((i, v.copy()) for i, v in sessions.items()), self.k.getSessionData() )
+
+    def test26_compiled( self ):
+        self.k.verbose(False)
+        testfile = os.path.join(os.path.dirname(__file__), "self-test.aiml")
+        interpreter = Kernel()
+        interpreter.verbose(False)
+        interpreter.learn(testfile)
+        interpreter._compileTemplates = False
+        asctime = time.asctime
+        time.asctime = lambda: "Sun Oct 18 12:00:00 2026"
+        try:
+            # every category, matched in a row so that <that> and the
+            # predicates carry over
+            for i, (pattern, that, topic, template) in enumerate(sorted(self.k._brain.categories())):
+                input_ = pattern.replace("*", "foo bar").replace("_", "foo bar")
+                responses = []
+                for k in (self.k, interpreter):
+                    random.seed(i)
+                    responses.append((k.respond(input_, "user1"), k.getSessionData("user1")))
+                self.assertEqual( responses[1], responses[0], msg="input=%s" % input_ )
+        finally:
+            time.asctime = asctime
+        self.assertTrue( len(self.k._compiledTemplates) > 40 )
+        self.assertEqual( {}, interpreter._compiledTemplates )
+
+    def test27_redirect_cycles( self ):
+        text = lambda s: ['text', {'xml:space': 'default'}, s]
+        srai = lambda s: ['srai', {}, text(s)]
+        def kernel(categories, intern, resolve):
+            k = Kernel()
+            k.verbose(False)
+            for pattern, template in categories:
+                k._brain.add((pattern, u"*", u"*"), template)
+            if intern: k.internTemplates()
+            if resolve: k.resolveRedirects()
+            return k
+        # HEY and HELLO share their <srai> once interned; marking HEY's
+        # must not send HELLO's round the cycle
+        categories = [(u"HI", ['template', {}, text(u"Well. "), srai(u"HELLO")]),
+                      (u"HEY", ['template', {}, srai(u"HELLO")]),
+                      (u"HELLO", ['template', {}, srai(u"HI")])]
+        expected = kernel(categories, False, False)
+        k = kernel(categories, True, True)
+        for input_ in ("hi", "hey", "hello"):
+            self.assertEqual( expected.respond(input_), k.respond(input_), msg="input=%s" % input_ )
+        # resolved redirects stop at the same depth as matched ones
+        categories = [(u"A", ['template', {}, text(u"x "), srai(u"B")]),
+                      (u"B", ['template', {}, srai(u"A")])]
+        expected = kernel(categories, False, False).respond("a")
+        self.assertEqual( 51, expected.count("x") )
+        k = kernel(categories, False, True)
+        self.assertEqual( expected, k.respond("a") )
+        k._compileTemplates = False
+        self.assertEqual( expected, k.respond("a", "user1") )
+
+    def test27_redirect_bot_name( self ):
+        self.k.verbose(False)
+        text = lambda s: ['text', {'xml:space': 'default'}, s]
+        self.k._brain.add((u"REDIRECT TEST", u"*", u"*"), ['template', {}, ['srai', {}, text(u"CALL ALICE")]])
+        self.k._brain.add((u"CALL BOT_NAME", u"*", u"*"), ['template', {}, text(u"That's me")])
+        self.k._brain.add((u"CALL *", u"*", u"*"), ['template', {}, text(u"Who?")])
+        self.k.resolveRedirects()
+        self.assertEqual( "Who?", self.k.respond("redirect test") )
+        # a redirect resolved for another bot name is matched again
+        self.k.setBotPredicate("name", "ALICE")
+        self.assertEqual( "That's me", self.k.respond("redirect test") )
+        # a redirect through the bot name is left alone
+        self.k.resolveRedirects()
+        srai = self.k._brain.lookup((u"REDIRECT TEST", u"*", u"*"))[2]
+        self.assertFalse( "pattern" in srai[1] )
+        self.assertEqual( "That's me", self.k.respond("redirect test", "user1") )
+
+    @unittest.skipUnless(os.path.isdir(BOT_DIR), "no shipped bots")
+    def test28_shipped_brains( self ):
+        # Every template of every shipped bot, rendered compiled and
+        # interpreted.  A bot without a brain file is learned from its
+        # AIML files.
+        sources = []
+        for directory in sorted(glob.glob(os.path.join(BOT_DIR, "*", ""))):
+            files = os.path.join(directory, "*.aiml")
+            if glob.glob(files):
+                brain = os.path.normpath(directory) + ".brn"
+                sources.append(brain if os.path.exists(brain) else files)
+        self.assertTrue( len(sources) > 0 )
+        def kernel(source, compiled):
+            k = Kernel()
+            k.verbose(False)
+            if source.endswith(".brn"): k.loadBrain(source)
+            else: k.learn(source)
+            k._compileTemplates = compiled
+            # Some categories recurse through <sr/> at every level, which
+            # takes exponential time up to the default limit.
+            k._maxRecursionDepth = 10
+            return k
+        def render(k, template):
+            session = k._sessions.acquire("user1")
+            session.matchStack.append(Match(template, [[(0, 1), (1, 2), (2, 3)]] * 3,
+                                            [u"uno dos tres"] * 3))
+            try:
+                return k._renderTemplate(template, "user1")
+            except Exception as e:
+                return "%s: %s" % (type(e).__name__, e)
+            finally:
+                session.matchStack.pop()
+                k._sessions.release(session)
+        asctime = time.asctime
+        time.asctime = lambda t=None: "Sun Oct 18 12:00:00 2026"
+        try:
+            for source in sources:
+                kernels = [kernel(source, True), kernel(source, False)]
+                categories = [sorted(k._brain.categories()) for k in kernels]
+                self.assertTrue( len(categories[0]) > 0, msg=source )
+                for i, pair in enumerate(zip(*categories)):
+                    responses = []
+                    for k, (pattern, that, topic, template) in zip(kernels, pair):
+                        random.seed(i)
+                        responses.append((render(k, template), k.getSessionData("user1")))
+                    self.assertEqual( responses[1], responses[0],
+                                      msg="%s: %s" % (os.path.basename(source), pair[0][:3]) )
+        finally:
+            time.asctime = asctime
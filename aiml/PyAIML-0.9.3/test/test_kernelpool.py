@@ -0,0 +1,76 @@
+# -*- coding: latin-1 -*-
+
+from __future__ import print_function
+import gc
+import os.path
+import threading
+import unittest
+
+from aiml import Kernel
+from aiml.KernelPool import KernelPool
+
+
+class FailingKernel(Kernel):
+    """A Kernel whose "boom" predicate raises an error that can't be
+    pickled."""
+
+    def getPredicate(self, name, sessionID=Kernel._globalSessionID):
+        if name == "boom":
+            raise ValueError(threading.Lock())
+        return Kernel.getPredicate(self, name, sessionID)
+
+
+class TestKernelPool( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.k = Kernel()
+        self.k.verbose(False)
+        self.k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+        self.pool = KernelPool(self.k, 3)
+
+    def tearDown(self):
+        self.pool.close()
+        del self.pool
+        del self.k
+
+    def test01_respondMany( self ):
+        '''responses come back in request order, sessions stay apart'''
+        requests = []
+        for i in range(10):
+            requests += [("user%d" % i, "test thatstar"), ("user%d" % i, "test thatstar")]
+        responses = self.pool.respondMany(requests)
+        self.assertEqual( ["I say beans", "I just said \"beans\""] * 10, responses )
+
+    def test02_predicates( self ):
+        '''predicates live in the worker serving the session'''
+        self.pool.setPredicate("gender", "male", "user1")
+        self.assertEqual( "male", self.pool.getPredicate("gender", "user1") )
+        self.assertEqual( "", self.k.getPredicate("gender", "user1") )
+        self.assertEqual( "You are handsome", self.pool.respond("test condition name value", "user1") )
+        self.assertEqual( ["test condition name value"],
+                          self.pool.getSessionData("user1")["_inputHistory"] )
+
+    def test03_methods( self ):
+        '''only session methods can be called in the workers'''
+        self.assertRaises( ValueError, self.pool._call, [("user1", "learn", ("x.aiml",))] )
+
+    def test04_errors( self ):
+        '''a failed request leaves the pool in step with its workers'''
+        k = FailingKernel()
+        k.verbose(False)
+        k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+        with KernelPool(k, 2) as pool:
+            pool.setPredicate("name", "Alice", "user1")
+            requests = [("user%d" % i, "getPredicate", ("name", "user%d" % i)) for i in range(6)]
+            self.assertRaises( RuntimeError, pool._call,
+                               requests + [("user2", "getPredicate", ("boom", "user2"))] )
+            self.assertEqual( ["", "Alice", "", "", "", ""], pool._call(requests) )
+
+    def test05_session_ids( self ):
+        '''sessions can be named by any value, the parent collects as usual'''
+        self.pool.setPredicate("name", "Bob", 42)
+        self.assertEqual( "Bob", self.pool.getPredicate("name", 42) )
+        if hasattr(gc, "get_freeze_count"):
+            self.assertEqual( 0, gc.get_freeze_count() )
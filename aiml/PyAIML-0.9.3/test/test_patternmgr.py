@@ -0,0 +1,329 @@
+# -*- coding: latin-1 -*-
+
+from __future__ import print_function
+import marshal
+import os.path
+import random
+import sys
+import tempfile
+import unittest
+import zlib
+
+from aiml import Kernel
+from aiml.PatternMgr import PatternMgr
+from aiml.CompiledPatternMgr import CompiledPatternMgr
+from aiml import BrainFile
+
+
+INPUTS = [
+    ("test bot", "", ""),
+    ("You should test star begin", "", ""),
+    ("test star having multiple stars in a pattern makes me extremely happy", "", ""),
+    ("test thatstar", "I say beans", ""),
+    ("test thatstar multiple", "I say beans and franks for everybody", ""),
+    ("test topic", "", "fruit"),
+    ("test topicstar multiple", "", "Soylent Ham and Cheese"),
+    ("test nothing like this", "", ""),
+    ("", "", ""),
+]
+
+
+def template(brain, pattern, that, topic):
+    """Return the template matched by brain, or None."""
+    match = brain.match(pattern, that, topic)
+    return match.template if match is not None else None
+
+
+class TestPatternMgr( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        testfile = os.path.join(os.path.dirname(__file__), "self-test.aiml")
+        self.brains = []
+        for compiledBrain in (False, True):
+            k = Kernel(compiledBrain)
+            k.verbose(False)
+            k.learn(testfile)
+            self.brains.append(k._brain)
+
+    def tearDown(self):
+        del self.brains
+
+    def test01_backend( self ):
+        '''the Kernel picks the requested backend'''
+        self.assertEqual( PatternMgr, type(self.brains[0]) )
+        self.assertEqual( CompiledPatternMgr, type(self.brains[1]) )
+        self.assertEqual( self.brains[0].numTemplates(),
+                          self.brains[1].numTemplates() )
+
+    def test02_match( self ):
+        '''both backends return the same templates'''
+        dictBrain, compiledBrain = self.brains
+        for pattern, that, topic in INPUTS:
+            self.assertEqual( template(dictBrain, pattern, that, topic),
+                              template(compiledBrain, pattern, that, topic),
+                              msg="input=%s" % pattern )
+
+    def test03_star( self ):
+        '''both backends return the same star contents'''
+        dictBrain, compiledBrain = self.brains
+        for pattern, that, topic in INPUTS[1:7]:
+            for starType in ('star', 'thatstar', 'topicstar'):
+                for index in (1, 2, 3):
+                    self.assertEqual( dictBrain.star(starType, pattern, that, topic, index),
+                                      compiledBrain.star(starType, pattern, that, topic, index),
+                                      msg="input=%s" % pattern )
+
+    def test04_add( self ):
+        '''categories can be added to a compiled brain'''
+        compiledBrain = self.brains[1]
+        self.assertEqual( None, template(compiledBrain, "compiled test", "", "") )
+        compiledBrain.add((u"COMPILED *", u"*", u"*"), ['template', {}])
+        self.assertEqual( ['template', {}], template(compiledBrain, "compiled test", "", "") )
+
+    def test05_save( self ):
+        '''saved brains restore into either backend'''
+        dictBrain, compiledBrain = self.brains
+        fd, filename = tempfile.mkstemp(suffix='.brn')
+        os.close(fd)
+        try:
+            compiledBrain.save(filename)
+            for restored in (PatternMgr(), CompiledPatternMgr()):
+                restored.restore(filename)
+                self.assertEqual( dictBrain.numTemplates(), restored.numTemplates() )
+                for pattern, that, topic in INPUTS:
+                    self.assertEqual( template(dictBrain, pattern, that, topic),
+                                      template(restored, pattern, that, topic) )
+        finally:
+            os.remove(filename)
+
+    def test06_mapped( self ):
+        '''mapped brains match like the original and decode lazily'''
+        dictBrain = self.brains[0]
+        fd, filename = tempfile.mkstemp(suffix='.brn')
+        os.close(fd)
+        try:
+            k = Kernel()
+            k.verbose(False)
+            k._brain = dictBrain
+            k.saveBrain(filename, mapped=True)
+            k = Kernel()
+            k.verbose(False)
+            k.loadBrain(filename)
+            restored = k._brain
+            self.assertEqual( CompiledPatternMgr, type(restored) )
+            self.assertEqual( 0, restored._templates.numDecoded() )
+            self.assertEqual( dictBrain.numTemplates(), restored.numTemplates() )
+            for pattern, that, topic in INPUTS:
+                self.assertEqual( template(dictBrain, pattern, that, topic),
+                                  template(restored, pattern, that, topic) )
+            self.assertTrue( restored._templates.numDecoded() < restored.numTemplates() )
+            self.assertEqual( "Extra   Spaces\n   Rule!   (but not in here!)    But   Here   They   Do!",
+                              k.respond("test whitespace") )
+            # adding a category to a mapped brain thaws it completely
+            restored.add((u"MAPPED TEST", u"*", u"*"), ['template', {}])
+            self.assertEqual( ['template', {}], template(restored, "mapped test", "", "") )
+            self.assertEqual( dictBrain.numTemplates() + 1, restored.numTemplates() )
+        finally:
+            os.remove(filename)
+
+    def test07_spans( self ):
+        '''stars capture the words of the pattern that actually matched'''
+        for brain in (PatternMgr(), CompiledPatternMgr()):
+            brain.add((u"* A B", u"*", u"*"), ['template', {}])
+            brain.add((u"X _ Y *", u"*", u"*"), ['template', {}])
+            self.assertEqual( u"A", brain.star('star', u"A A B", u"", u"", 1) )
+            self.assertEqual( u"y", brain.star('star', u"x y y Y z", u"", u"", 1) )
+            self.assertEqual( u"Y z", brain.star('star', u"x y y Y z", u"", u"", 2) )
+            self.assertEqual( u"", brain.star('star', u"x y y Y z", u"", u"", 3) )
+
+    def test08_long_input( self ):
+        '''long inputs neither recurse nor backtrack without bound'''
+        brain = self.brains[0]
+        words = u" ".join([u"star"] * 2000)
+        self.assertEqual( None, template(brain, u"test " + words, u"", u"") )
+        self.assertEqual( words + u" creamy", brain.star('star', u"test star %s creamy middle" % words, u"", u"", 1) )
+
+    def test09_match_spans( self ):
+        '''a single match captures the stars of all three contexts'''
+        for brain in self.brains:
+            match = brain.match(u"test thatstar multiple", u"I say beans and franks for everybody",
+                                u"Soylent Ham and Cheese")
+            self.assertEqual( u"beans", match.star('thatstar', 1) )
+            self.assertEqual( u"franks", match.star('thatstar', 2) )
+            self.assertEqual( u"", match.star('star', 1) )
+            self.assertRaises( ValueError, match.star, 'nostar', 1 )
+
+    def test10_kernel_matches_once( self ):
+        '''the Kernel doesn't match again to process <star/> tags'''
+        k = Kernel()
+        k.verbose(False)
+        k._brain = self.brains[1]
+        calls = []
+        match = k._brain.match
+        k._brain.match = lambda *args: calls.append(args) or match(*args)
+        self.assertEqual( "Multiple stars matched: having, stars in a pattern, extremely happy",
+                          k.respond("test star having multiple stars in a pattern makes me extremely happy") )
+        self.assertEqual( 1, len(calls) )
+
+    def test11_intern( self ):
+        '''identical templates and parts of templates are shared, and saved once'''
+        testfile = os.path.join(os.path.dirname(__file__), "self-test.aiml")
+        k = Kernel()
+        k.verbose(False)
+        k.learn(testfile)
+        for i in range(3):
+            k._brain.add((u"SHARED %d" % i, u"*", u"*"),
+                         ['template', {}, ['srai', {}, ['text', {'xml:space': 'default'}, u"TEST  BOT"]]])
+        expected = dict(((p, t, tp), template) for p, t, tp, template in k._brain.categories())
+        distinct = k.internTemplates()
+        self.assertEqual( k.numCategories() - 2, distinct )
+        fd, filename = tempfile.mkstemp(suffix='.brn')
+        os.close(fd)
+        try:
+            k.saveBrain(filename, mapped=True)
+            for restored in (k._brain, CompiledPatternMgr()):
+                if restored is not k._brain:
+                    restored.restore(filename)
+                shared = [restored.lookup((u"SHARED %d" % i, u"*", u"*")) for i in range(3)]
+                self.assertTrue( shared[0] is shared[1] is shared[2] )
+                self.assertEqual( ['text', {'xml:space': 'preserve'}, u"TEST BOT"], shared[0][2][2] )
+                self.assertEqual( len(expected), restored.numTemplates() )
+            k2 = Kernel()
+            k2.verbose(False)
+            k2.loadBrain(filename)
+            for input_ in ("shared 1", "test whitespace", "test random", "test condition name value"):
+                responses = []
+                for kernel in (k, k2):
+                    random.seed(1)
+                    responses.append(kernel.respond(input_))
+                self.assertEqual( responses[0], responses[1] )
+        finally:
+            os.remove(filename)
+
+    def test12_compressed( self ):
+        '''compressed brains restore into either backend'''
+        dictBrain = self.brains[0]
+        dictBrain.setBotName(u"Nameless")
+        fd, filename = tempfile.mkstemp(suffix='.brn')
+        os.close(fd)
+        try:
+            for method in ("zlib", "lzma"):
+                if method == "lzma" and BrainFile.lzma is None:
+                    continue
+                dictBrain.save(filename, compress=method)
+                self.assertTrue( BrainFile.isTreeFile(filename) )
+                self.assertEqual( (dictBrain.numTemplates(), u"Nameless"),
+                                  BrainFile.readTreeHeader(filename) )
+                for restored in (PatternMgr(), CompiledPatternMgr()):
+                    restored.restore(filename)
+                    self.assertEqual( dictBrain.numTemplates(), restored.numTemplates() )
+                    for pattern, that, topic in INPUTS:
+                        self.assertEqual( template(dictBrain, pattern, that, topic),
+                                          template(restored, pattern, that, topic) )
+            self.assertRaises( ValueError, dictBrain.save, filename, "rot13" )
+            # a truncated file is detected
+            with open(filename, "rb") as f:
+                data = f.read()
+            with open(filename, "wb") as f:
+                f.write(data[:len(data) // 2])
+            self.assertRaises( BrainFile.BrainFileError, BrainFile.readTree, filename )
+        finally:
+            os.remove(filename)
+
+    def test13_validate( self ):
+        '''damaged or incompatible brain files are rejected upfront'''
+        dictBrain = self.brains[0]
+        fd, filename = tempfile.mkstemp(suffix='.brn')
+        os.close(fd)
+        def damage(pos, value):
+            with open(filename, "r+b") as f:
+                f.seek(pos)
+                f.write(value)
+        try:
+            # a plain marshal file has nothing to check, but still loads
+            with open(filename, "wb") as f:
+                for value in (dictBrain.numTemplates(), dictBrain._botName, dictBrain._root):
+                    marshal.dump(value, f)
+            self.assertEqual( False, BrainFile.validate(filename) )
+            restored = PatternMgr()
+            restored.restore(filename)
+            self.assertEqual( dictBrain.numTemplates(), restored.numTemplates() )
+
+            for save in (dictBrain.save, self.brains[1].saveMapped):
+                save(filename)
+                self.assertEqual( True, BrainFile.validate(filename) )
+                size = os.path.getsize(filename)
+                damage(size - 10, b"#")
+                self.assertRaises( BrainFile.BrainFileError, BrainFile.validate, filename )
+            # the checksum of a tree file is checked when it's restored
+            dictBrain.save(filename)
+            damage(os.path.getsize(filename) - 10, b"#")
+            self.assertRaises( BrainFile.BrainFileError, PatternMgr().restore, filename )
+            # truncated
+            dictBrain.save(filename, compress="zlib")
+            with open(filename, "r+b") as f:
+                f.truncate(os.path.getsize(filename) - 1)
+            self.assertRaises( BrainFile.BrainFileError, BrainFile.validate, filename )
+            # written by a future marshal version
+            dictBrain.save(filename)
+            damage(19, b"\xff")
+            self.assertRaises( BrainFile.BrainFileError, BrainFile.validate, filename )
+            # written by another major Python version
+            for save in (dictBrain.save, self.brains[1].saveMapped):
+                save(filename)
+                damage(20, b"\x02" if sys.version_info[0] != 2 else b"\x03")
+                self.assertRaises( BrainFile.BrainFileError, BrainFile.validate, filename )
+            # truncated sections, under a checksum that matches
+            self.brains[1].saveMapped(filename)
+            with open(filename, "r+b") as f:
+                f.truncate(os.path.getsize(filename) - 100)
+                data = f.read()
+                tableStart = BrainFile._HEADER.size + BrainFile._INFO.size
+                info = BrainFile._INFO.unpack_from(data, BrainFile._HEADER.size)
+                f.seek(BrainFile._HEADER.size)
+                f.write(BrainFile._INFO.pack(info[0], info[1], info[2],
+                                             zlib.crc32(data[tableStart:]) & 0xffffffff))
+            self.assertRaises( BrainFile.BrainFileError, BrainFile.validate, filename )
+            # damaged compressed data
+            for method in ("zlib", "lzma"):
+                if method == "lzma" and BrainFile.lzma is None:
+                    continue
+                dictBrain.save(filename, compress=method)
+                damage(os.path.getsize(filename) // 2, b"\x00" * 20)
+                self.assertRaises( BrainFile.BrainFileError, PatternMgr().restore, filename )
+        finally:
+            os.remove(filename)
+
+    def test14_progress( self ):
+        '''loading a brain reports the bytes read'''
+        fd, filename = tempfile.mkstemp(suffix='.brn')
+        os.close(fd)
+        try:
+            for compress, mapped in ((None, False), ("zlib", False), (None, True)):
+                k = Kernel()
+                k.verbose(False)
+                k._brain = self.brains[0]
+                k.saveBrain(filename, mapped=mapped, compress=compress)
+                size = os.path.getsize(filename)
+                calls = []
+                k = Kernel()
+                k.verbose(False)
+                k.loadBrain(filename, lambda *args: calls.append(args))
+                self.assertEqual( (size, size), calls[-1], msg="compress=%s" % compress )
+                self.assertEqual( sorted(calls), calls )
+        finally:
+            os.remove(filename)
+
+    def test15_star_punctuation( self ):
+        '''stars capture the original words around punctuation'''
+        for brain in (PatternMgr(), CompiledPatternMgr()):
+            brain.add((u"WHAT IS *", u"*", u"*"), ['template', {}])
+            brain.add((u"ROCK *", u"*", u"*"), ['template', {}])
+            brain.add((u"* AND *", u"*", u"*"), ['template', {}])
+            self.assertEqual( u"5 + 5", brain.star('star', u"what is 5 + 5", u"", u"", 1) )
+            self.assertEqual( u"n-roll", brain.star('star', u"rock-n-roll", u"", u"", 1) )
+            self.assertEqual( u"x), y", brain.star('star', u"what is (x),  y?", u"", u"", 1) )
+            self.assertEqual( u"salt", brain.star('star', u"- salt, and pepper!", u"", u"", 1) )
+            self.assertEqual( u"pepper", brain.star('star', u"- salt, and pepper!", u"", u"", 2) )
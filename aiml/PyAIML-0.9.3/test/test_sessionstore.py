@@ -0,0 +1,110 @@
+# -*- coding: latin-1 -*-
+
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import unittest
+
+from aiml import Kernel
+from aiml.SessionStore import MemorySessionStore, SqliteSessionStore
+
+
+class TestSessionStore( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "sessions.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def use(self, store, sessionID, name=None, value=None):
+        """Acquire a session, optionally set a predicate, and release it."""
+        session = store.acquire(sessionID)
+        if name is not None:
+            session[name] = value
+        store.release(session, name is not None)
+        return session
+
+    def test01_lru( self ):
+        '''the least recently used sessions are evicted'''
+        store = MemorySessionStore(maxSessions=3)
+        for sessionID in ("a", "b", "c"):
+            self.use(store, sessionID, "name", sessionID)
+        self.use(store, "a")
+        self.use(store, "d")
+        self.assertEqual( ["a", "c", "d"], sorted(store.ids()) )
+        self.assertEqual( None, store.get("b") )
+        self.assertEqual( "a", store.get("a")["name"] )
+        self.assertEqual( 1, store.evictions )
+
+    def test02_ttl( self ):
+        '''sessions expire, unless they are pinned or in use'''
+        store = MemorySessionStore(ttl=0)
+        store.pin("global")
+        self.use(store, "global", "name", "kept")
+        busy = store.acquire("busy")
+        self.use(store, "gone", "name", "lost")
+        self.assertEqual( ["busy", "global"], sorted(store.ids()) )
+        self.assertEqual( "kept", store.get("global")["name"] )
+        store.release(busy)
+        self.use(store, "other")
+        self.assertEqual( ["global"], sorted(store.ids()) )
+
+    def test03_delete( self ):
+        '''deleted sessions leave nothing behind, even when in use'''
+        store = MemorySessionStore(maxSessions=1)
+        busy = store.acquire("a")
+        store.delete("a")
+        self.assertEqual( {}, store._users )
+        self.use(store, "a", "name", "new")
+        store.release(busy)
+        self.assertEqual( "new", store.get("a")["name"] )
+        # the new "a" isn't held by the old one's users
+        self.use(store, "b")
+        self.assertEqual( ["b"], store.ids() )
+        self.assertEqual( {}, store._users )
+
+    def test04_sqlite( self ):
+        '''sqlite sessions survive eviction and the store itself'''
+        store = SqliteSessionStore(self.filename, maxSessions=2)
+        for i in range(5):
+            session = store.acquire("user%d" % i)
+            session["name"] = u"User %d" % i
+            session.inputHistory.append(u"hello %d" % i)
+            store.release(session)
+        self.assertTrue( store.evictions > 0 )
+        self.assertEqual( 5, len(store) )
+        session = store.get("user0")
+        self.assertEqual( u"User 0", session["name"] )
+        self.assertTrue( session.inputHistory is session["_inputHistory"] )
+        store.delete("user4")
+        store.close()
+
+        store = SqliteSessionStore(self.filename)
+        self.assertEqual( ["user0", "user1", "user2", "user3"], sorted(store.ids()) )
+        self.assertEqual( [u"hello 3"], list(store.get("user3").inputHistory) )
+        store.close()
+
+    def test05_kernel( self ):
+        '''a Kernel keeps its sessions in the given store'''
+        testfile = os.path.join(os.path.dirname(__file__), "self-test.aiml")
+        store = SqliteSessionStore(self.filename, maxSessions=1)
+        k = Kernel(sessionStore=store)
+        k.verbose(False)
+        k.learn(testfile)
+        k.setPredicate("name", "Alice", "alice")
+        k.respond("test input", "bob")
+        self.assertEqual( "Alice", k.getPredicate("name", "alice") )
+        self.assertEqual( "", k.getPredicate("name", "carol") )
+        self.assertTrue( k._globalSessionID in k.getSessionData() )
+        store.close()
+
+        k = Kernel(sessionStore=SqliteSessionStore(self.filename))
+        k.verbose(False)
+        self.assertEqual( "Alice", k.getPredicate("name", "alice") )
+        self.assertEqual( ["test input"], k.getSessionData("bob")["_inputHistory"] )
+        k._sessions.close()
@@ -21,4 +21,37 @@ class TestUtils( unittest.TestCase ):
     def test_sentences( self ):
         sents = Utils.sentences("First.  Second, still?  Third and Final!  Well, not really")
         self.assertEqual( 4, len(sents) )
-
+        self.assertEqual( ["First", "Second"], Utils.sentences("First. Second!") )
+        self.assertEqual( ["First", "Second", ""], Utils.sentences("First. Second! ") )
+        self.assertEqual( ["First", "", "Second"], Utils.sentences("First..Second?") )
+        self.assertEqual( [""], Utils.sentences("") )
+        self.assertEqual( [""], Utils.sentences("?") )
+
+
+    def test_lrucache( self ):
+        cache = Utils.LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual( 1, cache.get("a") )
+        cache.put("c", 3)   # drops "b", the least recently used
+        self.assertEqual( None, cache.get("b") )
+        self.assertEqual( 3, cache.get("c") )
+        self.assertEqual( (2, 1, 2), cache.stats() )
+        cache.clear()
+        self.assertEqual( (2, 1, 0), cache.stats() )
+
+    def test_templateinterner( self ):
+        interner = Utils.TemplateInterner()
+        def template(text):
+            return ['template', {}, ['srai', {}, ['text', {'xml:space': 'default'}, text]],
+                    ['random', {}, ['li', {}, ['text', {'xml:space': 'preserve'}, 'a  b']]]]
+        t1 = interner.intern(template("HELLO   THERE"))
+        t2 = interner.intern(template("HELLO THERE"))
+        t3 = interner.intern(template("GOODBYE"))
+        self.assertTrue( t1 is t2 )
+        self.assertEqual( ['text', {'xml:space': 'preserve'}, 'HELLO THERE'], t1[2][2] )
+        self.assertFalse( t1 is t3 )
+        self.assertTrue( t1[3] is t3[3] )
+        self.assertTrue( t1[2][1] is t3[2][1] )
+        # preserved whitespace is left alone
+        self.assertEqual( 'a  b', t1[3][2][2][2] )
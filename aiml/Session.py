@@ -0,0 +1,119 @@
+'''
+The state of a single conversation with a Kernel.
+'''
+
+import copy
+import threading
+from collections import deque
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+class Session(dict):
+    """A session: a dictionary of predicates, plus the conversation state
+    the Kernel keeps for it.
+
+    The input and output histories and the input and match stacks are
+    plain attributes, so that the Kernel doesn't have to look them up as
+    predicates several times per sentence.  For compatibility, the
+    histories and the input stack are also reachable as the reserved
+    predicates "_inputHistory", "_outputHistory" and "_inputStack".
+
+    The histories are deques holding the last `maxHistory` entries: the
+    oldest entry is dropped as a new one is appended, and the recent
+    entries are found in constant time.
+
+    Each session has its own lock, which serializes the requests made in
+    that session when the Kernel runs in concurrent mode.
+    """
+
+    __slots__ = ("id", "inputHistory", "outputHistory", "inputStack",
+                 "matchStack", "impureCount", "lock")
+
+    def __init__(self, sessionID, maxHistory=10):
+        dict.__init__(self)
+        self.id = sessionID
+        self.inputHistory = self["_inputHistory"] = deque(maxlen=maxHistory)     # recent user input
+        self.outputHistory = self["_outputHistory"] = deque(maxlen=maxHistory)   # recent responses
+        self.inputStack = self["_inputStack"] = []         # empty in between calls to respond()
+        self.matchStack = []    # the Match for each template being processed
+        self.impureCount = 0    # number of impure templates processed so far
+        self.lock = threading.RLock()
+
+    def setMaxHistory(self, maxHistory):
+        """Change the number of entries kept in the histories, dropping
+        the oldest ones if need be."""
+        self.inputHistory = self["_inputHistory"] = deque(self.inputHistory, maxHistory)
+        self.outputHistory = self["_outputHistory"] = deque(self.outputHistory, maxHistory)
+
+    def getData(self):
+        """Return the predicates and histories of the session as a plain
+        dictionary, which shares nothing with the session."""
+        # dict.copy() and list() don't let other threads run, so the
+        # copy is consistent even while the session is in use.
+        data = dict.copy(self)
+        for k, v in data.items():
+            if isinstance(v, (list, deque)):
+                data[k] = list(v)
+        return data
+
+    def setData(self, data):
+        """Set the predicates and histories of the session from a
+        dictionary returned by getData()."""
+        for k, v in data.items():
+            if k in self and isinstance(self[k], list):
+                self[k][:] = v      # keep the attributes pointing to it
+            elif k in self and isinstance(self[k], deque):
+                self[k].clear()
+                self[k].extend(v)
+            else:
+                self[k] = v
+
+    def __deepcopy__(self, memo):
+        # Locks and matches can't (and needn't) be copied: a copy of a
+        # session is just a copy of its predicates, with the histories as
+        # lists, as they used to be.
+        return dict((copy.deepcopy(k, memo), copy.deepcopy(v, memo))
+                    for k, v in self.getData().items())
+
+
+class SessionView(Mapping):
+    """A read-only view of a session's predicates and histories.
+
+    Nothing is copied: the view reads the live session, and sees the
+    changes made to it.  The histories and the input stack read as
+    tuples, with the entries they hold when they are read.  copy()
+    returns a plain dictionary, as Kernel.getSessionData() does.
+    """
+
+    __slots__ = ("_session",)
+
+    def __init__(self, session):
+        self._session = session
+
+    @property
+    def id(self):
+        return self._session.id
+
+    def __getitem__(self, name):
+        value = self._session[name]
+        if isinstance(value, (list, deque)):
+            return tuple(value)
+        return value
+
+    def __iter__(self):
+        return iter(list(self._session))
+
+    def __len__(self):
+        return len(self._session)
+
+    def __contains__(self, name):
+        return name in self._session
+
+    def copy(self):
+        return self._session.getData()
+
+    def __repr__(self):
+        return "<SessionView %r>" % (self._session.id,)
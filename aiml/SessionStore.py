@@ -0,0 +1,244 @@
+"""This file contains the session stores, which hold the sessions of a
+Kernel: MemorySessionStore keeps them in memory, optionally dropping the
+least recently used ones; SqliteSessionStore keeps them in an sqlite3
+database, and only the recently used ones in memory.
+
+A store is handed to the Kernel when it is created:
+
+    k = aiml.Kernel(sessionStore=SqliteSessionStore("sessions.db"))
+"""
+
+from __future__ import print_function
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .Session import Session
+
+
+class SessionStore(object):
+    """The interface of a session store.
+
+    The Kernel acquire()s a session for as long as it works with it, and
+    release()s it afterwards, saying whether it changed.  Sessions that
+    are acquired stay in memory; the others may be dropped from memory
+    (evicted) whenever the store sees fit.
+
+    """
+
+    def acquire(self, sessionID):
+        """Return the session with the given ID, loading it or creating it
+        if need be, and keep it in memory until it is release()d."""
+        raise NotImplementedError
+
+    def release(self, session, changed=True):
+        """Release a session returned by acquire().  Once it is released
+        as many times as it was acquired, it is saved if it changed."""
+        raise NotImplementedError
+
+    def get(self, sessionID):
+        """Return the session with the given ID, or None if there is no
+        such session.  The session isn't created, and may be evicted at
+        any time: it should only be read."""
+        raise NotImplementedError
+
+    def delete(self, sessionID):
+        """Delete the session with the given ID, if there is one."""
+        raise NotImplementedError
+
+    def ids(self):
+        """Return a list of the IDs of all the sessions."""
+        raise NotImplementedError
+
+    def pin(self, sessionID):
+        """Never evict the session with the given ID."""
+        raise NotImplementedError
+
+    def close(self):
+        """Save what needs to be saved, and free the store's resources."""
+        pass
+
+    def __len__(self):
+        return len(self.ids())
+
+
+class MemorySessionStore(SessionStore):
+    """Keep the sessions in memory.
+
+    If `maxSessions` is given, the least recently used sessions are
+    evicted when there are more; if `ttl` is given, sessions unused for
+    more than `ttl` seconds are evicted.  Evicted sessions are lost.  By
+    default, sessions are kept forever.
+
+    The evictions attribute counts the evicted sessions.
+
+    """
+
+    def __init__(self, maxSessions=None, ttl=None):
+        self.maxSessions = maxSessions
+        self.ttl = ttl
+        self.evictions = 0
+        self._sessions = OrderedDict()  # ID -> Session, least recently used first
+        self._lastUsed = {}             # ID -> time of the last acquire()
+        self._users = {}                # ID -> number of acquire()s not released yet
+        self._changed = set()           # IDs of the acquired sessions that changed
+        self._pinned = set()
+        self._lock = threading.RLock()
+
+    # Hooks for stores that keep the sessions elsewhere as well.
+    def _load(self, sessionID):
+        """Return the stored session with the given ID, or None."""
+        return None
+
+    def _save(self, session):
+        """Store a session that changed."""
+        pass
+
+    def _forget(self, sessionID):
+        """Delete the stored session with the given ID."""
+        pass
+
+    def _storedIDs(self):
+        """Return the IDs of the stored sessions."""
+        return []
+
+    def _cache(self, sessionID, session, now):
+        """Keep session in memory, as the most recently used one."""
+        self._sessions[sessionID] = session
+        self._lastUsed[sessionID] = now
+
+    def acquire(self, sessionID):
+        now = time.time()
+        with self._lock:
+            session = self._sessions.pop(sessionID, None)
+            if session is None:
+                session = self._load(sessionID)
+                if session is None:
+                    session = Session(sessionID)
+                    self._changed.add(sessionID)
+            self._cache(sessionID, session, now)
+            self._users[sessionID] = self._users.get(sessionID, 0) + 1
+            return session
+
+    def release(self, session, changed=True):
+        with self._lock:
+            sessionID = session.id
+            if self._sessions.get(sessionID) is not session:
+                # Deleted while in use: forget about it.
+                return
+            if changed:
+                self._changed.add(sessionID)
+            users = self._users.pop(sessionID, 1) - 1
+            if users > 0:
+                self._users[sessionID] = users
+                return
+            if sessionID in self._changed:
+                self._changed.discard(sessionID)
+                self._save(session)
+            self._evict()
+
+    def get(self, sessionID):
+        # The Kernel calls this several times per sentence: sessions in
+        # memory are returned without taking the lock.
+        session = self._sessions.get(sessionID)
+        if session is not None:
+            return session
+        with self._lock:
+            session = self._sessions.get(sessionID)
+            if session is None:
+                session = self._load(sessionID)
+                if session is not None:
+                    self._cache(sessionID, session, time.time())
+                    self._evict()
+            return session
+
+    def delete(self, sessionID):
+        with self._lock:
+            self._sessions.pop(sessionID, None)
+            self._lastUsed.pop(sessionID, None)
+            self._users.pop(sessionID, None)
+            self._changed.discard(sessionID)
+            self._forget(sessionID)
+
+    def ids(self):
+        with self._lock:
+            ids = set(self._storedIDs())
+            ids.update(self._sessions)
+            return list(ids)
+
+    def pin(self, sessionID):
+        with self._lock:
+            self._pinned.add(sessionID)
+
+    def _evict(self):
+        """Evict the least recently used sessions while there are too
+        many, and the expired ones.  Acquired and pinned sessions are
+        kept, and count as just used."""
+        expired = time.time() - self.ttl if self.ttl is not None else None
+        for i in range(len(self._sessions)):
+            sessionID = next(iter(self._sessions))
+            if (self.maxSessions is None or len(self._sessions) <= self.maxSessions) and \
+                    (expired is None or self._lastUsed[sessionID] >= expired):
+                break
+            session = self._sessions.pop(sessionID)
+            if sessionID in self._users or sessionID in self._pinned:
+                self._sessions[sessionID] = session
+                continue
+            del self._lastUsed[sessionID]
+            self.evictions += 1
+
+
+class SqliteSessionStore(MemorySessionStore):
+    """Keep the sessions in an sqlite3 database.
+
+    Sessions are loaded on demand, and saved whenever they are released
+    with changes.  At most `maxSessions` of them stay in memory (None for
+    no limit), and none unused for more than `ttl` seconds if it's given;
+    evicted sessions are simply loaded again when needed.
+
+    Session IDs must be strings.  The predicates and histories are
+    stored as JSON.
+
+    """
+
+    def __init__(self, filename, maxSessions=1000, ttl=None):
+        MemorySessionStore.__init__(self, maxSessions, ttl)
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        # Each save is its own transaction: in WAL mode with synchronous
+        # NORMAL, committing one doesn't wait for the disk.
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS sessions "
+                         "(id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self._db.commit()
+
+    def _load(self, sessionID):
+        row = self._db.execute("SELECT data FROM sessions WHERE id = ?",
+                               (sessionID,)).fetchone()
+        if row is None:
+            return None
+        session = Session(sessionID)
+        session.setData(json.loads(row[0]))
+        return session
+
+    def _save(self, session):
+        self._db.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?)",
+                         (session.id, json.dumps(session.getData())))
+        self._db.commit()
+
+    def _forget(self, sessionID):
+        self._db.execute("DELETE FROM sessions WHERE id = ?", (sessionID,))
+        self._db.commit()
+
+    def _storedIDs(self):
+        return [row[0] for row in self._db.execute("SELECT id FROM sessions")]
+
+    def close(self):
+        with self._lock:
+            for sessionID in list(self._changed):
+                self._save(self._sessions[sessionID])
+            self._changed.clear()
+            self._db.close()
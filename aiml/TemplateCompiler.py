@@ -0,0 +1,359 @@
+"""This file contains the template compiler, which turns a template (the
+nested lists the AIML parser builds) into a tree of Python closures.
+
+Kernel._processElement() interprets a template: every element is looked
+up in the element processors, and every level builds its result with
+string concatenation.  A compiled template does the lookups once.  Each
+element becomes a function code(sessionID, out) that appends its text to
+the list out; elements that merely concatenate their contents (<template>,
+<li>, <condition>, <random>, ...) write straight into their parent's list,
+which is joined once at the end.  Only the elements that transform their
+contents (<uppercase>, <person>, <set>, ...) join their own list.
+
+A compiled element does exactly what its element processor does, in the
+same order.  Elements that have no compiled form, whose processor was
+replaced or overridden, or that are malformed fall back to the element
+processors.
+"""
+
+from __future__ import print_function
+
+import random
+import re
+import string
+import sys
+import time
+
+
+class TemplateCompiler(object):
+    """Compile the templates of a Kernel.  See Kernel._renderTemplate()."""
+
+    # element name -> (element processor, compiler method)
+    _compilers = {
+        "bot":          ("_processBot",         "_compileBot"),
+        "condition":    ("_processCondition",   "_compileCondition"),
+        "date":         ("_processDate",        "_compileDate"),
+        "formal":       ("_processFormal",      "_compileFormal"),
+        "gender":       ("_processGender",      "_compileGender"),
+        "get":          ("_processGet",         "_compileGet"),
+        "gossip":       ("_processGossip",      "_compileThink"),
+        "id":           ("_processId",          "_compileId"),
+        "input":        ("_processInput",       "_compileInput"),
+        "javascript":   ("_processJavascript",  "_compileThink"),
+        "li":           ("_processLi",          "_compileLi"),
+        "lowercase":    ("_processLowercase",   "_compileLowercase"),
+        "person":       ("_processPerson",      "_compilePerson"),
+        "person2":      ("_processPerson2",     "_compilePerson2"),
+        "random":       ("_processRandom",      "_compileRandom"),
+        "text":         ("_processText",        "_compileText"),
+        "sentence":     ("_processSentence",    "_compileSentence"),
+        "set":          ("_processSet",         "_compileSet"),
+        "size":         ("_processSize",        "_compileSize"),
+        "sr":           ("_processSr",          "_compileSr"),
+        "srai":         ("_processSrai",        "_compileSrai"),
+        "star":         ("_processStar",        "_compileStar"),
+        "template":     ("_processTemplate",    "_compileLi"),
+        "that":         ("_processThat",        "_compileThat"),
+        "thatstar":     ("_processThatstar",    "_compileThatstar"),
+        "think":        ("_processThink",       "_compileThink"),
+        "topicstar":    ("_processTopicstar",   "_compileTopicstar"),
+        "uppercase":    ("_processUppercase",   "_compileUppercase"),
+        "version":      ("_processVersion",     "_compileVersion"),
+    }
+
+    def __init__(self, kernel):
+        self._kernel = kernel
+        # The element processors of Kernel itself, to tell them from
+        # replaced or overridden ones.
+        from .Kernel import Kernel
+        self._builtins = Kernel.__dict__
+
+    def compile(self, elem):
+        """Return the compiled form of an element: a function taking a
+        session ID and a list, which appends the element's text to the
+        list."""
+        try:
+            processor, compiler = self._compilers[elem[0]]
+            handler = self._kernel._elementProcessors[elem[0]]
+        except Exception:
+            return self._interpret(elem)
+        if not self._isBuiltin(handler, processor):
+            return self._interpret(elem)
+        # <gossip> and <javascript> call _processThink() themselves.
+        if processor in ("_processGossip", "_processJavascript") and \
+                not self._isBuiltin(self._kernel._processThink, "_processThink"):
+            return self._interpret(elem)
+        try:
+            return getattr(self, compiler)(elem)
+        except Exception:
+            # A malformed element fails when (and if) it is processed.
+            return self._interpret(elem)
+
+    def _isBuiltin(self, method, name):
+        """Return True if method is the Kernel's own processor name."""
+        return getattr(method, "__func__", None) is self._builtins.get(name)
+
+    def _interpret(self, elem):
+        processElement = self._kernel._processElement
+        def interpret(sessionID, out):
+            out.append(processElement(elem, sessionID))
+        return interpret
+
+    def _sequence(self, elems):
+        """Compile elements whose texts are concatenated."""
+        codes = tuple(self.compile(e) for e in elems)
+        if len(codes) == 1:
+            return codes[0]
+        def sequence(sessionID, out):
+            for code in codes:
+                code(sessionID, out)
+        return sequence
+
+    def _render(self, elems):
+        """Compile elements whose texts are concatenated into a string."""
+        code = self._sequence(elems)
+        def render(sessionID):
+            out = []
+            code(sessionID, out)
+            return u"".join(out)
+        return render
+
+    def _transform(self, elem, function):
+        """Compile an element whose text is function() of its contents."""
+        render = self._render(elem[2:])
+        def transform(sessionID, out):
+            out.append(function(render(sessionID)))
+        return transform
+
+    def _starIndex(self, elem):
+        try: return int(elem[1]['index'])
+        except KeyError: return 1
+
+    def _compileBot(self, elem):
+        getBotPredicate = self._kernel.getBotPredicate
+        name = elem[1]['name']
+        def bot(sessionID, out):
+            out.append(getBotPredicate(name))
+        return bot
+
+    def _compileCondition(self, elem):
+        kernel = self._kernel
+        getPredicate = kernel.getPredicate
+        attr = elem[1]
+
+        # Case #1: a single predicate and value.
+        if 'name' in attr and 'value' in attr:
+            name = attr['name']
+            value = attr['value']
+            code = self._sequence(elem[2:])
+            def condition(sessionID, out):
+                if getPredicate(name, sessionID) == value:
+                    code(sessionID, out)
+            return condition
+
+        # Cases #2 and #3: the first <li> whose predicate has its value,
+        # or the last <li> if it has neither name nor value.  Malformed
+        # lists raise errors, which _processCondition() reports.
+        name = attr.get('name', None)
+        listitems = [e for e in elem[2:] if e[0] == 'li']
+        if len(listitems) == 0:
+            return self._sequence([])
+        tests = []
+        for li in listitems:
+            liAttr = li[1]
+            if len(liAttr) == 0 and li == listitems[-1]:
+                continue
+            liName = name if name is not None else liAttr['name']
+            tests.append((liName, liAttr['value'], self.compile(li), li))
+        last = listitems[-1]
+        default = None
+        if not ('name' in last[1] or 'value' in last[1]):
+            default = self.compile(last)
+        def condition(sessionID, out):
+            verbose = kernel._verboseMode
+            try:
+                for liName, liValue, code, li in tests:
+                    try:
+                        if getPredicate(liName, sessionID) == liValue:
+                            code(sessionID, out)
+                            return
+                    except Exception:
+                        if verbose: print("Something amiss -- skipping listitem", li)
+                        raise
+                if default is not None:
+                    try:
+                        default(sessionID, out)
+                    except Exception:
+                        if verbose: print("error in default listitem")
+                        raise
+            except Exception:
+                if verbose: print("catastrophic condition failure")
+                raise
+        return condition
+
+    def _compileDate(self, elem):
+        def date(sessionID, out):
+            out.append(time.asctime())
+        return date
+
+    def _compileFormal(self, elem):
+        return self._transform(elem, string.capwords)
+
+    def _subber(self, elem, name):
+        subbers = self._kernel._subbers
+        return self._transform(elem, lambda text: subbers[name].sub(text))
+
+    def _compileGender(self, elem):
+        return self._subber(elem, 'gender')
+
+    def _compileGet(self, elem):
+        getPredicate = self._kernel.getPredicate
+        name = elem[1]['name']
+        def get(sessionID, out):
+            out.append(getPredicate(name, sessionID))
+        return get
+
+    def _compileId(self, elem):
+        def id_(sessionID, out):
+            out.append(sessionID)
+        return id_
+
+    def _history(self, index, attribute, tag):
+        kernel = self._kernel
+        sessions = kernel._sessions
+        def history(sessionID, out):
+            try: out.append(getattr(sessions.get(sessionID), attribute)[-index])
+            except IndexError:
+                if kernel._verboseMode:
+                    err = "No such index %d while processing <%s> element.\n" % (index, tag)
+                    sys.stderr.write(err)
+                out.append("")
+        return history
+
+    def _compileInput(self, elem):
+        try: index = int(elem[1]['index'])
+        except: index = 1
+        return self._history(index, "inputHistory", "input")
+
+    def _compileLi(self, elem):
+        return self._sequence(elem[2:])
+
+    def _compileLowercase(self, elem):
+        return self._transform(elem, lambda text: text.lower())
+
+    def _compilePerson(self, elem):
+        if len(elem[2:]) == 0:  # atomic <person/> = <person><star/></person>
+            elem = [elem[0], elem[1], ['star', {}]]
+        return self._subber(elem, 'person')
+
+    def _compilePerson2(self, elem):
+        if len(elem[2:]) == 0:  # atomic <person2/> = <person2><star/></person2>
+            elem = [elem[0], elem[1], ['star', {}]]
+        return self._subber(elem, 'person2')
+
+    def _compileRandom(self, elem):
+        codes = [self.compile(e) for e in elem[2:] if e[0] == 'li']
+        if len(codes) == 0:
+            return self._sequence([])
+        shuffle = random.shuffle
+        def random_(sessionID, out):
+            # Shuffle like _processRandom(), so that the same random
+            # numbers pick the same <li>.
+            listitems = list(codes)
+            shuffle(listitems)
+            listitems[0](sessionID, out)
+        return random_
+
+    def _compileText(self, elem):
+        try:
+            elem[2] + ""
+        except TypeError:
+            raise TypeError("Text element contents are not text")
+        if elem[1]["xml:space"] == "default":
+            elem[2] = re.sub(r"\s+", " ", elem[2])
+            elem[1]["xml:space"] = "preserve"
+        text = elem[2]
+        def text_(sessionID, out):
+            out.append(text)
+        return text_
+
+    def _compileSentence(self, elem):
+        def sentence(response):
+            words = response.strip().split(" ", 1)
+            words[0] = words[0].capitalize()
+            return ' '.join(words)
+        return self._transform(elem, sentence)
+
+    def _compileSet(self, elem):
+        setPredicate = self._kernel.setPredicate
+        name = elem[1]['name']
+        render = self._render(elem[2:])
+        def set_(sessionID, out):
+            value = render(sessionID)
+            setPredicate(name, value, sessionID)
+            out.append(value)
+        return set_
+
+    def _compileSize(self, elem):
+        numCategories = self._kernel.numCategories
+        def size(sessionID, out):
+            out.append(str(numCategories()))
+        return size
+
+    def _compileSr(self, elem):
+        kernel = self._kernel
+        render = self._render([['star', {}]])
+        def sr(sessionID, out):
+            out.append(kernel._respond(render(sessionID), sessionID))
+        return sr
+
+    def _compileSrai(self, elem):
+        kernel = self._kernel
+        render = self._render(elem[2:])
+        def srai(sessionID, out):
+            # A <srai> marked by resolveRedirects() names its category;
+            # the marks may change after compiling.
+            if "pattern" in elem[1]:
+                response = kernel._redirect(elem[1], sessionID)
+                if response is not None:
+                    out.append(response)
+                    return
+            out.append(kernel._respond(render(sessionID), sessionID))
+        return srai
+
+    def _star(self, elem, starType):
+        index = self._starIndex(elem)
+        sessions = self._kernel._sessions
+        def star(sessionID, out):
+            out.append(sessions.get(sessionID).matchStack[-1].star(starType, index))
+        return star
+
+    def _compileStar(self, elem):
+        return self._star(elem, "star")
+
+    def _compileThat(self, elem):
+        index = 1
+        try: index = int(elem[1]['index'].split(',')[0])
+        except Exception: pass
+        return self._history(index, "outputHistory", "that")
+
+    def _compileThatstar(self, elem):
+        return self._star(elem, "thatstar")
+
+    def _compileThink(self, elem):
+        code = self._sequence(elem[2:])
+        def think(sessionID, out):
+            code(sessionID, [])
+        return think
+
+    def _compileTopicstar(self, elem):
+        return self._star(elem, "topicstar")
+
+    def _compileUppercase(self, elem):
+        return self._transform(elem, lambda text: text.upper())
+
+    def _compileVersion(self, elem):
+        version = self._kernel.version
+        def version_(sessionID, out):
+            out.append(version())
+        return version_
@@ -3,25 +3,119 @@ modules in the PyAIML package.
 
 """
 
+import re
+import threading
+from collections import OrderedDict
+
+_sentenceEndRE = re.compile(r"[.?!]")
+
 def sentences(s):
     """Split the string s into a list of sentences."""
     try: s+""
     except: raise TypeError( "s must be a string" )
-    pos = 0
-    sentenceList = []
-    l = len(s)
-    while pos < l:
-        try: p = s.index('.', pos)
-        except: p = l+1
-        try: q = s.index('?', pos)
-        except: q = l+1
-        try: e = s.index('!', pos)
-        except: e = l+1
-        end = min(p,q,e)
-        sentenceList.append( s[pos:end].strip() )
-        pos = end+1
+    # Split in a single pass.  Text after the last full stop only makes a
+    # sentence if there is some.
+    pieces = _sentenceEndRE.split(s)
+    if len(pieces[-1]) == 0: pieces.pop()
+    sentenceList = [p.strip() for p in pieces]
     # If no sentences were found, return a one-item list containing
     # the entire input string.
     if len(sentenceList) == 0: sentenceList.append(s)
     return sentenceList
 
+
+class LRUCache(object):
+    """A thread-safe dictionary holding at most maxSize entries.  When it
+    is full, the least recently used entry is dropped.  The hits and
+    misses attributes count the outcomes of get().
+
+    """
+
+    def __init__(self, maxSize=1024):
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Return the value of key (marking it as recently used), or
+        default if there is none."""
+        with self._lock:
+            try: value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Store value under key, dropping the least recently used entry
+        if the cache is full."""
+        if self.maxSize <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            if len(self._data) > self.maxSize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries.  The counters are kept."""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Return a (hits, misses, size) tuple."""
+        return (self.hits, self.misses, len(self._data))
+
+
+class TemplateInterner(object):
+    """Hash-cons AIML templates: structurally identical templates,
+    elements, attribute dictionaries and strings passed through intern()
+    come out as one shared object.
+
+    Shared parts must never be modified in place.  The Kernel only ever
+    modifies text elements, the first time it processes them, to collapse
+    their whitespace; intern() does that for them upfront.
+
+    """
+
+    _whitespace = re.compile(r"\s+")
+
+    def __init__(self):
+        self._objects = {}
+
+    def __len__(self):
+        return len(self._objects)
+
+    def intern(self, elem):
+        """Return the shared copy of an element (or a whole template)."""
+        name, attr = elem[0], elem[1]
+        if name == "text" and attr.get("xml:space") == "default":
+            attr = {"xml:space": "preserve"}
+            children = [self._share(self._whitespace.sub(" ", elem[2]))]
+        else:
+            children = [self.intern(e) if isinstance(e, list) else self._share(e)
+                        for e in elem[2:]]
+        attr = self._share(attr)
+        key = (self._share(name), id(attr)) + tuple(
+            id(e) if isinstance(e, list) else e for e in children)
+        try: return self._objects[key]
+        except KeyError:
+            elem = self._objects[key] = [key[0], attr] + children
+            return elem
+
+    def _share(self, value):
+        """Return the shared copy of a string or an attribute dictionary."""
+        key = tuple(sorted(value.items())) if isinstance(value, dict) else value
+        try: return self._objects[key]
+        except KeyError:
+            if isinstance(value, dict):
+                value = dict((self._share(k), self._share(v)) for k, v in value.items())
+            self._objects[key] = value
+            return value
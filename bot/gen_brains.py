@@ -18,23 +18,58 @@
 # A simple hack to attach a chatterbot to speak activity
 #coding=utf-8
 
+from __future__ import print_function
+
 from aiml.Kernel import Kernel
+from aiml import BrainBuilder
 import glob
+import os
+import multiprocessing
+import time
 
-k = Kernel()
-laiml = glob.glob("sara/*.aiml") #devuelve lista con ficheros *.aiml
-for fichero in laiml:
-    k.learn(str(fichero))
-k.saveBrain("sara.brn")
+BOTS = ["sara", "alice", "alisochka"]
+# The bot names Speak sets when it loads the brains (see brain.py).
+BOT_NAMES = {"alice": "Alice", "alisochka": "Alice"}
 
-k = Kernel()
-laiml = glob.glob("alice/*.aiml") #devuelve lista con ficheros *.aiml
-for fichero in laiml:
-    k.learn(str(fichero))
-k.saveBrain("alice.brn")
+def compileBrain(k, filename, botName=None):
+    # Resolve the constant <srai> redirects, then share identical
+    # templates and parts of templates, before saving.  The redirects
+    # only hold for the bot name they were resolved with.
+    if botName is not None:
+        k.setBotPredicate("name", botName)
+    redirects, depth = k.resolveRedirects()
+    print("%s: %d redirects resolved, longest chain %d" % (filename, redirects, depth))
+    distinct = k.internTemplates()
+    print("%s: %d distinct templates for %d categories" % (filename, distinct, k.numCategories()))
+    k.saveBrain(filename, mapped=True)
 
-k = Kernel()
-laiml = glob.glob("alisochka/*.aiml")
-for fichero in laiml:
-    k.learn(str(fichero))
-k.saveBrain("alisochka.brn")
+if __name__ == "__main__":
+    start = time.time()
+    # Parse the AIML files of all the bots at once, in a pool of worker
+    # processes.  Each brain is put together in file order (the last
+    # definition of a category wins) as soon as its files are parsed.
+    # A brain that was built before is only updated with the files that
+    # changed since, according to its manifest.
+    pool = multiprocessing.Pool()
+    jobs = []
+    for bot in BOTS:
+        brainFile, manifestFile = bot + ".brn", bot + ".manifest"
+        manifest = []
+        if os.path.exists(brainFile):
+            manifest = BrainBuilder.loadManifest(manifestFile)
+        job = BrainBuilder.submitUpdate(pool, sorted(glob.glob(bot + "/*.aiml")), manifest,
+                                        parser="expat")
+        jobs.append((bot, manifest, job))
+    for bot, manifest, job in jobs:
+        k = Kernel()
+        if manifest:
+            k.loadBrain(bot + ".brn")
+        newManifest, report = BrainBuilder.mergeUpdate(k, job)
+        if newManifest == manifest:
+            print("%s.brn is up to date" % bot)
+            continue
+        compileBrain(k, bot + ".brn", BOT_NAMES.get(bot))
+        BrainBuilder.saveManifest(bot + ".manifest", newManifest)
+    pool.close()
+    pool.join()
+    print("All brains built in %.2f seconds" % (time.time() - start))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2008 Sebastian Silva Fundacion FuenteLibre sebastian@fuentelibre.org
+#
+# HablarConSara.activity is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HablarConSara.activity is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HablarConSara.activity.  If not, see <http://www.gnu.org/licenses/>.
+
+# Report the memory used by every brain in this directory, loaded both
+# into the dictionary-based PatternMgr and into the CompiledPatternMgr,
+# and the cost of loading the same brain from the memory-mapped format.
+
+import gc
+import glob
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aiml import BrainFile
+from aiml.PatternMgr import PatternMgr
+from aiml.CompiledPatternMgr import CompiledPatternMgr
+
+
+def measure(cls, filename):
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    brain = cls()
+    brain.restore(filename)
+    elapsed = time.time() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return brain, current, peak, elapsed
+
+
+def main():
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    print("%-16s %-20s %10s %10s %8s" % ("brain", "backend", "resident", "peak", "load"))
+    for filename in sorted(glob.glob("*.brn")):
+        if BrainFile.isBrainFile(filename):
+            mapped = filename
+        else:
+            for cls in (PatternMgr, CompiledPatternMgr):
+                brain, current, peak, elapsed = measure(cls, filename)
+                print("%-16s %-20s %8.1fMB %8.1fMB %7.2fs" % (
+                    filename, cls.__name__, current / 1048576.0, peak / 1048576.0, elapsed))
+            fd, mapped = tempfile.mkstemp(suffix=".brn")
+            os.close(fd)
+            brain.saveMapped(mapped)
+            del brain
+        try:
+            brain, current, peak, elapsed = measure(CompiledPatternMgr, mapped)
+            print("%-16s %-20s %8.1fMB %8.1fMB %7.3fs" % (
+                filename, "mapped", current / 1048576.0, peak / 1048576.0, elapsed))
+            # Decoding a template on its first match is what makes the
+            # resident memory grow.
+            brain.match(u"HELLO", u"", u"")
+            brain.match(u"WHAT IS YOUR NAME", u"", u"")
+            gc.collect()
+            print("%-16s %-20s %d of %d templates decoded after two matches" % (
+                "", "", brain._templates.numDecoded(), len(brain._templates)))
+            del brain
+        finally:
+            if mapped != filename:
+                os.remove(mapped)
+
+
+if __name__ == '__main__':
+    main()
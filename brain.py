@@ -19,16 +19,22 @@
 #     License along with HablarConSara.activity.  If not, see
 #     <http://www.gnu.org/licenses/>.
 
+import collections
+import gc
+import glob
+import os
+import threading
 import time
 from gettext import gettext as _
 
-from gi.repository import Gdk
 from gi.repository import GLib
 from gi.repository import Gio
 
 from sugar3 import profile
+from sugar3.activity.activity import get_activity_root
 
 from aiml.Kernel import Kernel
+from aiml import BrainFile
 import voice
 
 import logging
@@ -50,10 +56,17 @@ def get_mem_info(tag):
     return int([i for i in meminfo if i.startswith(tag)][0].split()[1])
 
 
+def _get_mem_free():
+    return get_mem_info('MemFree:') + get_mem_info('Cached:')
+
+
+# memory thresholds, in kB
+_RESTRICTED_MEM_TOTAL = 524288
+_MIN_MEM_FREE = 102400
+
 # load Standard AIML set for restricted systems
-if get_mem_info('MemTotal:') < 524288:
-    mem_free = get_mem_info('MemFree:') + get_mem_info('Cached:')
-    if mem_free < 102400:
+if get_mem_info('MemTotal:') < _RESTRICTED_MEM_TOTAL:
+    if _get_mem_free() < _MIN_MEM_FREE:
         BOTS[_('English')]['brain'] = None
     else:
         BOTS[_('English')]['brain'] = 'bot/alisochka.brn'
@@ -61,6 +74,47 @@ if get_mem_info('MemTotal:') < 524288:
 
 _kernel = None
 _kernel_voice = None
+_kernels = collections.OrderedDict()    # brain file -> Kernel, least
+                                        # recently used first
+_loader = None      # the thread loading a brain, if any
+_queued = []        # (text, callback) pairs ask()ed while loading
+
+
+def _max_kernels():
+    """Return how many bots may stay loaded: all of them, unless memory
+    is short by the thresholds above."""
+    if get_mem_info('MemTotal:') < _RESTRICTED_MEM_TOTAL or \
+            _get_mem_free() < _MIN_MEM_FREE:
+        return 1
+    return len(BOTS)
+
+
+def _use_kernel(brain_file, kernel, voice):
+    """Make kernel, loaded from brain_file, answer from now on, and keep
+    it loaded for later, evicting the bots used least recently if there
+    are too many."""
+    global _kernel
+    global _kernel_voice
+
+    _kernel = kernel
+    _kernel_voice = voice
+    _kernels.pop(brain_file, None)
+    _kernels[brain_file] = kernel
+    evicted = False
+    while len(_kernels) > _max_kernels():
+        _kernels.popitem(last=False)
+        evicted = True
+    if evicted:
+        # the evicted brains go away with their kernels
+        Kernel.clearSharedBrains()
+        gc.collect()
+
+
+def _answer_queued():
+    queued = _queued[:]
+    del _queued[:]
+    for text, callback in queued:
+        callback(respond(text))
 
 
 def _get_age():
@@ -84,6 +138,93 @@ def get_default_voice():
         return default_voice
 
 
+def _cached_brain_file(brain_file):
+    """Return the path of the mapped copy of brain_file kept in the data
+    directory of the activity, which every Speak instance of the user
+    shares."""
+    return os.path.join(get_activity_root(), 'data', 'brains',
+                        os.path.basename(brain_file))
+
+
+def _is_fresh(cached_file, brain_file):
+    try:
+        cached_time = os.path.getmtime(cached_file)
+    except OSError:
+        return False
+    try:
+        return cached_time >= os.path.getmtime(brain_file)
+    except OSError:
+        return True
+
+
+def _save_cached_brain(kernel, cached_file):
+    """Save the brain of kernel as the mapped brain file cached_file.  The
+    file is written under another name first, so that other instances
+    never map it half-written."""
+    try:
+        if not os.path.isdir(os.path.dirname(cached_file)):
+            os.makedirs(os.path.dirname(cached_file))
+        temp_file = '%s.%d' % (cached_file, os.getpid())
+        kernel.internTemplates()
+        kernel.saveBrain(temp_file, mapped=True)
+        os.rename(temp_file, cached_file)
+    except (IOError, OSError) as e:
+        logger.warning('Cannot cache brain in %s (%s)' % (cached_file, e))
+        return False
+    return True
+
+
+def _load_brain_file(kernel, brain_file, progress=None):
+    """Load brain_file into kernel.  If it is missing, damaged or was
+    written by an incompatible Python, rebuild the brain from the AIML
+    files it was made of (bot/<name>/*.aiml) instead, raising IOError if
+    there are none.  progress, if given, is called with (bytes_read,
+    total_bytes) along the way.
+
+    Brains are loaded from mapped brain files, shared by the kernels of
+    this process, and whose pages are shared by all the Speak instances
+    that map them.  A brain file of another kind, or a brain rebuilt
+    from AIML, is saved once as a mapped copy in the activity's data
+    directory, which later loads (in any instance) use instead."""
+    cached_file = _cached_brain_file(brain_file)
+    candidates = [brain_file]
+    if _is_fresh(cached_file, brain_file):
+        candidates.insert(0, cached_file)
+    for candidate in candidates:
+        try:
+            BrainFile.validate(candidate)
+            kernel.loadBrain(candidate, progress, shared=True)
+        except (IOError, OSError, EOFError, ValueError, TypeError,
+                BrainFile.BrainFileError) as e:
+            # old plain marshal files can't be validated before loading
+            logger.warning('Cannot load brain %s (%s)' % (candidate, e))
+            continue
+        if not BrainFile.isBrainFile(candidate) and \
+                _save_cached_brain(kernel, cached_file):
+            kernel.loadBrain(cached_file, shared=True)
+        return
+
+    logger.warning('Rebuilding brain %s from AIML' % brain_file)
+    kernel.resetBrain()
+    aiml_dir = os.path.splitext(brain_file)[0]
+    aiml_files = sorted(glob.glob(os.path.join(aiml_dir, '*.aiml')))
+    if not aiml_files:
+        raise IOError('No AIML files in %s to rebuild brain %s from'
+                      % (aiml_dir, brain_file))
+    total = sum(os.path.getsize(f) for f in aiml_files)
+    done = 0
+    for aiml_file in aiml_files:
+        kernel.learn(aiml_file, parser='expat')
+        done += os.path.getsize(aiml_file)
+        if progress is not None:
+            progress(done, total)
+    # An empty brain must not be cached: it would be preferred over the
+    # brain file on every later load.
+    if kernel.numCategories() == 0:
+        raise IOError('No categories in the AIML files of %s' % brain_file)
+    if _save_cached_brain(kernel, cached_file):
+        kernel.loadBrain(cached_file, shared=True)
+
 def respond(text):
     if _kernel is not None:
         text = _kernel.respond(text)
@@ -92,49 +233,32 @@ def respond(text):
     return text
 
 
-def load(activity, voice, sorry=None):
-    old_cursor = activity.get_window().get_cursor()
-    activity.get_window().set_cursor(Gdk.Cursor(Gdk.CursorType.WATCH))
+def ask(text, callback):
+    """Pass the response to text to callback: right away, or, while a
+    brain is loading, once it is loaded."""
+    if _loader is not None:
+        _queued.append((text, callback))
+    else:
+        callback(respond(text))
 
-    def load_brain():
-        global _kernel
-        global _kernel_voice
 
-        is_first_session = _kernel is None
+def load(activity, voice, sorry=None):
+    """Switch to the brain of voice.  Bots used before stay loaded, as
+    memory allows, and are switched to right away.  Otherwise the brain
+    is loaded in a thread, so the main loop keeps running meanwhile: the
+    progress is shown by activity.show_brain_progress(), and the
+    questions ask()ed in the meantime are answered once the brain is
+    ready."""
+    global _loader
 
-        try:
-            if voice.friendlyname in BOTS:
-                brain = BOTS[voice.friendlyname]
-                brain_name = BOTS[voice.friendlyname]['name']
-            else:
-                brain = BOTS[_('English')]
-                brain_name = BOTS[_('English')]['name']
-            logger.debug('Load bot: %s' % brain)
-
-            if voice != _kernel_voice or _kernel is None:
-                kernel = Kernel()
-
-                if brain['brain'] is None:
-                    warning = _("Sorry, there is no free memory to load my "
-                                "brain. Close other activities and try once more.")
-                    activity.face.say_notification(warning)
-                    return
-
-                kernel.loadBrain(brain['brain'])
-                for name, value in list(brain['predicates'].items()):
-                    kernel.setBotPredicate(name, value)
-
-                if _kernel is not None:
-                    del _kernel
-                    _kernel = None
-                    import gc
-                    gc.collect()
-
-                _kernel = kernel
-                _kernel_voice = voice
-        finally:
-            activity.get_window().set_cursor(old_cursor)
+    if voice.friendlyname in BOTS:
+        brain = BOTS[voice.friendlyname]
+    else:
+        brain = BOTS[_('English')]
+    brain_name = brain['name']
+    logger.debug('Load bot: %s' % brain)
 
+    def greet(is_first_session):
         if is_first_session:
             _kernel.respond(_('my name is %s') % (profile.get_nick_name()))
             _kernel.respond(_('I am %d years old') % (_get_age()))
@@ -149,5 +273,67 @@ def load(activity, voice, sorry=None):
         else:
             activity.face.say_notification("Hi again!")
 
-    GLib.idle_add(load_brain)
+    if voice == _kernel_voice and _kernel is not None and _loader is None:
+        GLib.idle_add(greet, False)
+        return True
+
+    if brain['brain'] is None:
+        warning = _("Sorry, there is no free memory to load my "
+                    "brain. Close other activities and try once more.")
+        activity.face.say_notification(warning)
+        return True
+
+    kernel = _kernels.get(brain['brain'])
+    if kernel is not None:
+        # still loaded: switch right away, dropping any load in progress
+        _loader = None
+        activity.show_brain_progress(0.0)
+        _use_kernel(brain['brain'], kernel, voice)
+        greet(False)
+        _answer_queued()
+        return True
+
+    # These run in the main loop; a loader that has been superseded by
+    # a later call to load() is ignored.
+    def show_progress(bytes_read, total_bytes):
+        if loader is _loader:
+            activity.show_brain_progress(
+                float(bytes_read) / total_bytes if total_bytes else 1.0)
+        return False
+
+    def finish(kernel):
+        global _loader
+
+        if loader is not _loader:
+            return False
+        _loader = None
+        activity.show_brain_progress(0.0)
+
+        is_first_session = _kernel is None
+        if kernel is not None:
+            _use_kernel(brain['brain'], kernel, voice)
+            logger.debug('Loaded bot %s: %d categories'
+                         % (brain_name, kernel.numCategories()))
+            greet(is_first_session)
+        _answer_queued()
+        return False
+
+    def load_brain():
+        try:
+            kernel = Kernel()
+            _load_brain_file(
+                kernel, brain['brain'],
+                lambda *args: GLib.idle_add(show_progress, *args))
+            for name, value in list(brain['predicates'].items()):
+                kernel.setBotPredicate(name, value)
+        except Exception:
+            logger.exception('Cannot load brain %s' % brain['brain'])
+            kernel = None
+        GLib.idle_add(finish, kernel)
+
+    loader = threading.Thread(target=load_brain)
+    loader.daemon = True
+    _loader = loader
+    activity.show_brain_progress(0.0)
+    loader.start()
     return True